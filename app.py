@@ -3,15 +3,58 @@ Sistema de Gestão para Clínica de Estética - Versão Básica
 Desenvolvido com Flask + PostgreSQL
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, \
+    Response, stream_template, stream_with_context, send_file, has_request_context, \
+    before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_migrate import Migrate, upgrade as aplicar_migracoes, stamp as marcar_versao_banco
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, date, timedelta
+from decimal import Decimal, InvalidOperation
 import os
 from functools import wraps
 import re
+import io
+import bisect
+import calendar
+import codecs
+import itertools
+import operator
+import queue
+import random
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
+import csv
+import json
+import base64
+import gzip
+import hashlib
+import hmac
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TempoEsgotado
+from html import escape
+import xlsxwriter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import SimpleDocTemplate, Frame, Paragraph, Spacer, Table, TableStyle
+import click
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import text, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -29,7 +72,14 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_recycle': 300,
 }
 
+# Proxies reversos à frente do app (nginx etc.): com eles o IP do cliente vem do X-Forwarded-For
+app.config['PROXY_CONFIAVEIS'] = int(os.getenv('PROXY_CONFIAVEIS', '0'))
+if app.config['PROXY_CONFIAVEIS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_CONFIAVEIS'],
+                            x_proto=app.config['PROXY_CONFIAVEIS'])
+
 db = SQLAlchemy(app)
+migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 
 # ==================== MODELOS DO BANCO DE DADOS ====================
 
@@ -37,10 +87,11 @@ class Usuario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    senha_hash = db.Column(db.String(120), nullable=False)
+    senha_hash = db.Column(db.String(255), nullable=False)
     tipo = db.Column(db.String(20), nullable=False)  # admin, atendente, profissional
     ativo = db.Column(db.Boolean, default=True)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Profissional(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,30 +101,52 @@ class Profissional(db.Model):
     email = db.Column(db.String(120))
     ativo = db.Column(db.Boolean, default=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Paciente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
-    cpf = db.Column(db.String(14), unique=True, nullable=False)
+    nome_normalizado = db.Column(db.String(100), index=True)  # sem acentos/caixa, para busca
+    cpf = db.Column(db.String(14), unique=True, nullable=False)  # apenas dígitos
     data_nascimento = db.Column(db.Date, nullable=False)
     telefone = db.Column(db.String(20))
     gosto_musical = db.Column(db.String(100))
     observacoes = db.Column(db.Text)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_paciente_nome_id', 'nome', 'id'),  # listagem paginada por nome
+    )
+
+class PacienteBuscaToken(db.Model):
+    # Índice invertido por palavra do nome (busca por prefixo sem pg_trgm)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id', ondelete='CASCADE'), primary_key=True)
+    token = db.Column(db.String(100), primary_key=True)
+    
+    __table_args__ = (
+        db.Index('ix_paciente_busca_token_token', 'token', 'paciente_id'),
+    )
 
 class Anamnese(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
-    numero_identificador = db.Column(db.String(20), nullable=False)
+    numero_identificador = db.Column(db.String(20), unique=True, index=True, nullable=False)
     conteudo = db.Column(db.Text)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_anamnese_paciente_criado', 'paciente_id', 'criado_em'),  # ficha do paciente
+    )
 
 class Procedimento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
     valor = db.Column(db.Numeric(10, 2), nullable=False)
+    duracao_minutos = db.Column(db.Integer, nullable=False, default=30, server_default='30')
     ativo = db.Column(db.Boolean, default=True)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
 class Atendimento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -82,10 +155,20 @@ class Atendimento(db.Model):
     data_atendimento = db.Column(db.Date, nullable=False)
     descricao = db.Column(db.Text)
     valor_total = db.Column(db.Numeric(10, 2), default=0)
+    valor_pago = db.Column(db.Numeric(10, 2), nullable=False, default=0, server_default='0')  # soma dos pagamentos
     desconto_valor = db.Column(db.Numeric(10, 2), default=0)
     desconto_percentual = db.Column(db.Numeric(5, 2), default=0)
     status = db.Column(db.String(20), default='pendente')  # pendente, parcial, pago
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_atendimento_data_id', 'data_atendimento', 'id'),  # listagem e totais do dia
+        db.Index('ix_atendimento_status_data', 'status', 'data_atendimento', 'id'),  # filtro por status
+        db.Index('ix_atendimento_paciente_data', 'paciente_id', 'data_atendimento'),
+        db.Index('ix_atendimento_profissional_data', 'profissional_id', 'data_atendimento'),
+        db.Index('ix_atendimento_criado_em', 'criado_em'),  # últimos atendimentos do dashboard
+    )
 
 class AtendimentoProcedimento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -94,15 +177,34 @@ class AtendimentoProcedimento(db.Model):
     quantidade = db.Column(db.Integer, default=1)
     valor_unitario = db.Column(db.Numeric(10, 2), nullable=False)
     valor_total = db.Column(db.Numeric(10, 2), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_atendimento_procedimento_atendimento', 'atendimento_id'),
+        db.Index('ix_atendimento_procedimento_procedimento', 'procedimento_id'),
+    )
 
 class Agendamento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('paciente.id'), nullable=False)
     profissional_id = db.Column(db.Integer, db.ForeignKey('profissional.id'), nullable=False)
+    procedimento_id = db.Column(db.Integer, db.ForeignKey('procedimento.id'))
     data_hora = db.Column(db.DateTime, nullable=False)
+    duracao_minutos = db.Column(db.Integer, nullable=False, default=30, server_default='30')
+    data_hora_fim = db.Column(db.DateTime, nullable=False)  # data_hora + duração, para o teste de sobreposição
     observacoes = db.Column(db.Text)
     status = db.Column(db.String(20), default='agendado')  # agendado, realizado, cancelado
+    serie_id = db.Column(db.String(32))  # ocorrências de uma série recorrente (pacote de sessões)
+    recorrencia = db.Column(db.String(20))  # semanal, quinzenal, mensal
+    serie_ordem = db.Column(db.Integer)  # número da sessão na série
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_agendamento_data_hora', 'data_hora'),  # agenda do dia
+        db.Index('ix_agendamento_profissional_data_status', 'profissional_id', 'data_hora', 'status'),  # disponibilidade
+        db.Index('ix_agendamento_paciente_data', 'paciente_id', 'data_hora'),
+        db.Index('ix_agendamento_serie_data', 'serie_id', 'data_hora'),  # restante da série
+    )
 
 class Pagamento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -112,13 +214,109 @@ class Pagamento(db.Model):
     data_pagamento = db.Column(db.Date, nullable=False)
     observacoes = db.Column(db.Text)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)    
+    
+    __table_args__ = (
+        db.Index('ix_pagamento_atendimento', 'atendimento_id'),
+        db.Index('ix_pagamento_data', 'data_pagamento'),
+    )
+
+class ResumoFinanceiroDiario(db.Model):
+    # Totais de pagamentos por dia fechado; ver consolidar_resumo_financeiro
+    data = db.Column(db.Date, primary_key=True)
+    profissional_id = db.Column(db.Integer, db.ForeignKey('profissional.id'), primary_key=True)
+    forma_pagamento = db.Column(db.String(50), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class ResumoProcedimentoDiario(db.Model):
+    # Procedimentos realizados por dia e profissional; ver acumular_resumo_procedimentos
+    data = db.Column(db.Date, primary_key=True)
+    procedimento_id = db.Column(db.Integer, db.ForeignKey('procedimento.id'), primary_key=True)
+    profissional_id = db.Column(db.Integer, db.ForeignKey('profissional.id'), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    atendimentos = db.Column(db.Integer, nullable=False, default=0)
+    receita = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class ResumoProfissionalDiario(db.Model):
+    # Atendimentos com procedimentos por dia e profissional: cada atendimento conta uma vez
+    data = db.Column(db.Date, primary_key=True)
+    profissional_id = db.Column(db.Integer, db.ForeignKey('profissional.id'), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    atendimentos = db.Column(db.Integer, nullable=False, default=0)
+    receita = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class Contador(db.Model):
+    # Numeração sequencial sem lacunas (ex.: anamnese); ver proximo_valor_contador
+    nome = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
 
 # ==================== DECORADORES ====================
 
+# Usuários logados guardados por processo; o TTL limita quanto tempo uma desativação leva para valer
+app.config['USUARIOS_CACHE_TTL'] = int(os.getenv('USUARIOS_CACHE_TTL', '15'))
+app.config['USUARIOS_CACHE_ITENS'] = int(os.getenv('USUARIOS_CACHE_ITENS', '256'))
+
+UsuarioLogado = namedtuple('UsuarioLogado', 'id username email tipo ativo')
+
+_usuarios_cache = OrderedDict()
+_usuarios_lock = threading.Lock()
+
+def _buscar_usuario_logado(usuario_id):
+    """Registro imutável do usuário, lido do cache ou do banco (None se não existir)"""
+    agora = time.monotonic()
+    with _usuarios_lock:
+        item = _usuarios_cache.get(usuario_id)
+        if item is not None and item[0] > agora:
+            _usuarios_cache.move_to_end(usuario_id)
+            return item[1]
+    
+    linha = db.session.execute(
+        db.select(*(getattr(Usuario, campo) for campo in UsuarioLogado._fields)).where(Usuario.id == usuario_id)
+    ).first()
+    if linha is None:
+        return None
+    
+    usuario = UsuarioLogado(*linha)
+    with _usuarios_lock:
+        _usuarios_cache[usuario_id] = (agora + app.config['USUARIOS_CACHE_TTL'], usuario)
+        _usuarios_cache.move_to_end(usuario_id)
+        while len(_usuarios_cache) > app.config['USUARIOS_CACHE_ITENS']:
+            _usuarios_cache.popitem(last=False)
+    return usuario
+
+def usuario_logado():
+    """Usuário ativo da sessão, carregado no máximo uma vez por requisição (None se não houver)"""
+    if '_usuario_logado' not in g:
+        usuario = _buscar_usuario_logado(session['user_id']) if 'user_id' in session else None
+        g._usuario_logado = usuario if usuario is not None and usuario.ativo else None
+    return g._usuario_logado
+
+def invalidar_usuario(usuario_id):
+    """Descarta o usuário do cache deste processo"""
+    with _usuarios_lock:
+        _usuarios_cache.pop(usuario_id, None)
+
+@event.listens_for(Usuario, 'after_update')
+@event.listens_for(Usuario, 'after_delete')
+def _invalidar_usuario_alterado(mapper, connection, usuario):
+    invalidar_usuario(usuario.id)
+
+def _validar_sessao():
+    """Confere a sessão com o usuário atual: desativado ou removido perde a sessão"""
+    usuario = usuario_logado()
+    if usuario is None:
+        session.clear()
+    elif session.get('user_type') != usuario.tipo:
+        # O menu usa o tipo da sessão: acompanha mudanças feitas pelo administrador
+        session['user_type'] = usuario.tipo
+    return usuario
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if _validar_sessao() is None:
+            if request.path.startswith('/api/'):
+                return jsonify({'erro': 'Autenticação necessária'}), 401
             return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
@@ -126,10 +324,10 @@ def login_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        usuario = _validar_sessao()
+        if usuario is None:
             return redirect(url_for('login'))
-        usuario = Usuario.query.get(session['user_id'])
-        if not usuario or usuario.tipo != 'admin':
+        if usuario.tipo != 'admin':
             flash('Acesso negado. Apenas administradores podem acessar esta área.', 'error')
             return redirect(url_for('dashboard'))
         return f(*args, **kwargs)
@@ -137,26 +335,32 @@ def admin_required(f):
 
 # ==================== FUNÇÕES UTILITÁRIAS ====================
 
+_NAO_DIGITOS = re.compile(r'[^0-9]')
+_PESOS_CPF_1 = range(10, 1, -1)
+_PESOS_CPF_2 = range(11, 1, -1)
+
+def normalizar_cpfs(cpfs):
+    """Mantém só os dígitos de cada CPF; números (células de planilha) perdem os zeros à esquerda"""
+    return [f'{int(cpf):011d}' if isinstance(cpf, (int, float)) else _NAO_DIGITOS.sub('', str(cpf or ''))
+            for cpf in cpfs]
+
+def cpfs_validos(cpfs):
+    """Valida uma lista de CPFs já normalizados (só dígitos), sem regex por registro"""
+    resultado = []
+    for cpf in cpfs:
+        if len(cpf) != 11 or cpf == cpf[0] * 11:
+            resultado.append(False)
+            continue
+        digitos = [ord(caractere) - 48 for caractere in cpf]
+        primeiro = sum(map(operator.mul, digitos, _PESOS_CPF_1)) * 10 % 11 % 10
+        segundo = sum(map(operator.mul, digitos, _PESOS_CPF_2)) * 10 % 11 % 10
+        resultado.append(digitos[9] == primeiro and digitos[10] == segundo)
+    return resultado
+
 def validar_cpf(cpf):
     """Valida CPF removendo caracteres especiais"""
     cpf = re.sub(r'[^0-9]', '', cpf)
-    if len(cpf) != 11:
-        return False
-    
-    # Verifica se todos os dígitos são iguais
-    if cpf == cpf[0] * 11:
-        return False
-    
-    # Validação dos dígitos verificadores
-    def calcular_digito(cpf_base):
-        soma = sum(int(cpf_base[i]) * (len(cpf_base) + 1 - i) for i in range(len(cpf_base)))
-        resto = soma % 11
-        return 0 if resto < 2 else 11 - resto
-    
-    primeiro_digito = calcular_digito(cpf[:9])
-    segundo_digito = calcular_digito(cpf[:10])
-    
-    return cpf[-2:] == f"{primeiro_digito}{segundo_digito}"
+    return cpfs_validos([cpf])[0]
 
 def formatar_cpf(cpf):
     """Formata CPF para exibição"""
@@ -168,6 +372,947 @@ def calcular_idade(data_nascimento):
     hoje = date.today()
     return hoje.year - data_nascimento.year - ((hoje.month, hoje.day) < (data_nascimento.month, data_nascimento.day))
 
+def para_decimal(valor):
+    """Converte texto do formulário em Decimal com 2 casas (ValueError se inválido)"""
+    try:
+        return Decimal(str(valor).strip().replace(',', '.')).quantize(Decimal('0.01'))
+    except (InvalidOperation, AttributeError):
+        raise ValueError(f'Valor inválido: {valor}')
+
+def intervalo_periodo(referencia, periodo='dia'):
+    """Retorna (início, fim) semiaberto do dia, semana (seg-dom) ou mês que contém a data"""
+    if isinstance(referencia, datetime):
+        referencia = referencia.date()
+    
+    if periodo == 'dia':
+        inicio = referencia
+        fim = inicio + timedelta(days=1)
+    elif periodo == 'semana':
+        inicio = referencia - timedelta(days=referencia.weekday())
+        fim = inicio + timedelta(days=7)
+    elif periodo == 'mes':
+        inicio = referencia.replace(day=1)
+        fim = (inicio + timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f'Período inválido: {periodo}')
+    
+    return inicio, fim
+
+def filtro_periodo(coluna, referencia, periodo='dia'):
+    """Filtro coluna >= início AND coluna < fim, que aproveita o índice da coluna.
+    
+    Substitui func.date(coluna) == dia, que obriga a varrer a tabela inteira.
+    Em colunas DateTime os limites são meia-noite do início e do fim do período.
+    """
+    inicio, fim = intervalo_periodo(referencia, periodo)
+    if isinstance(coluna.type, db.DateTime):
+        inicio = datetime.combine(inicio, datetime.min.time())
+        fim = datetime.combine(fim, datetime.min.time())
+    return db.and_(coluna >= inicio, coluna < fim)
+
+def periodo_dos_parametros(parametros):
+    """Lê 'inicio' e 'fim' (AAAA-MM-DD) dos parâmetros; padrão: do dia 1 do mês até hoje"""
+    hoje = date.today()
+    try:
+        inicio = datetime.strptime(parametros.get('inicio', ''), '%Y-%m-%d').date()
+    except ValueError:
+        inicio = hoje.replace(day=1)
+    try:
+        fim = datetime.strptime(parametros.get('fim', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fim = hoje
+    return inicio, fim
+
+def travar_contador(nome, valor_inicial=lambda: 0):
+    """Trava a linha do contador até o fim da transação e retorna seu valor.
+    
+    O UPDATE trava a linha (lock de linha no PostgreSQL, lock de escrita no
+    SQLite) até o commit ou rollback, serializando quem usa o mesmo contador.
+    valor_inicial() semeia o contador na primeira utilização.
+    """
+    trava = db.update(Contador).where(Contador.nome == nome).values(valor=Contador.valor)
+    
+    if db.session.execute(trava).rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(Contador(nome=nome, valor=valor_inicial()))
+        except IntegrityError:
+            # Outra transação semeou o contador primeiro
+            db.session.execute(trava)
+    
+    return db.session.execute(
+        db.select(Contador.valor).where(Contador.nome == nome)
+    ).scalar_one()
+
+def proximo_valor_contador(nome, valor_inicial=lambda: 0):
+    """Incrementa e retorna o contador na transação atual.
+    
+    Como a linha fica travada até o commit, alocações concorrentes são
+    serializadas e um rollback devolve o número: não há duplicatas nem lacunas.
+    """
+    valor = travar_contador(nome, valor_inicial) + 1
+    db.session.execute(db.update(Contador).where(Contador.nome == nome).values(valor=valor))
+    return valor
+
+def gerar_numero_anamnese():
+    """Aloca o próximo número identificador de anamnese (ANMxxxxx)"""
+    # Números antigos eram MAX(id) + 1, nunca maiores que o maior id existente
+    numero = proximo_valor_contador(
+        'anamnese',
+        lambda: db.session.execute(db.select(db.func.coalesce(db.func.max(Anamnese.id), 0))).scalar()
+    )
+    return f"ANM{numero:05d}"
+
+@app.cli.command('testar-numeracao')
+@click.option('--threads', 'quantidade_threads', default=8, show_default=True, help='Transações concorrentes')
+@click.option('--por-thread', default=25, show_default=True, help='Números alocados por thread')
+@click.option('--rollback-a-cada', default=4, show_default=True, help='Desfaz uma alocação a cada N (0 = nunca)')
+def testar_numeracao_command(quantidade_threads, por_thread, rollback_a_cada):
+    """Confere sob concorrência que proximo_valor_contador não gera duplicatas nem lacunas.
+
+    Usa um contador próprio (removido ao final), então a numeração real das
+    anamneses não é tocada. Rode contra o banco de produção (PostgreSQL) para
+    validar o lock de linha. Sai com código 1 se houver duplicata ou lacuna.
+    """
+    nome = f'teste-numeracao-{os.getpid()}'
+    confirmados = []
+    erros = []
+    trava = threading.Lock()
+
+    def alocar(indice_thread):
+        with app.app_context():
+            for indice in range(por_thread):
+                try:
+                    numero = proximo_valor_contador(nome)
+                    # Segura a trava um pouco para as outras transações esperarem por ela
+                    time.sleep(random.uniform(0, 0.005))
+                    if rollback_a_cada and (indice_thread * por_thread + indice) % rollback_a_cada == 0:
+                        db.session.rollback()
+                        continue
+                    db.session.commit()
+                    with trava:
+                        confirmados.append(numero)
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    with trava:
+                        erros.append(str(e).splitlines()[0])
+
+    cronometro = time.perf_counter()
+    threads = [threading.Thread(target=alocar, args=(indice,)) for indice in range(quantidade_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    segundos = time.perf_counter() - cronometro
+
+    final = db.session.execute(db.select(Contador.valor).where(Contador.nome == nome)).scalar()
+    db.session.execute(db.delete(Contador).where(Contador.nome == nome))
+    db.session.commit()
+
+    duplicatas = len(confirmados) - len(set(confirmados))
+    esperado = list(range(1, len(confirmados) + 1))
+    sem_lacunas = sorted(confirmados) == esperado and (final or 0) == len(confirmados)
+    print(f"{len(confirmados)} número(s) confirmado(s) em {segundos:.2f}s no {db.engine.dialect.name}, "
+          f"contador final {final}, {len(erros)} transação(ões) com erro")
+    for erro in sorted(set(erros)):
+        print(f"   {erro}")
+    if duplicatas or not sem_lacunas:
+        faltando = sorted(set(esperado) - set(confirmados))[:10]
+        print(f"❌ {duplicatas} duplicata(s); números faltando: {faltando}")
+        raise SystemExit(1)
+    print("✅ Sem duplicatas nem lacunas")
+
+# ==================== PAGINAÇÃO ====================
+
+def estimar_total(query):
+    """Estimativa barata do total de linhas pelo plano do PostgreSQL.
+    
+    Retorna None nos demais bancos (um COUNT custaria o que a estimativa evita)
+    ou se o EXPLAIN falhar; o savepoint isola a falha sem desfazer a requisição.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    compilado = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+    try:
+        with db.session.begin_nested():
+            plano = db.session.connection().exec_driver_sql(
+                'EXPLAIN (FORMAT JSON) ' + str(compilado), compilado.params
+            ).scalar()
+        return int(plano[0]['Plan']['Plan Rows'])
+    except (SQLAlchemyError, LookupError, TypeError, ValueError):
+        return None
+
+class PaginacaoKeyset:
+    """Paginação por cursor (keyset) sobre uma ordenação única, ex.: (data, id).
+    
+    Cada página filtra a partir da chave do último item visto em vez de usar
+    OFFSET, então o custo não cresce com a profundidade, e não há COUNT: o
+    total só é estimado quando pedido e o banco permite (senão fica None). As páginas alcançáveis são a primeira
+    e as vizinhas da atual, cujos parâmetros de URL vêm de args_pagina().
+    """
+    
+    def __init__(self, query, colunas, chave, cursor=None, direcao='next', page=1,
+                 per_page=20, descendente=False, estimar=False):
+        self.per_page = per_page
+        self.total = estimar_total(query) if estimar else None
+        self.pages = max(1, -(-self.total // per_page)) if self.total is not None else None
+        
+        valores = self._decodificar(cursor, colunas) if cursor else None
+        voltando = valores is not None and direcao == 'prev'
+        crescente = descendente == voltando
+        
+        if valores is not None:
+            chave_sql = db.tuple_(*colunas)
+            cursor_sql = db.tuple_(*valores)
+            query = query.filter(chave_sql > cursor_sql if crescente else chave_sql < cursor_sql)
+        
+        ordem = [coluna.asc() if crescente else coluna.desc() for coluna in colunas]
+        items = query.order_by(None).order_by(*ordem).limit(per_page + 1).all()
+        
+        mais = len(items) > per_page
+        items = items[:per_page]
+        if voltando:
+            items.reverse()
+            self.has_prev, self.has_next = mais, True
+        else:
+            self.has_prev, self.has_next = valores is not None, mais
+        
+        self.items = items
+        self.page = max(page, 2) if self.has_prev else 1
+        self.prev_num = self.page - 1 if self.has_prev else None
+        self.next_num = self.page + 1 if self.has_next else None
+        self.prev_cursor = self._codificar(chave(items[0])) if self.has_prev and items else None
+        self.next_cursor = self._codificar(chave(items[-1])) if self.has_next and items else None
+    
+    @classmethod
+    def vazia(cls, per_page=20):
+        """Paginação sem itens (ex.: tabelas ainda não criadas)"""
+        paginacao = cls.__new__(cls)
+        paginacao.__dict__.update(
+            items=[], per_page=per_page, total=0, pages=1, page=1,
+            has_prev=False, has_next=False, prev_num=None, next_num=None,
+            prev_cursor=None, next_cursor=None
+        )
+        return paginacao
+    
+    def iter_pages(self):
+        """Primeira página, vizinhas e a atual; None marca um salto"""
+        if self.has_prev:
+            if self.prev_num > 1:
+                yield 1
+                if self.prev_num > 2:
+                    yield None
+            yield self.prev_num
+        yield self.page
+        if self.has_next:
+            yield self.next_num
+    
+    def args_pagina(self, num):
+        """Parâmetros de URL para navegar até uma página de iter_pages()"""
+        if num == 1 or num is None:
+            return {}
+        if num == self.prev_num and self.prev_cursor:
+            return {'cursor': self.prev_cursor, 'direcao': 'prev', 'page': num}
+        if num == self.next_num and self.next_cursor:
+            return {'cursor': self.next_cursor, 'page': num}
+        return {}
+    
+    @staticmethod
+    def _codificar(valores):
+        dados = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in valores]
+        return base64.urlsafe_b64encode(json.dumps(dados).encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def _decodificar(cursor, colunas):
+        """Converte o cursor de volta para os tipos das colunas; None se inválido"""
+        try:
+            dados = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if len(dados) != len(colunas):
+                return None
+            valores = []
+            for valor, coluna in zip(dados, colunas):
+                tipo = coluna.type.python_type
+                if tipo in (date, datetime):
+                    valores.append(tipo.fromisoformat(valor))
+                else:
+                    valores.append(tipo(valor))
+            return valores
+        except (ValueError, TypeError):
+            return None
+
+# ==================== BUSCA DE PACIENTES ====================
+
+_busca_trigrama = None  # None = ainda não detectado neste processo
+
+def normalizar_texto(valor):
+    """Remove acentos, pontuação e maiúsculas para indexação de busca"""
+    if not valor:
+        return ''
+    sem_acentos = unicodedata.normalize('NFKD', valor).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', sem_acentos.lower()).split())
+
+def _proximo_prefixo(prefixo):
+    """Menor string maior que todas as que começam com o prefixo"""
+    return prefixo[:-1] + chr(ord(prefixo[-1]) + 1)
+
+def _filtro_prefixo(coluna, prefixo):
+    """Filtro por prefixo em forma de intervalo, atendido por índice btree comum"""
+    return db.and_(coluna >= prefixo, coluna < _proximo_prefixo(prefixo))
+
+def busca_usa_trigrama():
+    """Indica se o banco é PostgreSQL com a extensão pg_trgm instalada"""
+    global _busca_trigrama
+    if _busca_trigrama is None:
+        _busca_trigrama = False
+        if db.engine.dialect.name == 'postgresql':
+            try:
+                _busca_trigrama = db.session.execute(
+                    text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                ).scalar() is not None
+            except Exception:
+                db.session.rollback()
+    return _busca_trigrama
+
+def filtrar_busca_pacientes(query, termo):
+    """Aplica a busca por nome ou CPF usando os índices de busca.
+    
+    Termos só com dígitos (e pontuação de CPF) buscam pelo prefixo do CPF.
+    Os demais buscam no nome normalizado: por trigramas (substring) no
+    PostgreSQL com pg_trgm, ou pelo prefixo de cada palavra nos demais bancos.
+    """
+    digitos = re.sub(r'[^0-9]', '', termo)
+    if digitos and re.fullmatch(r'[0-9.\-\s]+', termo):
+        return query.filter(_filtro_prefixo(Paciente.cpf, digitos))
+    
+    normalizado = normalizar_texto(termo)
+    if not normalizado:
+        return query.filter(db.false())
+    
+    if busca_usa_trigrama():
+        return query.filter(Paciente.nome_normalizado.like(f'%{normalizado}%'))
+    
+    for palavra in normalizado.split():
+        query = query.filter(Paciente.id.in_(
+            db.select(PacienteBuscaToken.paciente_id)
+              .where(_filtro_prefixo(PacienteBuscaToken.token, palavra))
+        ))
+    return query
+
+def _tokens_paciente(paciente_id, nome_normalizado):
+    return [{'paciente_id': paciente_id, 'token': token}
+            for token in sorted(set(nome_normalizado.split()))]
+
+@event.listens_for(Paciente, 'before_insert')
+@event.listens_for(Paciente, 'before_update')
+def _normalizar_nome_paciente(mapper, connection, paciente):
+    paciente.nome_normalizado = normalizar_texto(paciente.nome)
+
+@event.listens_for(Paciente, 'after_insert')
+@event.listens_for(Paciente, 'after_update')
+def _indexar_tokens_paciente(mapper, connection, paciente):
+    historico = db.inspect(paciente).attrs.nome_normalizado.history
+    if not historico.has_changes():
+        return
+    
+    tabela = PacienteBuscaToken.__table__
+    connection.execute(tabela.delete().where(tabela.c.paciente_id == paciente.id))
+    tokens = _tokens_paciente(paciente.id, paciente.nome_normalizado)
+    if tokens:
+        connection.execute(tabela.insert(), tokens)
+
+def configurar_busca_pacientes():
+    """Cria o índice de trigramas no PostgreSQL quando pg_trgm estiver disponível"""
+    global _busca_trigrama
+    if db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_paciente_nome_trgm '
+            'ON paciente USING gin (nome_normalizado gin_trgm_ops)'
+        ))
+        db.session.commit()
+        print("✅ Índice de busca por trigramas configurado")
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ pg_trgm indisponível, busca usará índice de palavras: {str(e)}")
+    _busca_trigrama = None
+
+def reindexar_busca_pacientes(lote=1000):
+    """Recalcula nome normalizado e palavras de busca de todos os pacientes"""
+    tabela = PacienteBuscaToken.__table__
+    ultimo_id = 0
+    total = 0
+    
+    while True:
+        linhas = db.session.execute(
+            db.select(Paciente.id, Paciente.nome, Paciente.nome_normalizado)
+              .where(Paciente.id > ultimo_id)
+              .order_by(Paciente.id).limit(lote)
+        ).all()
+        if not linhas:
+            break
+        
+        ids = [linha.id for linha in linhas]
+        normalizados = [{'id': linha.id, 'nome_normalizado': normalizar_texto(linha.nome)} for linha in linhas]
+        
+        # Só grava o que mudou, para não marcar todos os pacientes como alterados
+        alterados = [item for item, linha in zip(normalizados, linhas)
+                     if item['nome_normalizado'] != linha.nome_normalizado]
+        if alterados:
+            db.session.execute(db.update(Paciente), alterados)
+        db.session.execute(tabela.delete().where(tabela.c.paciente_id.in_(ids)))
+        tokens = [token for item in normalizados
+                  for token in _tokens_paciente(item['id'], item['nome_normalizado'])]
+        if tokens:
+            db.session.execute(tabela.insert(), tokens)
+        db.session.commit()
+        
+        ultimo_id = ids[-1]
+        total += len(ids)
+    
+    return total
+
+@app.cli.command('reindexar-pacientes')
+def reindexar_pacientes_command():
+    """Reconstrói os índices de busca de pacientes"""
+    configurar_busca_pacientes()
+    total = reindexar_busca_pacientes()
+    invalidar_busca_pacientes()
+    print(f"✅ {total} pacientes reindexados")
+
+# Resultados do autocomplete de pacientes guardados por processo
+app.config['BUSCA_PACIENTES_CACHE_ITENS'] = int(os.getenv('BUSCA_PACIENTES_CACHE_ITENS', '500'))
+app.config['BUSCA_PACIENTES_CACHE_TTL'] = int(os.getenv('BUSCA_PACIENTES_CACHE_TTL', '60'))
+
+# Colunas do seletor de pacientes: só o necessário para exibir e escolher
+COLUNAS_SELETOR_PACIENTE = (Paciente.id, Paciente.nome, Paciente.cpf, Paciente.telefone,
+                            Paciente.data_nascimento, Paciente.observacoes)
+
+_busca_pacientes_cache = OrderedDict()
+_busca_pacientes_lock = threading.Lock()
+_busca_pacientes_geracao = 0
+
+def _chave_busca_pacientes(termo):
+    """Normaliza o termo como filtrar_busca_pacientes, para variações baterem no mesmo cache"""
+    digitos = re.sub(r'[^0-9]', '', termo)
+    if digitos and re.fullmatch(r'[0-9.\-\s]+', termo):
+        return ('cpf', digitos)
+    return ('nome', ' '.join(normalizar_texto(termo).split()))
+
+def buscar_pacientes_resumo(termo, limite=10):
+    """Retorna tuplas (id, nome, cpf, telefone, data_nascimento, observacoes) dos pacientes encontrados.
+
+    Consulta só as colunas do seletor, sem montar entidades, e guarda o resultado
+    por alguns segundos. As escritas em pacientes chamam invalidar_busca_pacientes();
+    nos demais workers o TTL limita a defasagem.
+    """
+    chave = _chave_busca_pacientes(termo) + (limite,)
+    agora = time.monotonic()
+
+    with _busca_pacientes_lock:
+        item = _busca_pacientes_cache.get(chave)
+        if item is not None and item[0] > agora:
+            _busca_pacientes_cache.move_to_end(chave)
+            return item[1]
+        geracao = _busca_pacientes_geracao
+
+    consulta = db.session.query(*COLUNAS_SELETOR_PACIENTE)
+    linhas = [tuple(linha) for linha in
+              filtrar_busca_pacientes(consulta, termo).order_by(Paciente.nome, Paciente.id).limit(limite)]
+
+    with _busca_pacientes_lock:
+        # Só armazena se nenhum paciente foi alterado durante a consulta
+        if _busca_pacientes_geracao == geracao:
+            _busca_pacientes_cache[chave] = (agora + app.config['BUSCA_PACIENTES_CACHE_TTL'], linhas)
+            _busca_pacientes_cache.move_to_end(chave)
+            while len(_busca_pacientes_cache) > app.config['BUSCA_PACIENTES_CACHE_ITENS']:
+                _busca_pacientes_cache.popitem(last=False)
+
+    return linhas
+
+def paciente_resumo(paciente_id):
+    """Linha do seletor para um paciente já escolhido (ou None), para reexibir o formulário"""
+    if not paciente_id:
+        return None
+    return db.session.execute(
+        db.select(*COLUNAS_SELETOR_PACIENTE).where(Paciente.id == paciente_id)
+    ).first()
+
+def invalidar_busca_pacientes():
+    """Descarta os resultados do autocomplete após cadastrar, editar ou importar pacientes"""
+    global _busca_pacientes_geracao
+    with _busca_pacientes_lock:
+        _busca_pacientes_cache.clear()
+        _busca_pacientes_geracao += 1
+
+# ==================== CATÁLOGO (PROCEDIMENTOS E PROFISSIONAIS) ====================
+
+# Intervalo (segundos) entre consultas à versão do catálogo, para ver alterações de outros workers
+app.config['CATALOGO_VERIFICAR_SEGUNDOS'] = int(os.getenv('CATALOGO_VERIFICAR_SEGUNDOS', '5'))
+
+ProcedimentoRef = namedtuple('ProcedimentoRef', 'id nome valor duracao_minutos ativo')
+ProfissionalRef = namedtuple('ProfissionalRef', 'id nome especialidade telefone email ativo')
+
+class Catalogo:
+    """Snapshot imutável de procedimentos e profissionais, ordenados por nome"""
+    __slots__ = ('versao', 'procedimentos', 'profissionais', 'procedimentos_ativos', 'profissionais_ativos')
+    
+    def __init__(self, versao, procedimentos, profissionais):
+        self.versao = versao
+        self.procedimentos = procedimentos
+        self.profissionais = profissionais
+        self.procedimentos_ativos = tuple(item for item in procedimentos if item.ativo)
+        self.profissionais_ativos = tuple(item for item in profissionais if item.ativo)
+
+_catalogo = {'snapshot': None, 'verificar_em': 0.0, 'geracao': 0}
+_catalogo_lock = threading.Lock()
+
+def _versao_catalogo():
+    return db.session.execute(
+        db.select(Contador.valor).where(Contador.nome == 'catalogo')
+    ).scalar() or 0
+
+def _carregar_catalogo(versao):
+    procedimentos = db.session.execute(
+        db.select(*(getattr(Procedimento, campo) for campo in ProcedimentoRef._fields))
+          .order_by(Procedimento.nome, Procedimento.id)
+    ).all()
+    profissionais = db.session.execute(
+        db.select(*(getattr(Profissional, campo) for campo in ProfissionalRef._fields))
+          .order_by(Profissional.nome, Profissional.id)
+    ).all()
+    return Catalogo(versao,
+                    tuple(ProcedimentoRef(*linha) for linha in procedimentos),
+                    tuple(ProfissionalRef(*linha) for linha in profissionais))
+
+def obter_catalogo():
+    """Retorna o snapshot do catálogo, recarregando-o só quando a versão muda.
+    
+    A versão fica na tabela de contadores e é consultada no máximo a cada
+    CATALOGO_VERIFICAR_SEGUNDOS; entre uma verificação e outra os formulários
+    e listas não fazem nenhuma consulta. O snapshot é compartilhado entre as
+    requisições e não deve ser alterado.
+    """
+    agora = time.monotonic()
+    with _catalogo_lock:
+        snapshot = _catalogo['snapshot']
+        if snapshot is not None and agora < _catalogo['verificar_em']:
+            return snapshot
+        geracao = _catalogo['geracao']
+    
+    versao = _versao_catalogo()
+    if snapshot is None or snapshot.versao != versao:
+        snapshot = _carregar_catalogo(versao)
+    
+    with _catalogo_lock:
+        # Só armazena se este worker não alterou o catálogo durante a leitura
+        if _catalogo['geracao'] == geracao:
+            _catalogo.update(snapshot=snapshot,
+                             verificar_em=agora + app.config['CATALOGO_VERIFICAR_SEGUNDOS'])
+    return snapshot
+
+def invalidar_catalogo():
+    """Publica uma nova versão do catálogo após alterar procedimentos ou profissionais"""
+    proximo_valor_contador('catalogo')
+    db.session.commit()
+    with _catalogo_lock:
+        _catalogo['snapshot'] = None
+        _catalogo['geracao'] += 1
+
+# ==================== CACHE DE ESTATÍSTICAS ====================
+
+# Tempo (segundos) que o snapshot de estatísticas permanece válido por processo
+app.config['ESTATISTICAS_CACHE_TTL'] = int(os.getenv('ESTATISTICAS_CACHE_TTL', '30'))
+
+_estatisticas_cache = {'dados': None, 'data': None, 'expira_em': 0.0, 'geracao': 0}
+_estatisticas_lock = threading.Lock()
+
+def _consultar_estatisticas(hoje):
+    """Calcula todas as estatísticas do dashboard em uma única consulta agregada"""
+    def contar(modelo, *filtros):
+        return db.select(db.func.count()).select_from(modelo).where(*filtros).scalar_subquery()
+    
+    consulta = db.select(
+        contar(Paciente).label('total_pacientes'),
+        contar(Atendimento).label('total_atendimentos'),
+        contar(Atendimento, Atendimento.data_atendimento == hoje).label('atendimentos_hoje'),
+        contar(Atendimento, Atendimento.status == 'pendente').label('atendimentos_pendentes'),
+        db.select(db.func.coalesce(db.func.sum(Atendimento.valor_total), 0))
+          .where(Atendimento.data_atendimento == hoje)
+          .scalar_subquery().label('valores_hoje'),
+        contar(Agendamento, filtro_periodo(Agendamento.data_hora, hoje)).label('agendamentos_hoje'),
+    )
+    
+    linha = db.session.execute(consulta).one()
+    dados = dict(linha._mapping)
+    dados['valores_hoje'] = float(dados['valores_hoje'] or 0)
+    catalogo = obter_catalogo()
+    dados['total_profissionais'] = len(catalogo.profissionais_ativos)
+    dados['total_procedimentos'] = len(catalogo.procedimentos_ativos)
+    return dados
+
+def obter_estatisticas():
+    """Retorna o snapshot de estatísticas, recalculando quando expirado ou invalidado.
+    
+    O cache é por processo: o TTL limita a defasagem entre workers, e as rotas de
+    escrita chamam invalidar_estatisticas() para que o próprio worker veja a mudança.
+    O dicionário retornado é compartilhado e não deve ser alterado.
+    """
+    hoje = date.today()
+    
+    with _estatisticas_lock:
+        cache = _estatisticas_cache
+        if cache['dados'] is not None and cache['data'] == hoje and time.monotonic() < cache['expira_em']:
+            return cache['dados']
+        geracao = cache['geracao']
+    
+    dados = _consultar_estatisticas(hoje)
+    
+    with _estatisticas_lock:
+        # Só armazena se ninguém invalidou o cache durante a consulta
+        if _estatisticas_cache['geracao'] == geracao:
+            _estatisticas_cache.update(
+                dados=dados,
+                data=hoje,
+                expira_em=time.monotonic() + app.config['ESTATISTICAS_CACHE_TTL']
+            )
+    
+    return dados
+
+def invalidar_estatisticas():
+    """Descarta o snapshot de estatísticas após uma escrita"""
+    with _estatisticas_lock:
+        _estatisticas_cache['dados'] = None
+        _estatisticas_cache['geracao'] += 1
+
+# ==================== PAINEL AO VIVO (SSE) ====================
+
+app.config['PAINEL_RESSINCRONIZAR_SEGUNDOS'] = int(os.getenv('PAINEL_RESSINCRONIZAR_SEGUNDOS', '60'))
+# Cada tela conectada ocupa uma thread do servidor enquanto a página está aberta.
+# Com workers síncronos (gunicorn sem --threads) uma tela prende o worker inteiro:
+# use workers em threads e mantenha o limite abaixo do total de threads por processo
+# (ex.: --threads 64 para 50), deixando folga para as demais requisições.
+app.config['PAINEL_MAX_CONEXOES'] = int(os.getenv('PAINEL_MAX_CONEXOES', '50'))
+
+class PainelAoVivo:
+    """Contadores do dashboard mantidos por eventos e enviados às telas abertas (SSE).
+    
+    As rotas de escrita publicam deltas pequenos ({'atendimentos_hoje': 1, ...})
+    depois do commit. Uma única thread agregadora aplica os deltas aos contadores
+    e repassa o resultado à fila de cada tela conectada. O banco só é consultado
+    quando a primeira tela conecta e a cada PAINEL_RESSINCRONIZAR_SEGUNDOS,
+    não importa quantas telas estejam abertas. Os deltas não saem do processo:
+    um processo sem telas conectadas os descarta, e as telas ligadas a outros
+    workers só veem a mudança na ressincronização seguinte. Telas sem canal
+    (limite atingido, conexão caída) consultam /dashboard/refresh no mesmo ritmo.
+    """
+    
+    def __init__(self):
+        self._entrada = queue.Queue()
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.contadores = None
+        self.versao = 0
+        self._dia = None
+        self._ressincronizar_em = 0.0
+    
+    def publicar(self, tipo, ressincronizar=False, **delta):
+        """Enfileira um evento; não bloqueia nem consulta o banco"""
+        if self._assinantes:
+            self._entrada.put((tipo, delta, ressincronizar))
+    
+    def assinar(self):
+        """Fila de mensagens de uma nova tela, ou None se o limite de conexões foi atingido"""
+        fila = queue.Queue(maxsize=100)
+        with self._lock:
+            if len(self._assinantes) >= app.config['PAINEL_MAX_CONEXOES']:
+                return None
+            self._assinantes.add(fila)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='painel-ao-vivo', daemon=True)
+                self._thread.start()
+        self._entrada.put(('conexao', fila, False))
+        return fila
+    
+    def conectado(self, fila):
+        return fila in self._assinantes
+    
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+    
+    def _executar(self):
+        with app.app_context():
+            while True:
+                try:
+                    evento = self._entrada.get(timeout=5)
+                except queue.Empty:
+                    evento = None
+                try:
+                    self._processar(evento)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"⚠️ Erro no painel ao vivo: {e}")
+                    self.contadores = None
+                finally:
+                    db.session.remove()
+    
+    def _processar(self, evento):
+        with self._lock:
+            assinantes = list(self._assinantes)
+        if not assinantes:
+            self.contadores = None
+            return
+        
+        tipo, dados, ressincronizar = evento or ('ressincronizacao', {}, False)
+        hoje = date.today()
+        if ressincronizar or self.contadores is None or self._dia != hoje \
+                or time.monotonic() >= self._ressincronizar_em:
+            # Os eventos são publicados depois do commit: a consulta já inclui o delta
+            self.contadores = _consultar_estatisticas(hoje)
+            self._dia = hoje
+            self._ressincronizar_em = time.monotonic() + app.config['PAINEL_RESSINCRONIZAR_SEGUNDOS']
+            self._enviar(assinantes, self._mensagem(tipo))
+        elif tipo == 'conexao':
+            # Só a tela que acabou de conectar precisa do estado atual
+            self._enviar([dados], self._mensagem(tipo))
+        elif evento is not None:
+            for chave, valor in dados.items():
+                self.contadores[chave] = self.contadores.get(chave, 0) + valor
+            self._enviar(assinantes, self._mensagem(tipo, dados))
+    
+    def _mensagem(self, tipo, delta=None):
+        self.versao += 1
+        dados = json.dumps({'evento': tipo, 'delta': delta or {}, 'estatisticas': self.contadores})
+        return f'event: estatisticas\nid: {self.versao}\ndata: {dados}\n\n'
+    
+    def _enviar(self, filas, mensagem):
+        for fila in filas:
+            try:
+                fila.put_nowait(mensagem)
+            except queue.Full:
+                # Tela que não consome as mensagens: desconecta, o navegador reconecta
+                self.cancelar(fila)
+
+painel_ao_vivo = PainelAoVivo()
+
+@app.route('/eventos/dashboard')
+@login_required
+def eventos_dashboard():
+    """Canal SSE com os contadores do dashboard"""
+    fila = painel_ao_vivo.assinar()
+    if fila is None:
+        return Response('retry: 60000\n\n', status=503, mimetype='text/event-stream')
+    
+    def gerar():
+        try:
+            yield 'retry: 5000\n\n'
+            while painel_ao_vivo.conectado(fila):
+                try:
+                    yield fila.get(timeout=15)
+                except queue.Empty:
+                    yield ': ping\n\n'  # mantém a conexão aberta em proxies
+        finally:
+            painel_ao_vivo.cancelar(fila)
+    
+    return Response(gerar(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ==================== AUTENTICAÇÃO ====================
+
+# Método/custo do hash de senha; hashes antigos são refeitos no próximo login bem-sucedido
+app.config['SENHA_HASH_METODO'] = os.getenv('SENHA_HASH_METODO', 'pbkdf2:sha256:600000')
+# Hashes calculados ao mesmo tempo, quantos podem esperar na fila e por quanto tempo
+app.config['SENHA_WORKERS'] = int(os.getenv('SENHA_WORKERS', '2'))
+app.config['SENHA_FILA_MAXIMA'] = int(os.getenv('SENHA_FILA_MAXIMA', '16'))
+app.config['SENHA_TIMEOUT_SEGUNDOS'] = int(os.getenv('SENHA_TIMEOUT_SEGUNDOS', '10'))
+# Limite de tentativas de login (token bucket): rajada permitida e tentativas repostas por minuto
+# Falhas do mesmo usuário vindas do mesmo IP
+app.config['LOGIN_RAJADA_USUARIO_IP'] = int(os.getenv('LOGIN_RAJADA_USUARIO_IP', '5'))
+app.config['LOGIN_POR_MINUTO_USUARIO_IP'] = int(os.getenv('LOGIN_POR_MINUTO_USUARIO_IP', '5'))
+# Falhas do usuário somando todos os IPs (senha testada de muitas origens); rajada
+# maior para que bloquear a conta de outra pessoa exija muitas tentativas
+app.config['LOGIN_RAJADA_USUARIO'] = int(os.getenv('LOGIN_RAJADA_USUARIO', '50'))
+app.config['LOGIN_POR_MINUTO_USUARIO'] = int(os.getenv('LOGIN_POR_MINUTO_USUARIO', '10'))
+app.config['LOGIN_RAJADA_IP'] = int(os.getenv('LOGIN_RAJADA_IP', '30'))
+app.config['LOGIN_POR_MINUTO_IP'] = int(os.getenv('LOGIN_POR_MINUTO_IP', '30'))
+
+# O PBKDF2 libera o GIL: poucas threads dedicadas em vez de ocupar as do servidor
+_senhas_executor = ThreadPoolExecutor(max_workers=app.config['SENHA_WORKERS'], thread_name_prefix='senha')
+_senhas_vagas = threading.BoundedSemaphore(app.config['SENHA_WORKERS'] + app.config['SENHA_FILA_MAXIMA'])
+
+def gerar_hash_senha(senha):
+    return generate_password_hash(senha, method=app.config['SENHA_HASH_METODO'])
+
+def _calcular_hash(funcao, *args):
+    """Executa o hash no pool limitado; None se a fila estiver cheia ou a espera estourar"""
+    if not _senhas_vagas.acquire(blocking=False):
+        return None
+    try:
+        futuro = _senhas_executor.submit(funcao, *args)
+    except Exception:
+        _senhas_vagas.release()
+        raise
+    # A vaga só volta quando o hash termina, mesmo que esta requisição desista antes
+    futuro.add_done_callback(lambda _: _senhas_vagas.release())
+    try:
+        return futuro.result(timeout=app.config['SENHA_TIMEOUT_SEGUNDOS'])
+    except TempoEsgotado:
+        return None
+
+def verificar_senha(senha_hash, senha):
+    """True/False conforme a senha confere; None quando o servidor está ocupado"""
+    return _calcular_hash(check_password_hash, senha_hash, senha)
+
+def prefixo_hash_configurado():
+    """Prefixo que o werkzeug grava para SENHA_HASH_METODO, sem calcular nenhum hash.
+    
+    O werkzeug completa o método com os seus padrões (ex.: 'pbkdf2' vira
+    'pbkdf2:sha256:600000'); aqui os mesmos padrões são aplicados ao texto.
+    """
+    metodo, *argumentos = app.config['SENHA_HASH_METODO'].split(':')
+    if metodo == 'pbkdf2':
+        argumentos += ['sha256', DEFAULT_PBKDF2_ITERATIONS][len(argumentos):]
+    elif metodo == 'scrypt' and not argumentos:
+        argumentos = [2 ** 15, 8, 1]
+    return ':'.join(map(str, [metodo, *argumentos]))
+
+def hash_desatualizado(senha_hash):
+    """Indica se o hash foi gerado com método ou custo diferente do configurado"""
+    return senha_hash.split('$', 1)[0] != prefixo_hash_configurado()
+
+class LimiteTentativas:
+    """Token bucket por chave (usuário ou IP), em memória e por processo.
+    
+    Cada chave começa com a rajada cheia; cada tentativa cobrada gasta uma
+    ficha e as fichas voltam continuamente à taxa por minuto. Só as chaves
+    usadas mais recentemente são mantidas.
+    """
+    
+    def __init__(self, config_rajada, config_por_minuto, maximo_chaves=10000):
+        self.config_rajada = config_rajada
+        self.config_por_minuto = config_por_minuto
+        self.maximo_chaves = maximo_chaves
+        self._baldes = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def permitir(self, chave, gastar=True):
+        """Indica se a chave ainda tem ficha; com gastar=False só consulta, sem cobrar"""
+        rajada = app.config[self.config_rajada]
+        por_segundo = app.config[self.config_por_minuto] / 60
+        agora = time.monotonic()
+        
+        with self._lock:
+            fichas, ultimo = self._baldes.pop(chave, (rajada, agora))
+            fichas = min(rajada, fichas + (agora - ultimo) * por_segundo)
+            permitido = fichas >= 1
+            if permitido and gastar:
+                fichas -= 1
+            self._baldes[chave] = (fichas, agora)
+            while len(self._baldes) > self.maximo_chaves:
+                self._baldes.popitem(last=False)
+        return permitido
+    
+    def limpar(self):
+        with self._lock:
+            self._baldes.clear()
+
+limite_login_usuario = LimiteTentativas('LOGIN_RAJADA_USUARIO', 'LOGIN_POR_MINUTO_USUARIO')
+limite_login_usuario_ip = LimiteTentativas('LOGIN_RAJADA_USUARIO_IP', 'LOGIN_POR_MINUTO_USUARIO_IP')
+limite_login_ip = LimiteTentativas('LOGIN_RAJADA_IP', 'LOGIN_POR_MINUTO_IP')
+
+@app.cli.command('testar-login')
+@click.option('--usuario', default='admin', show_default=True, help='Usuário existente (a senha usada é sempre errada)')
+@click.option('--tentativas', default=200, show_default=True, help='Tentativas da enxurrada vinda de um único IP')
+@click.option('--simultaneas', default=60, show_default=True, help='Logins simultâneos de IPs diferentes')
+def testar_login_command(usuario, tentativas, simultaneas):
+    """Teste de carga do login: limite por IP, limite por usuário e pool de hash.
+    
+    As requisições passam pelo cliente de teste do Flask neste processo, então os
+    limites do servidor em execução não são afetados e nenhuma senha é alterada.
+    Sai com código 1 se algum cenário falhar.
+    """
+    def disparar(quantidade, ip_da_tentativa):
+        codigos = []
+        trava = threading.Lock()
+        
+        def tentar(indice):
+            resposta = app.test_client().post(
+                '/login', data={'username': usuario, 'senha': f'senha-errada-{indice}'},
+                environ_base={'REMOTE_ADDR': ip_da_tentativa(indice)})
+            with trava:
+                codigos.append(resposta.status_code)
+        
+        cronometro = time.perf_counter()
+        threads = [threading.Thread(target=tentar, args=(indice,)) for indice in range(quantidade)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        contagem = {codigo: codigos.count(codigo) for codigo in sorted(set(codigos))}
+        return contagem, time.perf_counter() - cronometro
+    
+    def conferir(nome, ok, detalhes):
+        print(f"{'✅' if ok else '❌'} {nome}: {detalhes}")
+        return ok
+    
+    def falhas_seguidas(nome, limite, ip_da_tentativa):
+        # Tenta até o primeiro 429; as fichas repostas durante o teste também valem
+        rajada, por_minuto = app.config[limite.config_rajada], app.config[limite.config_por_minuto]
+        cronometro = time.perf_counter()
+        recusadas = 0
+        while recusadas <= 2 * rajada + 10 and disparar(1, lambda _: ip_da_tentativa(recusadas))[0] == {200: 1}:
+            recusadas += 1
+        repostas = int((time.perf_counter() - cronometro) * por_minuto / 60) + 1
+        resultados.append(conferir(
+            nome, rajada <= recusadas <= rajada + repostas,
+            f'{recusadas} falha(s) até o 429 (rajada {rajada}, até {repostas} reposta(s) em '
+            f'{time.perf_counter() - cronometro:.1f}s)'))
+    
+    def limpar_limites():
+        limite_login_ip.limpar()
+        limite_login_usuario.limpar()
+        limite_login_usuario_ip.limpar()
+    
+    limpar_limites()
+    resultados = []
+    
+    # 1. Enxurrada de um IP: só a rajada do IP chega ao hash, o resto recebe 429 na hora
+    contagem, segundos = disparar(tentativas, lambda indice: '203.0.113.1')
+    hashes = contagem.get(200, 0) + contagem.get(302, 0)
+    resultados.append(conferir(
+        'enxurrada de um IP', hashes <= app.config['LOGIN_RAJADA_IP'] and 500 not in contagem,
+        f'{contagem} em {segundos:.2f}s, {hashes} verificação(ões) de senha'))
+    
+    # 2. Falhas seguidas do mesmo usuário e IP: bloqueado após a rajada do par usuário/IP
+    limpar_limites()
+    falhas_seguidas('falhas seguidas do usuário no mesmo IP', limite_login_usuario_ip,
+                    lambda indice: '198.51.100.7')
+    
+    # 3. Essas falhas não bloqueiam o mesmo usuário vindo de outro IP
+    contagem, _ = disparar(1, lambda indice: '198.51.100.8')
+    resultados.append(conferir('usuário em outro IP', contagem == {200: 1}, f'{contagem}'))
+    
+    # 4. Pool de hash cheio: quem não cabe na fila recebe 503 sem esperar
+    limpar_limites()
+    contagem, segundos = disparar(simultaneas, lambda indice: f'10.0.{indice // 250}.{indice % 250 + 1}')
+    capacidade = app.config['SENHA_WORKERS'] + app.config['SENHA_FILA_MAXIMA']
+    resultados.append(conferir(
+        'pool de hash cheio',
+        500 not in contagem and 429 not in contagem and (simultaneas <= capacidade or 503 in contagem),
+        f'{contagem} em {segundos:.2f}s (capacidade {capacidade})'))
+    
+    # 5. Senhas testadas contra o usuário a partir de muitos IPs: bloqueado após a rajada do usuário
+    limpar_limites()
+    falhas_seguidas('falhas do usuário de IPs diferentes', limite_login_usuario,
+                    lambda indice: f'192.0.2.{indice % 250 + 1}')
+    
+    limpar_limites()
+    if not all(resultados):
+        raise SystemExit(1)
+
 # ==================== ROTAS PRINCIPAIS ====================
 
 @app.route('/')
@@ -182,15 +1327,45 @@ def login():
         username = request.form['username']
         senha = request.form['senha']
         
-        usuario = Usuario.query.filter_by(username=username, ativo=True).first()
+        # Recusa enxurradas antes de gastar qualquer hash. Toda tentativa conta para o IP;
+        # os limites do usuário (por IP e somando todos os IPs) só são cobrados em falhas,
+        # e o de todos os IPs tem rajada maior, para ser difícil bloquear o login alheio
+        chave_usuario = username.strip().lower()
+        chave_usuario_ip = (chave_usuario, request.remote_addr)
+        if not (limite_login_ip.permitir(request.remote_addr)
+                and limite_login_usuario_ip.permitir(chave_usuario_ip, gastar=False)
+                and limite_login_usuario.permitir(chave_usuario, gastar=False)):
+            flash('Muitas tentativas de login. Aguarde um minuto e tente novamente.', 'error')
+            return render_template('login.html'), 429
+        
+        credencial = db.session.execute(
+            db.select(Usuario.id, Usuario.senha_hash).where(Usuario.username == username, Usuario.ativo == True)
+        ).first()
+        # Devolve a conexão ao pool enquanto espera o hash
+        db.session.close()
+        senha_correta = verificar_senha(credencial.senha_hash, senha) if credencial else False
+        
+        if senha_correta is None:
+            flash('Servidor ocupado. Tente novamente em alguns segundos.', 'error')
+            return render_template('login.html'), 503
         
-        if usuario and check_password_hash(usuario.senha_hash, senha):
+        if senha_correta:
+            usuario = db.session.get(Usuario, credencial.id)
+            if hash_desatualizado(usuario.senha_hash):
+                novo_hash = _calcular_hash(gerar_hash_senha, senha)
+                if novo_hash:
+                    usuario.senha_hash = novo_hash
+                    db.session.commit()
+            # O login acabou de ler o registro: não reaproveita uma cópia antiga do cache
+            invalidar_usuario(usuario.id)
             session['user_id'] = usuario.id
             session['username'] = usuario.username
             session['user_type'] = usuario.tipo
             flash(f'Bem-vindo, {usuario.username}!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            limite_login_usuario_ip.permitir(chave_usuario_ip)
+            limite_login_usuario.permitir(chave_usuario)
             flash('Usuário ou senha inválidos!', 'error')
     
     return render_template('login.html')
@@ -204,25 +1379,15 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    hoje = date.today()
-    
-    # Estatísticas básicas
-    total_pacientes = Paciente.query.count()
-    total_profissionais = Profissional.query.filter_by(ativo=True).count()
-    total_procedimentos = Procedimento.query.filter_by(ativo=True).count()
+    # Estatísticas (snapshot compartilhado, ver obter_estatisticas)
+    try:
+        stats = obter_estatisticas()
+    except Exception:
+        # Se tabelas não existem ainda
+        db.session.rollback()
+        stats = {}
     
-    # Estatísticas de atendimentos (com tratamento de erro)
     try:
-        total_atendimentos = Atendimento.query.count()
-        atendimentos_hoje = Atendimento.query.filter_by(data_atendimento=hoje).count()
-        
-        # Valores financeiros
-        valores_hoje = db.session.query(db.func.sum(Atendimento.valor_total))\
-                                .filter_by(data_atendimento=hoje).scalar() or 0
-        
-        # Atendimentos pendentes
-        atendimentos_pendentes = Atendimento.query.filter_by(status='pendente').count()
-        
         # Últimos atendimentos
         ultimos_atendimentos = db.session.query(
             Atendimento,
@@ -233,19 +1398,10 @@ def dashboard():
          .order_by(Atendimento.criado_em.desc()).limit(5).all()
         
     except Exception:
-        # Se tabelas não existem ainda
-        total_atendimentos = 0
-        atendimentos_hoje = 0
-        valores_hoje = 0
-        atendimentos_pendentes = 0
         ultimos_atendimentos = []
     
     # Estatísticas de agendamentos (com tratamento de erro)
     try:
-        agendamentos_hoje = Agendamento.query.filter(
-            db.func.date(Agendamento.data_hora) == hoje
-        ).count()
-        
         proximos_agendamentos = db.session.query(
             Agendamento,
             Paciente.nome.label('paciente_nome'),
@@ -257,23 +1413,22 @@ def dashboard():
          .order_by(Agendamento.data_hora).limit(5).all()
         
     except Exception:
-        agendamentos_hoje = 0
         proximos_agendamentos = []
     
     return render_template('dashboard.html',
         # Estatísticas básicas
-        total_pacientes=total_pacientes,
-        total_profissionais=total_profissionais,
-        total_procedimentos=total_procedimentos,
+        total_pacientes=stats.get('total_pacientes', 0),
+        total_profissionais=stats.get('total_profissionais', 0),
+        total_procedimentos=stats.get('total_procedimentos', 0),
         
         # Estatísticas de atendimentos
-        total_atendimentos=total_atendimentos,
-        atendimentos_hoje=atendimentos_hoje,
-        valores_recebidos_hoje=float(valores_hoje),
-        atendimentos_pendentes=atendimentos_pendentes,
+        total_atendimentos=stats.get('total_atendimentos', 0),
+        atendimentos_hoje=stats.get('atendimentos_hoje', 0),
+        valores_recebidos_hoje=stats.get('valores_hoje', 0),
+        atendimentos_pendentes=stats.get('atendimentos_pendentes', 0),
         
         # Estatísticas de agendamentos
-        agendamentos_hoje=agendamentos_hoje,
+        agendamentos_hoje=stats.get('agendamentos_hoje', 0),
         
         # Listas
         ultimos_atendimentos=ultimos_atendimentos,
@@ -286,20 +1441,19 @@ def dashboard():
 @login_required
 def pacientes():
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    direcao = request.args.get('direcao', 'next')
     search = request.args.get('search', '')
     
     query = Paciente.query
     
     if search:
-        query = query.filter(
-            db.or_(
-                Paciente.nome.ilike(f'%{search}%'),
-                Paciente.cpf.ilike(f'%{search}%')
-            )
-        )
+        query = filtrar_busca_pacientes(query, search)
     
-    pacientes = query.order_by(Paciente.nome).paginate(
-        page=page, per_page=20, error_out=False
+    pacientes = PaginacaoKeyset(
+        query, [Paciente.nome, Paciente.id],
+        chave=lambda paciente: (paciente.nome, paciente.id),
+        cursor=cursor, direcao=direcao, page=page, per_page=20
     )
     
     return render_template('pacientes/lista.html', pacientes=pacientes, search=search)
@@ -337,6 +1491,9 @@ def cadastrar_paciente():
         
         db.session.add(paciente)
         db.session.commit()
+        invalidar_estatisticas()
+        invalidar_busca_pacientes()
+        painel_ao_vivo.publicar('paciente', total_pacientes=1)
         
         flash(f'Paciente {nome} cadastrado com sucesso!', 'success')
         
@@ -384,6 +1541,7 @@ def editar_paciente(id):
         paciente.observacoes = observacoes
         
         db.session.commit()
+        invalidar_busca_pacientes()
         
         flash(f'Dados do paciente {nome} atualizados com sucesso!', 'success')
         return redirect(url_for('pacientes'))
@@ -414,12 +1572,10 @@ def ver_paciente(id):
 def procedimentos():
     search = request.args.get('search', '')
     
-    query = Procedimento.query.filter_by(ativo=True)
+    procedimentos = obter_catalogo().procedimentos_ativos
     
     if search:
-        query = query.filter(Procedimento.nome.ilike(f'%{search}%'))
-    
-    procedimentos = query.order_by(Procedimento.nome).all()
+        procedimentos = [item for item in procedimentos if search.lower() in item.nome.lower()]
     
     return render_template('procedimentos/lista.html', procedimentos=procedimentos, search=search)
 
@@ -433,16 +1589,23 @@ def cadastrar_procedimento():
         except ValueError:
             flash('Valor inválido!', 'error')
             return render_template('procedimentos/form.html', dados=request.form)
+        try:
+            duracao = duracao_agendamento(request.form.get('duracao_minutos', type=int))
+        except ValueError as e:
+            flash(f'{e}!', 'error')
+            return render_template('procedimentos/form.html', dados=request.form)
         
         # Verificar se procedimento já existe
         if Procedimento.query.filter_by(nome=nome, ativo=True).first():
             flash('Procedimento já cadastrado!', 'error')
             return render_template('procedimentos/form.html', dados=request.form)
         
-        procedimento = Procedimento(nome=nome, valor=valor)
+        procedimento = Procedimento(nome=nome, valor=valor, duracao_minutos=duracao)
         
         db.session.add(procedimento)
         db.session.commit()
+        invalidar_catalogo()
+        invalidar_estatisticas()
         
         flash(f'Procedimento "{nome}" cadastrado com sucesso!', 'success')
         return redirect(url_for('procedimentos'))
@@ -461,6 +1624,11 @@ def editar_procedimento(id):
         except ValueError:
             flash('Valor inválido!', 'error')
             return render_template('procedimentos/form.html', procedimento=procedimento, dados=request.form)
+        try:
+            duracao = duracao_agendamento(request.form.get('duracao_minutos', type=int))
+        except ValueError as e:
+            flash(f'{e}!', 'error')
+            return render_template('procedimentos/form.html', procedimento=procedimento, dados=request.form)
         
         # Verificar se nome já existe (exceto o atual)
         existente = Procedimento.query.filter(
@@ -475,8 +1643,10 @@ def editar_procedimento(id):
         
         procedimento.nome = nome
         procedimento.valor = valor
+        procedimento.duracao_minutos = duracao
         
         db.session.commit()
+        invalidar_catalogo()
         
         flash(f'Procedimento "{nome}" atualizado com sucesso!', 'success')
         return redirect(url_for('procedimentos'))
@@ -494,8 +1664,7 @@ def nova_anamnese(paciente_id):
         conteudo = request.form['conteudo']
         
         # Gerar número identificador único
-        ultimo_numero = db.session.execute(text("SELECT COALESCE(MAX(id), 0) FROM anamnese")).scalar() or 0
-        numero_identificador = f"ANM{(ultimo_numero + 1):05d}"
+        numero_identificador = gerar_numero_anamnese()
         
         anamnese = Anamnese(
             paciente_id=paciente_id,
@@ -532,8 +1701,7 @@ def editar_anamnese(id):
         
         # Se clicou em "Salvar como", cria nova anamnese
         if 'salvar_como' in request.form:
-            novo_numero = db.session.execute(text("SELECT COALESCE(MAX(id), 0) FROM anamnese")).scalar() or 0
-            numero_identificador = f"ANM{(novo_numero + 1):05d}"
+            numero_identificador = gerar_numero_anamnese()
             
             nova_anamnese = Anamnese(
                 paciente_id=anamnese.paciente_id,
@@ -606,7 +1774,7 @@ def criar_usuario_admin():
             admin = Usuario(
                 username='admin',
                 email='admin@clinica.com',
-                senha_hash=generate_password_hash('admin123'),
+                senha_hash=gerar_hash_senha('admin123'),
                 tipo='admin'
             )
             db.session.add(admin)
@@ -617,6 +1785,14 @@ def criar_usuario_admin():
     except Exception as e:
         print(f"❌ Erro ao criar usuário admin: {str(e)}")
 
+def migrar_banco():
+    """Aplica as migrações pendentes (Flask-Migrate)"""
+    tabelas = db.inspect(db.engine).get_table_names()
+    if 'paciente' in tabelas and 'alembic_version' not in tabelas:
+        # Banco criado com db.create_all() antes das migrações existirem
+        marcar_versao_banco(revision='0001')
+    aplicar_migracoes()
+
 def criar_tabelas():
     """Cria todas as tabelas do banco de dados"""
     with app.app_context():
@@ -635,8 +1811,12 @@ def criar_tabelas():
                 print("❌ Usuário sem permissões suficientes.")
                 return False
             
-            print("🔄 Criando tabelas...")
-            db.create_all()
+            print("🔄 Aplicando migrações...")
+            migrar_banco()
+            configurar_busca_pacientes()
+            configurar_agenda_sem_sobreposicao()
+            if db.session.query(Paciente.id).filter(Paciente.nome_normalizado.is_(None)).first():
+                print(f"✅ {reindexar_busca_pacientes()} pacientes indexados para busca")
             
             print("🔄 Configurando usuário administrador...")
             criar_usuario_admin()
@@ -658,75 +1838,355 @@ def utility_processor():
         timedelta=timedelta
     )
 
-# ==================== ROTAS DE TESTE ====================
-
-@app.route('/test')
-def test():
-    """Rota de teste para verificar se tudo está funcionando"""
-    return jsonify({
-        'status': 'OK',
-        'message': 'Sistema funcionando!',
-        'database': 'Conectado' if testar_conexao_banco() else 'Erro',
-        'tables': [table.name for table in db.metadata.tables.values()]
-    })
-
-# ==================== MÓDULO DE ATENDIMENTOS ====================
+# ==================== CONCILIAÇÃO DE PAGAMENTOS ====================
 
-@app.route('/atendimentos')
+def reconciliar_valores_pagos():
+    """Recalcula valor_pago e status de todos os atendimentos a partir dos pagamentos.
+    
+    Executa um único UPDATE com subconsulta correlacionada; retorna quantos
+    atendimentos estavam divergentes antes da correção.
+    """
+    soma_pagamentos = db.select(db.func.coalesce(db.func.sum(Pagamento.valor), 0))\
+                        .where(Pagamento.atendimento_id == Atendimento.id)\
+                        .scalar_subquery()
+    
+    divergentes = db.session.execute(
+        db.select(db.func.count()).select_from(Atendimento)
+          .where(Atendimento.valor_pago != soma_pagamentos)
+    ).scalar()
+    
+    db.session.execute(
+        db.update(Atendimento).values(
+            valor_pago=soma_pagamentos,
+            status=db.case(
+                (db.and_(soma_pagamentos > 0, soma_pagamentos >= Atendimento.valor_total), 'pago'),
+                (soma_pagamentos > 0, 'parcial'),
+                else_='pendente'
+            )
+        )
+    )
+    db.session.commit()
+    invalidar_estatisticas()
+    return divergentes
+
+@app.cli.command('reconciliar-pagamentos')
+def reconciliar_pagamentos_command():
+    """Recalcula os totais pagos dos atendimentos"""
+    divergentes = reconciliar_valores_pagos()
+    print(f"✅ Totais recalculados ({divergentes} atendimentos estavam divergentes)")
+
+# ==================== DIAGNÓSTICO DE CONSULTAS ====================
+
+def consultas_das_rotas():
+    """Consultas representativas de cada rota, com parâmetros de exemplo"""
+    hoje = date.today()
+    agora = datetime.now()
+    
+    return {
+        'dashboard (últimos atendimentos)': db.select(Atendimento.id, Paciente.nome, Profissional.nome)
+            .join(Paciente, Atendimento.paciente_id == Paciente.id)
+            .join(Profissional, Atendimento.profissional_id == Profissional.id)
+            .order_by(Atendimento.criado_em.desc()).limit(5),
+        'dashboard (atendimentos pendentes)': db.select(db.func.count())
+            .select_from(Atendimento).where(Atendimento.status == 'pendente'),
+        'atendimentos (lista por status)': db.select(Atendimento.id)
+            .where(Atendimento.status == 'pendente')
+            .order_by(Atendimento.data_atendimento.desc(), Atendimento.id.desc()).limit(21),
+        'pacientes (lista)': db.select(Paciente.id)
+            .order_by(Paciente.nome, Paciente.id).limit(21),
+        'ver_paciente (anamneses)': db.select(Anamnese.id)
+            .where(Anamnese.paciente_id == 1).order_by(Anamnese.criado_em.desc()),
+        'agendamentos (agenda do dia)': db.select(Agendamento.id)
+            .where(filtro_periodo(Agendamento.data_hora, hoje)).order_by(Agendamento.data_hora),
+        'dashboard (próximos agendamentos)': db.select(Agendamento.id)
+            .where(Agendamento.data_hora >= agora, Agendamento.status == 'agendado')
+            .order_by(Agendamento.data_hora).limit(5),
+        'verificar_disponibilidade': db.select(Agendamento.id)
+            .where(filtro_sobreposicao(1, agora, agora + timedelta(minutes=30))),
+        'novo_pagamento (pagamentos do atendimento)': db.select(Pagamento.valor)
+            .where(Pagamento.atendimento_id == 1),
+    }
+
+# Tabela de cada FROM/JOIN, para acrescentar NOT INDEXED no SQLite
+_TABELA_CONSULTADA = re.compile(r'\b((?:FROM|JOIN) \w+(?: AS \w+)?)')
+
+def explicar_consulta(consulta, sem_indices=False):
+    """Retorna as linhas do plano de execução da consulta.
+    
+    sem_indices=True no SQLite lê as tabelas com NOT INDEXED; no PostgreSQL o
+    equivalente é desligar as varreduras por índice na transação (ver explicar-consultas).
+    """
+    dialeto = db.engine.dialect
+    prefixo = 'EXPLAIN ' if dialeto.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    sql = str(consulta.compile(dialect=dialeto, compile_kwargs={'literal_binds': True}))
+    if sem_indices and dialeto.name == 'sqlite':
+        sql = _TABELA_CONSULTADA.sub(r'\1 NOT INDEXED', sql)
+    linhas = db.session.execute(text(prefixo + sql)).all()
+    return [str(linha[-1]) for linha in linhas]
+
+@app.cli.command('explicar-consultas')
+def explicar_consultas_command():
+    """Mostra o EXPLAIN das consultas das rotas sem e com índices.
+    
+    Nenhum índice é removido: no PostgreSQL as varreduras por índice são
+    desligadas com SET LOCAL numa transação desfeita ao final, no SQLite as
+    tabelas são lidas com NOT INDEXED. Pode rodar com o sistema em uso.
+    """
+    consultas = consultas_das_rotas()
+    
+    if db.engine.dialect.name == 'postgresql':
+        try:
+            for parametro in ('enable_indexscan', 'enable_indexonlyscan', 'enable_bitmapscan'):
+                db.session.execute(text(f'SET LOCAL {parametro} = off'))
+            planos_antes = {nome: explicar_consulta(consulta) for nome, consulta in consultas.items()}
+        finally:
+            db.session.rollback()
+    else:
+        planos_antes = {nome: explicar_consulta(consulta, sem_indices=True) for nome, consulta in consultas.items()}
+    
+    for nome, consulta in consultas.items():
+        print(f"=== {nome} ===")
+        print("-- sem índices")
+        for linha in planos_antes[nome]:
+            print(f"   {linha}")
+        print("-- com índices")
+        for linha in explicar_consulta(consulta):
+            print(f"   {linha}")
+        print()
+
+# ==================== MÉTRICAS POR ROTA ====================
+
+app.config['METRICAS_ATIVAS'] = os.getenv('METRICAS_ATIVAS', '1') == '1'
+# Cabeçalho Server-Timing nas respostas (ferramentas do navegador); sempre ligado em modo debug
+app.config['METRICAS_SERVER_TIMING'] = os.getenv('METRICAS_SERVER_TIMING', '0') == '1'
+# Token para coletores Prometheus em /metrics (Authorization: Bearer); vazio desativa a rota
+app.config['METRICAS_TOKEN'] = os.getenv('METRICAS_TOKEN', '')
+
+# Limites dos histogramas: segundos (os mesmos do cliente Prometheus) e número de consultas
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Histograma:
+    """Contagens por faixa (não acumuladas), soma e total de observações"""
+    __slots__ = ('limites', 'contagens', 'soma', 'total')
+    
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+    
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+    
+    def media(self):
+        return self.soma / self.total if self.total else 0.0
+    
+    def quantil(self, q):
+        """Estimativa por interpolação linear dentro da faixa, como o histogram_quantile"""
+        if not self.total:
+            return 0.0
+        alvo = q * self.total
+        acumulado = 0
+        for indice, quantidade in enumerate(self.contagens):
+            if quantidade and acumulado + quantidade >= alvo:
+                if indice == len(self.limites):
+                    return self.limites[-1]
+                inferior = self.limites[indice - 1] if indice else 0.0
+                return inferior + (self.limites[indice] - inferior) * (alvo - acumulado) / quantidade
+            acumulado += quantidade
+        return self.limites[-1]
+
+class MetricasRotas:
+    """Tempos e consultas SQL por endpoint, acumulados no processo desde a última limpeza"""
+    
+    SERIES = (('requisicao', LIMITES_SEGUNDOS), ('banco', LIMITES_SEGUNDOS),
+              ('render', LIMITES_SEGUNDOS), ('consultas', LIMITES_CONSULTAS))
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.limpar()
+    
+    def limpar(self):
+        with self._lock:
+            self._rotas = {}
+            self.desde = datetime.now()
+    
+    def registrar(self, endpoint, status, requisicao, banco, render, consultas):
+        with self._lock:
+            rota = self._rotas.get(endpoint)
+            if rota is None:
+                rota = self._rotas[endpoint] = {nome: Histograma(limites) for nome, limites in self.SERIES}
+                rota['status'] = {}
+            for nome, valor in (('requisicao', requisicao), ('banco', banco),
+                                ('render', render), ('consultas', consultas)):
+                rota[nome].observar(valor)
+            rota['status'][status] = rota['status'].get(status, 0) + 1
+    
+    def resumo(self):
+        """Uma linha por endpoint, das rotas que mais somam tempo para as que menos somam"""
+        with self._lock:
+            linhas = [{
+                'endpoint': endpoint,
+                'requisicoes': rota['requisicao'].total,
+                'erros': sum(quantidade for status, quantidade in rota['status'].items() if status >= 500),
+                'tempo_total': rota['requisicao'].soma,
+                'media_ms': rota['requisicao'].media() * 1000,
+                'p50_ms': rota['requisicao'].quantil(0.5) * 1000,
+                'p95_ms': rota['requisicao'].quantil(0.95) * 1000,
+                'banco_ms': rota['banco'].media() * 1000,
+                'render_ms': rota['render'].media() * 1000,
+                'consultas': rota['consultas'].media(),
+                'consultas_p95': rota['consultas'].quantil(0.95),
+            } for endpoint, rota in self._rotas.items()]
+        return sorted(linhas, key=lambda linha: linha['tempo_total'], reverse=True)
+    
+    def prometheus(self):
+        """Texto no formato de exposição do Prometheus"""
+        descricoes = {
+            'requisicao': ('clinica_requisicao_segundos', 'Latência das requisições por endpoint'),
+            'banco': ('clinica_banco_segundos', 'Tempo gasto em consultas SQL por requisição'),
+            'render': ('clinica_render_segundos', 'Tempo de renderização de templates por requisição'),
+            'consultas': ('clinica_consultas_sql', 'Consultas SQL por requisição'),
+        }
+        with self._lock:
+            rotas = sorted(self._rotas.items())
+            linhas = []
+            for serie, limites in self.SERIES:
+                nome, ajuda = descricoes[serie]
+                linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} histogram']
+                for endpoint, rota in rotas:
+                    histograma = rota[serie]
+                    acumulado = 0
+                    for limite, quantidade in zip(limites + (float('inf'),), histograma.contagens):
+                        acumulado += quantidade
+                        le = '+Inf' if limite == float('inf') else repr(float(limite))
+                        linhas.append(f'{nome}_bucket{{endpoint="{endpoint}",le="{le}"}} {acumulado}')
+                    linhas.append(f'{nome}_sum{{endpoint="{endpoint}"}} {histograma.soma!r}')
+                    linhas.append(f'{nome}_count{{endpoint="{endpoint}"}} {histograma.total}')
+            linhas += ['# HELP clinica_respostas_total Respostas por endpoint e status',
+                       '# TYPE clinica_respostas_total counter']
+            for endpoint, rota in rotas:
+                for status, quantidade in sorted(rota['status'].items()):
+                    linhas.append(f'clinica_respostas_total{{endpoint="{endpoint}",status="{status}"}} {quantidade}')
+        return '\n'.join(linhas) + '\n'
+
+metricas_rotas = MetricasRotas()
+
+def _metricas_requisicao():
+    """Acumuladores da requisição atual (None fora de requisições, ex.: threads de fundo)"""
+    return g.get('_metricas') if has_request_context() else None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _inicio_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metricas_inicio', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _fim_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info['_metricas_inicio'].pop()
+    metricas = _metricas_requisicao()
+    if metricas is not None:
+        metricas['consultas'] += 1
+        metricas['banco'] += time.perf_counter() - inicio
+
+@event.listens_for(Engine, 'handle_error')
+def _erro_consulta(contexto):
+    # A consulta falhou: after_cursor_execute não vem, descarta o início empilhado
+    if contexto.connection is not None and contexto.connection.info.get('_metricas_inicio'):
+        contexto.connection.info['_metricas_inicio'].pop()
+
+@before_render_template.connect_via(app)
+def _inicio_render(sender, template, context, **extra):
+    metricas = _metricas_requisicao()
+    if metricas is not None:
+        metricas['render_inicio'] = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _fim_render(sender, template, context, **extra):
+    metricas = _metricas_requisicao()
+    if metricas is not None and metricas.get('render_inicio'):
+        # Inclui as consultas feitas durante a renderização (valores preguiçosos dos templates)
+        metricas['render'] += time.perf_counter() - metricas.pop('render_inicio')
+
+@app.before_request
+def _iniciar_metricas():
+    if app.config['METRICAS_ATIVAS']:
+        g._metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'banco': 0.0, 'render': 0.0}
+
+@app.after_request
+def _registrar_metricas(resposta):
+    metricas = g.pop('_metricas', None)
+    if metricas is None:
+        return resposta
+    
+    total = time.perf_counter() - metricas['inicio']
+    metricas_rotas.registrar(request.endpoint or 'sem_rota', resposta.status_code,
+                             total, metricas['banco'], metricas['render'], metricas['consultas'])
+    
+    if app.config['METRICAS_SERVER_TIMING'] or app.debug:
+        resposta.headers['Server-Timing'] = (
+            f'db;dur={metricas["banco"] * 1000:.1f};desc="{metricas["consultas"]} SQL", '
+            f'render;dur={metricas["render"] * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+    return resposta
+
+# ==================== ROTAS DE TESTE ====================
+
+@app.route('/test')
+def test():
+    """Rota de teste para verificar se tudo está funcionando"""
+    return jsonify({
+        'status': 'OK',
+        'message': 'Sistema funcionando!',
+        'database': 'Conectado' if testar_conexao_banco() else 'Erro',
+        'tables': [table.name for table in db.metadata.tables.values()]
+    })
+
+# ==================== MÓDULO DE ATENDIMENTOS ====================
+
+def consulta_atendimentos(search='', status=''):
+    """Atendimentos com nomes do paciente e do profissional, com os filtros da lista"""
+    query = db.session.query(
+        Atendimento,
+        Paciente.nome.label('paciente_nome'),
+        Profissional.nome.label('profissional_nome')
+    ).join(Paciente, Atendimento.paciente_id == Paciente.id)\
+     .join(Profissional, Atendimento.profissional_id == Profissional.id)
+    
+    if search:
+        query = query.filter(Paciente.nome.ilike(f'%{search}%'))
+    
+    if status:
+        query = query.filter(Atendimento.status == status)
+    
+    return query
+
+@app.route('/atendimentos')
 @login_required
 def atendimentos():
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    direcao = request.args.get('direcao', 'next')
     search = request.args.get('search', '')
     status = request.args.get('status', '')
     
     try:
-        # Criar query básica com join para buscar dados relacionados
-        query = db.session.query(
-            Atendimento,
-            Paciente.nome.label('paciente_nome'),
-            Profissional.nome.label('profissional_nome')
-        ).join(Paciente, Atendimento.paciente_id == Paciente.id)\
-         .join(Profissional, Atendimento.profissional_id == Profissional.id)
-        
-        # Aplicar filtros se houver
-        if search:
-            query = query.filter(Paciente.nome.ilike(f'%{search}%'))
-        
-        if status:
-            query = query.filter(Atendimento.status == status)
+        query = consulta_atendimentos(search, status)
         
-        # Ordenar por data mais recente
-        query = query.order_by(Atendimento.data_atendimento.desc())
-        
-        # Executar query e paginar manualmente
-        total = query.count()
-        per_page = 20
-        offset = (page - 1) * per_page
-        items = query.offset(offset).limit(per_page).all()
+        # Mais recentes primeiro, paginando por cursor (data, id)
+        atendimentos_paginados = PaginacaoKeyset(
+            query, [Atendimento.data_atendimento, Atendimento.id],
+            chave=lambda linha: (linha.Atendimento.data_atendimento, linha.Atendimento.id),
+            cursor=cursor, direcao=direcao, page=page, per_page=20,
+            descendente=True, estimar=True
+        )
         
     except Exception:
         # Se tabelas não existem, retorna dados vazios
-        items = []
-        total = 0
-    
-    # Criar objeto de paginação manual
-    class PaginationMock:
-        def __init__(self, items, page, per_page, total):
-            self.items = items
-            self.total = total
-            self.pages = max(1, (total + per_page - 1) // per_page)
-            self.page = page
-            self.per_page = per_page
-            self.has_prev = page > 1
-            self.has_next = page < self.pages
-            self.prev_num = page - 1 if self.has_prev else None
-            self.next_num = page + 1 if self.has_next else None
-            
-        def iter_pages(self):
-            for num in range(1, self.pages + 1):
-                yield num
-    
-    atendimentos_paginados = PaginationMock(items, page, per_page, total)
+        db.session.rollback()
+        atendimentos_paginados = PaginacaoKeyset.vazia()
     
     return render_template('atendimentos/lista.html', 
                          atendimentos=atendimentos_paginados,
@@ -743,6 +2203,7 @@ def novo_atendimento():
             data_atendimento = datetime.strptime(request.form['data_atendimento'], '%Y-%m-%d').date()
             descricao = request.form.get('descricao', '')
             valor_total = float(request.form.get('valor_total', 0))
+            procedimento_ids = {int(pid) for pid in request.form.getlist('procedimento_ids') if pid.isdigit()}
             
             # Validações
             if not paciente_id or not profissional_id:
@@ -776,7 +2237,31 @@ def novo_atendimento():
             )
             
             db.session.add(atendimento)
+            db.session.flush()
+            
+            # Procedimentos marcados: uma consulta para os preços e um INSERT em lote
+            if procedimento_ids:
+                itens = [
+                    {
+                        'atendimento_id': atendimento.id,
+                        'procedimento_id': procedimento.id,
+                        'quantidade': 1,
+                        'valor_unitario': procedimento.valor,
+                        'valor_total': procedimento.valor,
+                    }
+                    for procedimento in Procedimento.query.filter(Procedimento.id.in_(procedimento_ids)).all()
+                ]
+                if itens:
+                    db.session.execute(db.insert(AtendimentoProcedimento), itens)
+                    acumular_resumo_procedimentos(data_atendimento, profissional.id, itens,
+                                                  Decimal(str(valor_total)))
+            
             db.session.commit()
+            invalidar_estatisticas()
+            delta = {'total_atendimentos': 1, 'atendimentos_pendentes': 1}
+            if data_atendimento == date.today():
+                delta.update(atendimentos_hoje=1, valores_hoje=float(valor_total))
+            painel_ao_vivo.publicar('atendimento', **delta)
             
             flash(f'Atendimento para {paciente.nome} registrado com sucesso!', 'success')
             
@@ -793,13 +2278,15 @@ def novo_atendimento():
             db.session.rollback()
             flash(f'Erro ao registrar atendimento: {str(e)}', 'error')
     
-    # GET - Exibir formulário
-    pacientes = Paciente.query.order_by(Paciente.nome).all()
-    profissionais = Profissional.query.filter_by(ativo=True).order_by(Profissional.nome).all()
-    procedimentos = Procedimento.query.filter_by(ativo=True).order_by(Procedimento.nome).all()
+    # GET - Exibir formulário (o paciente é escolhido pelo autocomplete)
+    paciente = paciente_resumo(request.form.get('paciente_id', type=int)
+                               or request.args.get('paciente_id', type=int))
+    catalogo = obter_catalogo()
+    profissionais = catalogo.profissionais_ativos
+    procedimentos = catalogo.procedimentos_ativos
     
     return render_template('atendimentos/form.html', 
-                         pacientes=pacientes, 
+                         paciente=paciente, 
                          profissionais=profissionais, 
                          procedimentos=procedimentos)
 
@@ -820,8 +2307,14 @@ def ver_atendimento(id):
         if not atendimento_data:
             flash('Atendimento não encontrado!', 'error')
             return redirect(url_for('atendimentos'))
+        
+        pagamentos = Pagamento.query.filter_by(atendimento_id=id)\
+            .order_by(Pagamento.data_pagamento, Pagamento.id).all()
             
-        return render_template('atendimentos/detalhes.html', atendimento=atendimento_data)
+        return render_template('atendimentos/detalhes.html',
+                             atendimento=atendimento_data,
+                             pagamentos=pagamentos,
+                             recibo=request.args.get('recibo', type=int))
         
     except Exception as e:
         flash(f'Erro ao buscar atendimento: {str(e)}', 'error')
@@ -829,6 +2322,271 @@ def ver_atendimento(id):
 
 # ==================== MÓDULO DE AGENDAMENTOS ====================
 
+app.config['AGENDA_DURACAO_PADRAO'] = int(os.getenv('AGENDA_DURACAO_PADRAO', '30'))
+app.config['AGENDA_DURACAO_MAXIMA'] = int(os.getenv('AGENDA_DURACAO_MAXIMA', '480'))
+app.config['AGENDA_INICIO'] = os.getenv('AGENDA_INICIO', '08:00')
+app.config['AGENDA_FIM'] = os.getenv('AGENDA_FIM', '19:00')
+app.config['AGENDA_INTERVALO_MINUTOS'] = int(os.getenv('AGENDA_INTERVALO_MINUTOS', '15'))
+
+def duracao_agendamento(duracao=None, procedimento_id=None):
+    """Duração informada; senão a do procedimento; senão a padrão da agenda"""
+    if not duracao and procedimento_id:
+        duracao = db.session.execute(
+            db.select(Procedimento.duracao_minutos).where(Procedimento.id == procedimento_id)
+        ).scalar()
+    duracao = int(duracao or app.config['AGENDA_DURACAO_PADRAO'])
+    if not 0 < duracao <= app.config['AGENDA_DURACAO_MAXIMA']:
+        raise ValueError(f"A duração deve ficar entre 1 e {app.config['AGENDA_DURACAO_MAXIMA']} minutos")
+    return duracao
+
+def filtro_sobreposicao(profissional_id, inicio, fim):
+    """Agendamentos ativos do profissional que se sobrepõem ao intervalo [início, fim).
+    
+    Dois intervalos se sobrepõem quando cada um começa antes do fim do outro.
+    Como nenhum agendamento dura mais que AGENDA_DURACAO_MAXIMA, data_hora também
+    fica limitada por baixo e a consulta lê só uma faixa do índice
+    (profissional_id, data_hora, status).
+    """
+    return db.and_(
+        Agendamento.profissional_id == profissional_id,
+        Agendamento.status == 'agendado',
+        Agendamento.data_hora < fim,
+        Agendamento.data_hora > inicio - timedelta(minutes=app.config['AGENDA_DURACAO_MAXIMA']),
+        Agendamento.data_hora_fim > inicio,
+    )
+
+def conflito_agenda(profissional_id, inicio, fim, ignorar_id=None):
+    """Primeiro agendamento que ocupa parte do intervalo, com o nome do paciente, ou None"""
+    consulta = db.select(
+        Agendamento.id, Agendamento.data_hora, Agendamento.data_hora_fim,
+        Paciente.nome.label('paciente_nome')
+    ).join(Paciente, Agendamento.paciente_id == Paciente.id)\
+     .where(filtro_sobreposicao(profissional_id, inicio, fim))\
+     .order_by(Agendamento.data_hora).limit(1)
+    if ignorar_id:
+        consulta = consulta.where(Agendamento.id != ignorar_id)
+    return db.session.execute(consulta).first()
+
+def mensagem_conflito(conflito):
+    return (f"Horário ocupado por {conflito.paciente_nome} "
+            f"({conflito.data_hora.strftime('%H:%M')} às {conflito.data_hora_fim.strftime('%H:%M')})")
+
+def expediente(dia):
+    """(abertura, fechamento) da agenda no dia"""
+    return (datetime.strptime(f"{dia} {app.config['AGENDA_INICIO']}", '%Y-%m-%d %H:%M'),
+            datetime.strptime(f"{dia} {app.config['AGENDA_FIM']}", '%Y-%m-%d %H:%M'))
+
+class OcupacaoAgenda:
+    """Intervalos ocupados de um profissional em listas ordenadas, para busca com bisect.
+    
+    `fins` guarda o maior término até cada posição: com agendamentos sem
+    sobreposição é o próprio término, mas continua correto se houver
+    sobreposições antigas (anteriores à verificação por intervalo).
+    """
+    
+    def __init__(self):
+        self.inicios = []
+        self.fins = []
+    
+    def adicionar(self, inicio, fim):
+        """Os intervalos devem chegar em ordem de início"""
+        self.inicios.append(inicio)
+        self.fins.append(max(fim, self.fins[-1]) if self.fins else fim)
+    
+    def livre(self, inicio, fim):
+        """True se nenhum intervalo começa antes de `fim` e termina depois de `inicio`"""
+        anteriores = bisect.bisect_left(self.inicios, fim)
+        return anteriores == 0 or self.fins[anteriores - 1] <= inicio
+
+def disponibilidade_agenda(profissional_ids, inicio, fim, duracao):
+    """Horários livres de cada profissional em cada dia de `inicio` a `fim` (inclusive).
+    
+    Uma única consulta traz todos os agendamentos ativos do período, que são
+    separados por profissional em OcupacaoAgenda; cada horário da grade de
+    AGENDA_INTERVALO_MINUTOS é testado em memória com uma busca binária.
+    Retorna {profissional_id: {dia: [início, ...]}}.
+    """
+    abertura, _ = expediente(inicio)
+    _, fechamento = expediente(fim)
+    ocupacoes = {profissional_id: OcupacaoAgenda() for profissional_id in profissional_ids}
+    if not ocupacoes:
+        return {}
+    
+    linhas = db.session.execute(
+        db.select(Agendamento.profissional_id, Agendamento.data_hora, Agendamento.data_hora_fim)
+          .where(Agendamento.profissional_id.in_(list(ocupacoes)),
+                 Agendamento.status == 'agendado',
+                 Agendamento.data_hora < fechamento,
+                 Agendamento.data_hora > abertura - timedelta(minutes=app.config['AGENDA_DURACAO_MAXIMA']),
+                 Agendamento.data_hora_fim > abertura)
+          .order_by(Agendamento.profissional_id, Agendamento.data_hora)
+    )
+    for profissional_id, data_hora, data_hora_fim in linhas:
+        ocupacoes[profissional_id].adicionar(data_hora, data_hora_fim)
+    
+    # Grade de (início, fim) de cada dia, comum a todos os profissionais
+    passo = timedelta(minutes=app.config['AGENDA_INTERVALO_MINUTOS'])
+    tamanho = timedelta(minutes=duracao)
+    agora = datetime.now()
+    grade = {}
+    dia = inicio
+    while dia <= fim:
+        abertura_dia, fechamento_dia = expediente(dia)
+        horarios = []
+        horario = abertura_dia
+        while horario + tamanho <= fechamento_dia:
+            if horario >= agora:
+                horarios.append((horario, horario + tamanho))
+            horario += passo
+        grade[dia] = horarios
+        dia += timedelta(days=1)
+    
+    return {
+        profissional_id: {
+            dia: [horario for horario, termino in horarios if ocupacao.livre(horario, termino)]
+            for dia, horarios in grade.items()
+        }
+        for profissional_id, ocupacao in ocupacoes.items()
+    }
+
+def horarios_livres(profissional_id, dia, duracao):
+    """Horários de início em que cabe um agendamento de `duracao` minutos no dia"""
+    return disponibilidade_agenda([profissional_id], dia, dia, duracao)[profissional_id][dia]
+
+REGRAS_RECORRENCIA = {'semanal': 'Semanal', 'quinzenal': 'Quinzenal', 'mensal': 'Mensal'}
+SERIE_MAXIMO_SESSOES = 52
+
+def datas_recorrencia(primeira, regra, sessoes):
+    """Início de cada sessão da série; na regra mensal o dia é ajustado ao fim de meses curtos"""
+    if regra == 'mensal':
+        datas = []
+        for n in range(sessoes):
+            ano, mes = divmod(primeira.month - 1 + n, 12)
+            ano, mes = primeira.year + ano, mes + 1
+            datas.append(primeira.replace(year=ano, month=mes, day=min(primeira.day, calendar.monthrange(ano, mes)[1])))
+        return datas
+    passo = timedelta(days=7 if regra == 'semanal' else 14)
+    return [primeira + passo * n for n in range(sessoes)]
+
+def conflitos_ocorrencias(profissional_id, ocorrencias, ignorar_ids=()):
+    """Ocorrências (início, fim) que colidem com a agenda do profissional.
+    
+    Uma única consulta por intervalo, da primeira à última ocorrência, carrega a
+    agenda em uma OcupacaoAgenda; cada ocorrência é testada em memória.
+    """
+    consulta = db.select(Agendamento.data_hora, Agendamento.data_hora_fim)\
+                 .where(filtro_sobreposicao(profissional_id, min(inicio for inicio, _ in ocorrencias),
+                                            max(fim for _, fim in ocorrencias)))\
+                 .order_by(Agendamento.data_hora)
+    if ignorar_ids:
+        consulta = consulta.where(Agendamento.id.not_in(list(ignorar_ids)))
+    
+    ocupacao = OcupacaoAgenda()
+    for data_hora, data_hora_fim in db.session.execute(consulta):
+        ocupacao.adicionar(data_hora, data_hora_fim)
+    return [(inicio, fim) for inicio, fim in ocorrencias if not ocupacao.livre(inicio, fim)]
+
+def criar_serie_agendamentos(dados, regra, sessoes):
+    """Cria todas as sessões de uma série em um INSERT em lote e uma transação.
+    
+    `dados` tem os campos do primeiro agendamento (incluindo data_hora e
+    duracao_minutos). Retorna (serie_id, []) ou (None, conflitos) sem gravar nada.
+    """
+    duracao = timedelta(minutes=dados['duracao_minutos'])
+    ocorrencias = [(inicio, inicio + duracao) for inicio in datas_recorrencia(dados['data_hora'], regra, sessoes)]
+    conflitos = conflitos_ocorrencias(dados['profissional_id'], ocorrencias)
+    if conflitos:
+        return None, conflitos
+    
+    serie_id = uuid.uuid4().hex
+    db.session.execute(db.insert(Agendamento), [
+        dict(dados, data_hora=inicio, data_hora_fim=fim, status='agendado',
+             serie_id=serie_id, recorrencia=regra, serie_ordem=ordem)
+        for ordem, (inicio, fim) in enumerate(ocorrencias, start=1)
+    ])
+    db.session.commit()
+    return serie_id, []
+
+def _restante_serie(agendamento):
+    """Sessões ainda agendadas da série a partir desta (inclusive)"""
+    return db.and_(Agendamento.serie_id == agendamento.serie_id,
+                   Agendamento.data_hora >= agendamento.data_hora,
+                   Agendamento.status == 'agendado')
+
+def _deslocar_data_hora(coluna, minutos):
+    """coluna + minutos em SQL, para mover várias linhas no mesmo UPDATE"""
+    if db.engine.dialect.name == 'sqlite':
+        # Mesmo formato em que o SQLAlchemy grava DateTime no SQLite, para as comparações de texto
+        return db.func.strftime('%Y-%m-%d %H:%M:%S.000000', coluna, f'{minutos:+d} minutes')
+    return coluna + timedelta(minutes=minutos)
+
+def cancelar_restante_serie(agendamento):
+    """Cancela esta e as próximas sessões agendadas em um único UPDATE; retorna quantas"""
+    resultado = db.session.execute(
+        db.update(Agendamento).where(_restante_serie(agendamento)).values(status='cancelado')
+          .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return resultado.rowcount
+
+def remarcar_restante_serie(agendamento, nova_data_hora):
+    """Move esta e as próximas sessões agendadas pelo mesmo deslocamento, em um único UPDATE.
+    
+    Retorna (quantidade, []) ou (0, conflitos) sem alterar nada.
+    """
+    minutos = int((nova_data_hora - agendamento.data_hora).total_seconds() // 60)
+    sessoes = db.session.execute(
+        db.select(Agendamento.id, Agendamento.data_hora, Agendamento.data_hora_fim)
+          .where(_restante_serie(agendamento))
+    ).all()
+    if not sessoes or not minutos:
+        return 0, []
+    
+    deslocamento = timedelta(minutes=minutos)
+    conflitos = conflitos_ocorrencias(
+        agendamento.profissional_id,
+        [(sessao.data_hora + deslocamento, sessao.data_hora_fim + deslocamento) for sessao in sessoes],
+        ignorar_ids=[sessao.id for sessao in sessoes]
+    )
+    if conflitos:
+        return 0, conflitos
+    
+    resultado = db.session.execute(
+        db.update(Agendamento).where(Agendamento.id.in_([sessao.id for sessao in sessoes]))
+          .values(data_hora=_deslocar_data_hora(Agendamento.data_hora, minutos),
+                  data_hora_fim=_deslocar_data_hora(Agendamento.data_hora_fim, minutos))
+          .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return resultado.rowcount, []
+
+def mensagem_conflitos_serie(conflitos):
+    datas = ', '.join(inicio.strftime('%d/%m %H:%M') for inicio, _ in conflitos[:5])
+    if len(conflitos) > 5:
+        datas += f' e mais {len(conflitos) - 5}'
+    return f'{len(conflitos)} sessão(ões) colidem com outros agendamentos: {datas}'
+
+def configurar_agenda_sem_sobreposicao():
+    """Cria no PostgreSQL a restrição de exclusão contra agendamentos sobrepostos"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        existe = db.session.execute(text(
+            "SELECT 1 FROM pg_constraint WHERE conname = 'ex_agendamento_sem_sobreposicao'"
+        )).first()
+        if not existe:
+            db.session.execute(text('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+            db.session.execute(text(
+                'ALTER TABLE agendamento ADD CONSTRAINT ex_agendamento_sem_sobreposicao '
+                'EXCLUDE USING gist (profissional_id WITH =, tsrange(data_hora, data_hora_fim) WITH &&) '
+                "WHERE (status = 'agendado')"
+            ))
+            db.session.commit()
+            print("✅ Restrição contra agendamentos sobrepostos configurada")
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Restrição de sobreposição não criada, a agenda usará só a verificação da aplicação: {str(e)}")
+
 @app.route('/agendamentos')
 @login_required
 def agendamentos():
@@ -852,7 +2610,7 @@ def agendamentos():
             Profissional.nome.label('profissional_nome')
         ).join(Paciente, Agendamento.paciente_id == Paciente.id)\
          .join(Profissional, Agendamento.profissional_id == Profissional.id)\
-         .filter(db.func.date(Agendamento.data_hora) == data_selecionada)\
+         .filter(filtro_periodo(Agendamento.data_hora, data_selecionada))\
          .order_by(Agendamento.data_hora).all()
     except Exception:
         # Se não conseguir fazer a query (tabelas não existem), retorna lista vazia
@@ -864,13 +2622,56 @@ def agendamentos():
                          hoje=hoje,
                          timedelta=timedelta)
 
+@app.route('/agendamentos/semana')
+@login_required
+def agenda_semanal():
+    try:
+        data_selecionada = datetime.strptime(request.args.get('data', ''), '%Y-%m-%d').date()
+    except ValueError:
+        data_selecionada = date.today()
+    
+    profissionais = obter_catalogo().profissionais_ativos
+    profissional_id = request.args.get('profissional_id', type=int)
+    if profissional_id is None and profissionais:
+        profissional_id = profissionais[0].id
+    
+    inicio_semana, fim_semana = intervalo_periodo(data_selecionada, 'semana')
+    dias = [inicio_semana + timedelta(days=i) for i in range(7)]
+    agenda = {dia: [] for dia in dias}
+    
+    # Semana inteira do profissional em uma única consulta por intervalo
+    try:
+        agendamentos_semana = db.session.query(
+            Agendamento,
+            Paciente.nome.label('paciente_nome')
+        ).join(Paciente, Agendamento.paciente_id == Paciente.id)\
+         .filter(Agendamento.profissional_id == profissional_id)\
+         .filter(filtro_periodo(Agendamento.data_hora, data_selecionada, 'semana'))\
+         .order_by(Agendamento.data_hora).all()
+    except Exception:
+        agendamentos_semana = []
+    
+    for agendamento, paciente_nome in agendamentos_semana:
+        agenda[agendamento.data_hora.date()].append((agendamento, paciente_nome))
+    
+    return render_template('agendamentos/semana.html',
+                         agenda=agenda,
+                         dias=dias,
+                         profissionais=profissionais,
+                         profissional_id=profissional_id,
+                         data_selecionada=data_selecionada,
+                         semana_anterior=inicio_semana - timedelta(days=7),
+                         proxima_semana=fim_semana,
+                         hoje=date.today())
+
 @app.route('/agendamentos/novo', methods=['GET', 'POST'])
 @login_required
 def novo_agendamento():
     if request.method == 'POST':
         try:
             paciente_id = request.form['paciente_id']
-            profissional_id = request.form['profissional_id']
+            profissional_id = int(request.form['profissional_id'])
+            procedimento_id = request.form.get('procedimento_id', type=int)
             data = request.form['data']
             horario = request.form['horario']
             observacoes = request.form.get('observacoes', '')
@@ -878,33 +2679,78 @@ def novo_agendamento():
             
             # Combinar data e horário
             data_hora = datetime.strptime(f"{data} {horario}", '%Y-%m-%d %H:%M')
+            duracao = duracao_agendamento(request.form.get('duracao_minutos', type=int), procedimento_id)
+            data_hora_fim = data_hora + timedelta(minutes=duracao)
+            recorrencia = request.form.get('recorrencia', '')
+            sessoes = request.form.get('sessoes', 1, type=int)
+            serie = recorrencia in REGRAS_RECORRENCIA and sessoes > 1
+            conflito = None
+            if status == 'agendado' and not serie:
+                conflito = conflito_agenda(profissional_id, data_hora, data_hora_fim)
             
-            # Criar novo agendamento
-            agendamento = Agendamento(
-                paciente_id=paciente_id,
-                profissional_id=profissional_id,
-                data_hora=data_hora,
-                observacoes=observacoes,
-                status=status
-            )
-            
-            db.session.add(agendamento)
-            db.session.commit()
-            
-            flash('Agendamento criado com sucesso!', 'success')
-            return redirect(url_for('agendamentos'))
+            if serie:
+                # Pacote de sessões: todas as ocorrências de uma vez
+                if sessoes > SERIE_MAXIMO_SESSOES:
+                    raise ValueError(f'Uma série pode ter no máximo {SERIE_MAXIMO_SESSOES} sessões')
+                serie_id, conflitos = criar_serie_agendamentos({
+                    'paciente_id': int(paciente_id),
+                    'profissional_id': profissional_id,
+                    'procedimento_id': procedimento_id,
+                    'data_hora': data_hora,
+                    'duracao_minutos': duracao,
+                    'observacoes': observacoes,
+                }, recorrencia, sessoes)
+                if conflitos:
+                    flash(f'{mensagem_conflitos_serie(conflitos)}. Nenhuma sessão foi agendada!', 'error')
+                else:
+                    invalidar_estatisticas()
+                    painel_ao_vivo.publicar('agendamento', agendamentos_hoje=int(data_hora.date() == date.today()))
+                    flash(f'{sessoes} sessões agendadas ({REGRAS_RECORRENCIA[recorrencia].lower()})!', 'success')
+                    return redirect(url_for('serie_agendamento', serie_id=serie_id))
+            elif conflito:
+                flash(f'{mensagem_conflito(conflito)}!', 'error')
+            else:
+                # Criar novo agendamento
+                agendamento = Agendamento(
+                    paciente_id=paciente_id,
+                    profissional_id=profissional_id,
+                    procedimento_id=procedimento_id,
+                    data_hora=data_hora,
+                    duracao_minutos=duracao,
+                    data_hora_fim=data_hora_fim,
+                    observacoes=observacoes,
+                    status=status
+                )
+                
+                db.session.add(agendamento)
+                db.session.commit()
+                invalidar_estatisticas()
+                painel_ao_vivo.publicar('agendamento', agendamentos_hoje=int(data_hora.date() == date.today()))
+                
+                flash('Agendamento criado com sucesso!', 'success')
+                return redirect(url_for('agendamentos'))
             
+        except IntegrityError:
+            # Restrição de exclusão do PostgreSQL: outro agendamento ocupou o horário
+            db.session.rollback()
+            flash('Horário ocupado por outro agendamento!', 'error')
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao criar agendamento: {str(e)}', 'error')
     
-    # GET - Exibir formulário
-    pacientes = Paciente.query.order_by(Paciente.nome).all()
-    profissionais = Profissional.query.filter_by(ativo=True).order_by(Profissional.nome).all()
+    # GET - Exibir formulário (o paciente é escolhido pelo autocomplete)
+    paciente = paciente_resumo(request.form.get('paciente_id', type=int)
+                               or request.args.get('paciente_id', type=int))
+    catalogo = obter_catalogo()
+    profissionais = catalogo.profissionais_ativos
+    procedimentos = catalogo.procedimentos_ativos
     
     return render_template('agendamentos/form.html', 
-                         pacientes=pacientes, 
-                         profissionais=profissionais)
+                         paciente=paciente, 
+                         profissionais=profissionais,
+                         procedimentos=procedimentos,
+                         regras_recorrencia=REGRAS_RECORRENCIA,
+                         maximo_sessoes=SERIE_MAXIMO_SESSOES)
 
 @app.route('/agendamentos/<int:id>/status', methods=['POST'])
 @login_required
@@ -912,16 +2758,86 @@ def atualizar_status_agendamento(id):
     try:
         status = request.form['status']
         agendamento = Agendamento.query.get_or_404(id)
-        agendamento.status = status
-        db.session.commit()
         
-        flash(f'Status do agendamento atualizado para {status}!', 'success')
+        # Reativar um agendamento cancelado só se o horário continuar livre
+        conflito = None
+        if status == 'agendado' and agendamento.status != 'agendado':
+            conflito = conflito_agenda(agendamento.profissional_id, agendamento.data_hora,
+                                       agendamento.data_hora_fim, ignorar_id=agendamento.id)
+        if conflito:
+            flash(f'{mensagem_conflito(conflito)}!', 'error')
+        else:
+            agendamento.status = status
+            db.session.commit()
+            invalidar_estatisticas()
+            painel_ao_vivo.publicar('agendamento_status')
+            
+            flash(f'Status do agendamento atualizado para {status}!', 'success')
+    except IntegrityError:
+        db.session.rollback()
+        flash('Horário ocupado por outro agendamento!', 'error')
     except Exception as e:
         db.session.rollback()
         flash(f'Erro ao atualizar status: {str(e)}', 'error')
     
     return redirect(url_for('agendamentos'))
 
+@app.route('/agendamentos/serie/<serie_id>')
+@login_required
+def serie_agendamento(serie_id):
+    sessoes = db.session.query(
+        Agendamento,
+        Paciente.nome.label('paciente_nome'),
+        Profissional.nome.label('profissional_nome')
+    ).join(Paciente, Agendamento.paciente_id == Paciente.id)\
+     .join(Profissional, Agendamento.profissional_id == Profissional.id)\
+     .filter(Agendamento.serie_id == serie_id)\
+     .order_by(Agendamento.data_hora).all()
+    if not sessoes:
+        flash('Série de agendamentos não encontrada!', 'error')
+        return redirect(url_for('agendamentos'))
+    
+    return render_template('agendamentos/serie.html',
+                         sessoes=sessoes,
+                         regras_recorrencia=REGRAS_RECORRENCIA)
+
+@app.route('/agendamentos/<int:id>/serie/cancelar', methods=['POST'])
+@login_required
+def cancelar_serie_agendamento(id):
+    agendamento = Agendamento.query.get_or_404(id)
+    try:
+        quantidade = cancelar_restante_serie(agendamento)
+        invalidar_estatisticas()
+        painel_ao_vivo.publicar('agendamento_status')
+        flash(f'{quantidade} sessão(ões) cancelada(s)!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erro ao cancelar sessões: {str(e)}', 'error')
+    
+    return redirect(url_for('serie_agendamento', serie_id=agendamento.serie_id))
+
+@app.route('/agendamentos/<int:id>/serie/remarcar', methods=['POST'])
+@login_required
+def remarcar_serie_agendamento(id):
+    agendamento = Agendamento.query.get_or_404(id)
+    try:
+        nova_data_hora = datetime.strptime(f"{request.form['data']} {request.form['horario']}", '%Y-%m-%d %H:%M')
+        quantidade, conflitos = remarcar_restante_serie(agendamento, nova_data_hora)
+        if conflitos:
+            flash(f'{mensagem_conflitos_serie(conflitos)}. Nenhuma sessão foi remarcada!', 'error')
+        else:
+            invalidar_estatisticas()
+            painel_ao_vivo.publicar('agendamento', ressincronizar=True)  # sessões podem entrar ou sair de hoje
+            flash(f'{quantidade} sessão(ões) remarcada(s)!', 'success')
+    except IntegrityError:
+        db.session.rollback()
+        flash('Horário ocupado por outro agendamento!', 'error')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erro ao remarcar sessões: {str(e)}', 'error')
+    
+    return redirect(url_for('serie_agendamento', serie_id=agendamento.serie_id))
+
 # ==================== MÓDULO DE PROFISSIONAIS ====================
 
 @app.route('/profissionais')
@@ -929,11 +2845,9 @@ def atualizar_status_agendamento(id):
 def profissionais():
     search = request.args.get('search', '')
     
-    query = Profissional.query
+    profissionais = obter_catalogo().profissionais
     if search:
-        query = query.filter(Profissional.nome.ilike(f'%{search}%'))
-    
-    profissionais = query.order_by(Profissional.nome).all()
+        profissionais = [item for item in profissionais if search.lower() in item.nome.lower()]
     
     return render_template('profissionais/lista.html', 
                          profissionais=profissionais, 
@@ -962,6 +2876,8 @@ def cadastrar_profissional():
         
         db.session.add(profissional)
         db.session.commit()
+        invalidar_catalogo()
+        invalidar_estatisticas()
         
         flash(f'Profissional {nome} cadastrado com sucesso!', 'success')
         return redirect(url_for('profissionais'))
@@ -996,6 +2912,7 @@ def editar_profissional(id):
         profissional.email = email
         
         db.session.commit()
+        invalidar_catalogo()
         
         flash(f'Dados do profissional {nome} atualizados!', 'success')
         return redirect(url_for('profissionais'))
@@ -1016,18 +2933,25 @@ def pagamentos():
 def novo_pagamento(atendimento_id):
     if request.method == 'POST':
         try:
-            valor = float(request.form['valor'])
+            try:
+                valor = para_decimal(request.form['valor'])
+            except ValueError:
+                flash('Valor inválido!', 'error')
+                raise
             forma_pagamento = request.form['forma_pagamento']
             data_pagamento = datetime.strptime(request.form['data_pagamento'], '%Y-%m-%d').date()
             observacoes = request.form.get('observacoes', '')
             
-            # Buscar atendimento
-            atendimento = Atendimento.query.get_or_404(atendimento_id)
+            # Buscar atendimento travando a linha (SELECT ... FOR UPDATE) até o commit,
+            # para que pagamentos simultâneos não ultrapassem o valor total
+            atendimento = db.session.get(Atendimento, atendimento_id, with_for_update=True)
+            if not atendimento:
+                flash('Atendimento não encontrado!', 'error')
+                raise ValueError('Atendimento inexistente')
             
-            # Calcular valores já pagos
-            pagamentos_existentes = Pagamento.query.filter_by(atendimento_id=atendimento_id).all()
-            valor_ja_pago = sum(float(p.valor) for p in pagamentos_existentes)
-            valor_pendente = float(atendimento.valor_total) - valor_ja_pago
+            valor_total = atendimento.valor_total or Decimal('0')
+            valor_ja_pago = atendimento.valor_pago or Decimal('0')
+            valor_pendente = valor_total - valor_ja_pago
             
             # Validações
             if valor <= 0:
@@ -1052,34 +2976,46 @@ def novo_pagamento(atendimento_id):
             )
             
             db.session.add(pagamento)
+            reconsolidar_dia_financeiro(data_pagamento)
             
-            # Atualizar status do atendimento
+            # Atualizar total pago (incremento no próprio UPDATE) e status do atendimento
+            status_anterior = atendimento.status
             novo_valor_pago = valor_ja_pago + valor
-            if novo_valor_pago >= float(atendimento.valor_total):
+            atendimento.valor_pago = Atendimento.valor_pago + valor
+            if novo_valor_pago >= valor_total:
                 atendimento.status = 'pago'
                 status_msg = 'totalmente pago'
             else:
                 atendimento.status = 'parcial'
                 status_msg = 'parcialmente pago'
             
+            paciente_id = atendimento.paciente_id
             db.session.commit()
+            invalidar_estatisticas()
+            painel_ao_vivo.publicar('pagamento', atendimentos_pendentes=-int(status_anterior == 'pendente'))
+            try:
+                # Na virada do dia, o primeiro pagamento consolida os dias fechados
+                consolidar_resumo_financeiro()
+            except Exception:
+                # O relatório lê dos pagamentos os dias ainda não consolidados
+                db.session.rollback()
             
             # Buscar dados do paciente para a mensagem
-            paciente = Paciente.query.get(atendimento.paciente_id)
+            paciente = db.session.get(Paciente, paciente_id)
             
             flash(f'Pagamento de R$ {valor:.2f} registrado! Atendimento de {paciente.nome} agora está {status_msg}.', 'success')
             
             # Se ainda há valor pendente, perguntar se quer continuar pagando
-            if novo_valor_pago < float(atendimento.valor_total):
-                valor_restante = float(atendimento.valor_total) - novo_valor_pago
+            if novo_valor_pago < valor_total:
+                valor_restante = valor_total - novo_valor_pago
                 flash(f'Valor restante: R$ {valor_restante:.2f}', 'info')
-                return redirect(url_for('novo_pagamento', atendimento_id=atendimento_id))
+                return redirect(url_for('novo_pagamento', atendimento_id=atendimento_id, recibo=pagamento.id))
             else:
-                return redirect(url_for('ver_atendimento', id=atendimento_id))
+                return redirect(url_for('ver_atendimento', id=atendimento_id, recibo=pagamento.id))
             
         except ValueError:
-            # Erro de validação - não faz rollback
-            pass
+            # Erro de validação - libera a trava do atendimento
+            db.session.rollback()
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao registrar pagamento: {str(e)}', 'error')
@@ -1100,134 +3036,1890 @@ def novo_pagamento(atendimento_id):
             flash('Atendimento não encontrado!', 'error')
             return redirect(url_for('atendimentos'))
         
-        # Calcular valores pagos
-        try:
-            pagamentos_existentes = Pagamento.query.filter_by(atendimento_id=atendimento_id).all()
-            valor_pago = sum(float(p.valor) for p in pagamentos_existentes)
-        except:
-            valor_pago = 0
-            
-        valor_pendente = float(atendimento_data.Atendimento.valor_total) - valor_pago
+        # Total pago mantido no próprio atendimento
+        valor_pago = atendimento_data.Atendimento.valor_pago or Decimal('0')
+        valor_pendente = (atendimento_data.Atendimento.valor_total or Decimal('0')) - valor_pago
         
         return render_template('pagamentos/form.html', 
                              atendimento=atendimento_data,
                              valor_pago=valor_pago,
-                             valor_pendente=max(0, valor_pendente))
+                             valor_pendente=max(0, valor_pendente),
+                             recibo=request.args.get('recibo', type=int))
         
     except Exception as e:
         flash(f'Erro ao buscar dados do pagamento: {str(e)}', 'error')
         return redirect(url_for('atendimentos'))
 
-# ==================== MÓDULO DE RELATÓRIOS ====================
+# ==================== RESUMO FINANCEIRO ====================
 
-@app.route('/relatorios')
-@login_required
-def relatorios():
-    return render_template('relatorios/index.html')
+DATA_INICIAL_RESUMO = date(2000, 1, 1)
 
-@app.route('/relatorios/financeiro')
-@login_required
-def relatorio_financeiro():
-    flash('Relatório financeiro em desenvolvimento', 'info')
-    return redirect(url_for('relatorios'))
+AGRUPAMENTOS_FINANCEIRO = {
+    'dia': 'Dia',
+    'semana': 'Semana',
+    'mes': 'Mês',
+    'forma_pagamento': 'Forma de pagamento',
+    'profissional': 'Profissional',
+}
 
-@app.route('/relatorios/pendencias')
-@login_required
-def relatorio_pendencias():
-    flash('Relatório de pendências em desenvolvimento', 'info')
-    return redirect(url_for('relatorios'))
+def ultimo_dia_consolidado():
+    """Último dia já consolidado no resumo financeiro (None se nenhum)"""
+    valor = db.session.execute(
+        db.select(Contador.valor).where(Contador.nome == 'resumo_financeiro')
+    ).scalar()
+    return date.fromordinal(valor) if valor else None
 
-@app.route('/relatorios/procedimentos')
-@login_required
-def relatorio_procedimentos():
-    flash('Relatório de procedimentos em desenvolvimento', 'info')
-    return redirect(url_for('relatorios'))
+def _pagamentos_por_dia(inicio, fim):
+    """Pagamentos agrupados por dia, profissional e forma, direto das tabelas"""
+    return db.select(
+        Pagamento.data_pagamento.label('data'),
+        Atendimento.profissional_id.label('profissional_id'),
+        Pagamento.forma_pagamento.label('forma_pagamento'),
+        db.func.count().label('quantidade'),
+        db.func.sum(Pagamento.valor).label('total')
+    ).join(Atendimento, Pagamento.atendimento_id == Atendimento.id)\
+     .where(Pagamento.data_pagamento >= inicio, Pagamento.data_pagamento < fim)\
+     .group_by(Pagamento.data_pagamento, Atendimento.profissional_id, Pagamento.forma_pagamento)
 
-# ==================== MÓDULO DE ADMINISTRAÇÃO ====================
+def _recalcular_resumo(inicio, fim):
+    tabela = ResumoFinanceiroDiario.__table__
+    db.session.execute(tabela.delete().where(tabela.c.data >= inicio, tabela.c.data < fim))
+    db.session.execute(tabela.insert().from_select(
+        ['data', 'profissional_id', 'forma_pagamento', 'quantidade', 'total'],
+        _pagamentos_por_dia(inicio, fim)
+    ))
 
-@app.route('/admin')
-@admin_required
-def admin_dashboard():
-    total_usuarios = Usuario.query.count()
-    usuarios_ativos = Usuario.query.filter_by(ativo=True).count()
-    total_pacientes = Paciente.query.count()
-    total_procedimentos = Procedimento.query.filter_by(ativo=True).count()
+def consolidar_resumo_financeiro():
+    """Consolida no resumo diário os dias fechados (até ontem) ainda pendentes.
     
-    return render_template('admin/dashboard.html',
-                         total_usuarios=total_usuarios,
-                         usuarios_ativos=usuarios_ativos,
-                         total_pacientes=total_pacientes,
-                         total_procedimentos=total_procedimentos)
-
-@app.route('/admin/usuarios')
-@admin_required
-def admin_usuarios():
-    usuarios = Usuario.query.order_by(Usuario.username).all()
-    return render_template('admin/usuarios.html', usuarios=usuarios)
-
-@app.route('/admin/backup')
-@admin_required
-def admin_backup():
-    flash('Funcionalidade de backup em desenvolvimento', 'info')
-    return redirect(url_for('admin_dashboard'))
+    Quando já está em dia custa uma leitura do contador; senão trava o
+    contador, agrega os dias faltantes com um INSERT ... SELECT e faz commit.
+    Roda depois de cada pagamento e pelo `flask consolidar-financeiro` (cron),
+    nunca nos relatórios.
+    """
+    ontem = date.today() - timedelta(days=1)
+    ultimo = ultimo_dia_consolidado()
+    if ultimo is not None and ultimo >= ontem:
+        return ultimo
+    
+    valor = travar_contador('resumo_financeiro')
+    inicio = date.fromordinal(valor) + timedelta(days=1) if valor else DATA_INICIAL_RESUMO
+    if inicio <= ontem:
+        _recalcular_resumo(inicio, ontem + timedelta(days=1))
+        db.session.execute(
+            db.update(Contador).where(Contador.nome == 'resumo_financeiro').values(valor=ontem.toordinal())
+        )
+    db.session.commit()
+    return ontem
 
-# ==================== TRATAMENTO DE ERROS ====================
+def reconsolidar_dia_financeiro(dia):
+    """Refaz o resumo de um dia já fechado (pagamento lançado com data retroativa)"""
+    ultimo = ultimo_dia_consolidado()
+    if ultimo is not None and dia <= ultimo:
+        db.session.flush()
+        _recalcular_resumo(dia, dia + timedelta(days=1))
 
-@app.errorhandler(404)
-def not_found_error(error):
-    return render_template('errors/404.html'), 404
+def truncar_data(coluna, periodo):
+    """Expressão SQL que leva a data ao início da semana (segunda) ou do mês"""
+    if periodo == 'dia':
+        return coluna
+    if db.engine.dialect.name == 'postgresql':
+        return db.cast(db.func.date_trunc('week' if periodo == 'semana' else 'month', coluna), db.Date)
+    if periodo == 'semana':
+        return db.func.date(coluna, 'weekday 0', '-6 days')
+    return db.func.strftime('%Y-%m-01', coluna)
 
-@app.errorhandler(500)
-def internal_error(error):
-    db.session.rollback()
-    return render_template('errors/500.html'), 500
+def consulta_relatorio_financeiro(inicio, fim, agrupar):
+    """Receita do período [inicio, fim) agrupada no banco, só com leituras.
     
+    Dias já consolidados vêm do resumo diário; os demais (hoje em diante e
+    dias fechados ainda não consolidados) são agregados a partir dos pagamentos.
+    """
+    ultimo = ultimo_dia_consolidado()
+    corte = min(max(ultimo + timedelta(days=1), inicio), fim) if ultimo else inicio
     
-# ==================== ROTAS EXTRAS ====================
+    partes = []
+    if inicio < corte:
+        partes.append(db.select(
+            ResumoFinanceiroDiario.data,
+            ResumoFinanceiroDiario.profissional_id,
+            ResumoFinanceiroDiario.forma_pagamento,
+            ResumoFinanceiroDiario.quantidade,
+            ResumoFinanceiroDiario.total
+        ).where(ResumoFinanceiroDiario.data >= inicio, ResumoFinanceiroDiario.data < corte))
+    if corte < fim:
+        partes.append(_pagamentos_por_dia(corte, fim))
+    if not partes:
+        partes.append(_pagamentos_por_dia(inicio, inicio))
+    
+    base = (db.union_all(*partes) if len(partes) > 1 else partes[0]).subquery()
+    quantidade = db.func.sum(base.c.quantidade).label('quantidade')
+    total = db.func.sum(base.c.total).label('total')
+    
+    if agrupar == 'profissional':
+        return db.select(Profissional.nome.label('chave'), quantidade, total)\
+                 .join(Profissional, Profissional.id == base.c.profissional_id)\
+                 .group_by(Profissional.id, Profissional.nome)\
+                 .order_by(total.desc())
+    if agrupar == 'forma_pagamento':
+        return db.select(base.c.forma_pagamento.label('chave'), quantidade, total)\
+                 .group_by(base.c.forma_pagamento)\
+                 .order_by(total.desc())
+    
+    chave = truncar_data(base.c.data, agrupar)
+    return db.select(chave.label('chave'), quantidade, total).group_by(chave).order_by(chave)
 
-@app.route('/api/estatisticas')
-@login_required
-def api_estatisticas():
-    """API para dados do dashboard em tempo real"""
-    try:
-        hoje = date.today()
-        
-        stats = {
-            'pacientes_total': Paciente.query.count(),
-            'atendimentos_hoje': Atendimento.query.filter_by(data_atendimento=hoje).count() if 'Atendimento' in globals() else 0,
-            'agendamentos_hoje': Agendamento.query.filter(db.func.date(Agendamento.data_hora) == hoje).count() if 'Agendamento' in globals() else 0,
-            'profissionais_ativos': Profissional.query.filter_by(ativo=True).count(),
-            'procedimentos_ativos': Procedimento.query.filter_by(ativo=True).count(),
+def linhas_relatorio_financeiro(consulta, agrupar):
+    """Lê o resultado em lotes e produz uma linha por grupo"""
+    for linha in db.session.execute(consulta, execution_options={'yield_per': 500}):
+        chave = linha.chave
+        if agrupar in ('dia', 'semana', 'mes'):
+            data_grupo = chave if isinstance(chave, date) else date.fromisoformat(str(chave)[:10])
+            chave = data_grupo.isoformat()
+            rotulo = data_grupo.strftime('%m/%Y' if agrupar == 'mes' else '%d/%m/%Y')
+            if agrupar == 'semana':
+                rotulo = f"Semana de {rotulo}"
+        else:
+            rotulo = chave or '-'
+        yield {
+            'chave': chave,
+            'rotulo': rotulo,
+            'quantidade': int(linha.quantidade or 0),
+            'total': Decimal(linha.total or 0).quantize(Decimal('0.01')),
         }
-        
-        return jsonify(stats)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
 
-@app.route('/buscar-pacientes')
-@login_required
-def buscar_pacientes():
-    """Busca rápida de pacientes para autocomplete"""
+@app.cli.command('consolidar-financeiro')
+def consolidar_financeiro_command():
+    """Atualiza o resumo financeiro diário dos dias fechados"""
+    ultimo = consolidar_resumo_financeiro()
+    print(f"✅ Resumo financeiro consolidado até {ultimo.strftime('%d/%m/%Y')}")
+
+# ==================== PENDÊNCIAS ====================
+
+FAIXAS_PENDENCIA = ('0-30', '31-60', '61-90', '90+')
+
+def faixa_pendencia(hoje):
+    """Faixa de atraso (em dias desde o atendimento) como expressão SQL"""
+    return db.case(
+        (Atendimento.data_atendimento >= hoje - timedelta(days=30), '0-30'),
+        (Atendimento.data_atendimento >= hoje - timedelta(days=60), '31-60'),
+        (Atendimento.data_atendimento >= hoje - timedelta(days=90), '61-90'),
+        else_='90+'
+    )
+
+def consulta_pendencias(hoje, faixa='', profissional_id=None):
+    """Atendimentos pendentes ou parciais com saldo, paciente e profissional.
+    
+    O saldo usa o valor_pago mantido no atendimento, então cada linha sai de
+    uma única consulta com joins, sem agregar os pagamentos por atendimento.
+    """
+    query = db.session.query(
+        Atendimento.id,
+        Atendimento.data_atendimento,
+        Atendimento.status,
+        Atendimento.valor_total,
+        Atendimento.valor_pago,
+        (db.func.coalesce(Atendimento.valor_total, 0) - Atendimento.valor_pago).label('saldo'),
+        faixa_pendencia(hoje).label('faixa'),
+        Paciente.nome.label('paciente_nome'),
+        Paciente.telefone.label('paciente_telefone'),
+        Profissional.nome.label('profissional_nome')
+    ).join(Paciente, Atendimento.paciente_id == Paciente.id)\
+     .join(Profissional, Atendimento.profissional_id == Profissional.id)\
+     .filter(Atendimento.status.in_(['pendente', 'parcial']))
+    
+    if faixa in FAIXAS_PENDENCIA:
+        query = query.filter(faixa_pendencia(hoje) == faixa)
+    if profissional_id:
+        query = query.filter(Atendimento.profissional_id == profissional_id)
+    return query
+
+def resumo_pendencias(hoje):
+    """Quantidade e saldo por faixa de atraso, em uma consulta agrupada"""
+    faixa = faixa_pendencia(hoje)
+    linhas = db.session.execute(
+        db.select(
+            faixa.label('faixa'),
+            db.func.count().label('quantidade'),
+            db.func.sum(db.func.coalesce(Atendimento.valor_total, 0) - Atendimento.valor_pago).label('saldo')
+        ).where(Atendimento.status.in_(['pendente', 'parcial'])).group_by(faixa)
+    ).all()
+    
+    resumo = {nome: {'quantidade': 0, 'saldo': Decimal('0')} for nome in FAIXAS_PENDENCIA}
+    for linha in linhas:
+        resumo[linha.faixa] = {'quantidade': linha.quantidade, 'saldo': Decimal(linha.saldo or 0)}
+    return resumo
+
+def formatar_decimal_csv(valor):
+    return f"{Decimal(valor or 0):.2f}".replace('.', ',')
+
+def gerar_csv_pendencias(query):
+    """Gera o CSV (separador ';', padrão do Excel em português) linha a linha"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    
+    def descarregar():
+        conteudo = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return conteudo
+    
+    escritor.writerow(['Atendimento', 'Data', 'Dias', 'Faixa', 'Paciente', 'Telefone',
+                       'Profissional', 'Status', 'Valor Total', 'Valor Pago', 'Saldo'])
+    yield '\ufeff' + descarregar()
+    
+    hoje = date.today()
+    linhas = query.order_by(Atendimento.data_atendimento, Atendimento.id).yield_per(500)
+    for linha in linhas:
+        escritor.writerow([
+            linha.id,
+            linha.data_atendimento.strftime('%d/%m/%Y'),
+            (hoje - linha.data_atendimento).days,
+            linha.faixa,
+            linha.paciente_nome,
+            linha.paciente_telefone or '',
+            linha.profissional_nome,
+            linha.status,
+            formatar_decimal_csv(linha.valor_total),
+            formatar_decimal_csv(linha.valor_pago),
+            formatar_decimal_csv(linha.saldo),
+        ])
+        if buffer.tell() > 8192:
+            yield descarregar()
+    yield descarregar()
+
+# ==================== RESUMO DE PROCEDIMENTOS ====================
+
+AGRUPAMENTOS_PROCEDIMENTOS = {
+    'procedimento': 'Procedimento',
+    'profissional': 'Profissional',
+}
+
+def acumular_resumo_procedimentos(data, profissional_id, itens, valor_atendimento):
+    """Soma os itens de um atendimento aos resumos diários de procedimentos e de profissionais.
+    
+    INSERT ... ON CONFLICT DO UPDATE na mesma transação do atendimento, então
+    os resumos acompanham as linhas sem precisar de reprocessamento. No resumo
+    por profissional o atendimento conta uma vez, com o valor total cobrado.
+    """
+    tabela = ResumoProcedimentoDiario.__table__
+    dialeto = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    comando = dialeto.insert(tabela).values([
+        {
+            'data': data,
+            'procedimento_id': item['procedimento_id'],
+            'profissional_id': profissional_id,
+            'quantidade': item['quantidade'],
+            'atendimentos': 1,
+            'receita': item['valor_total'],
+        }
+        for item in itens
+    ])
+    db.session.execute(comando.on_conflict_do_update(
+        index_elements=['data', 'procedimento_id', 'profissional_id'],
+        set_={
+            'quantidade': tabela.c.quantidade + comando.excluded.quantidade,
+            'atendimentos': tabela.c.atendimentos + comando.excluded.atendimentos,
+            'receita': tabela.c.receita + comando.excluded.receita,
+        }
+    ))
+    
+    tabela = ResumoProfissionalDiario.__table__
+    comando = dialeto.insert(tabela).values(
+        data=data,
+        profissional_id=profissional_id,
+        quantidade=sum(item['quantidade'] for item in itens),
+        atendimentos=1,
+        receita=valor_atendimento,
+    )
+    db.session.execute(comando.on_conflict_do_update(
+        index_elements=['data', 'profissional_id'],
+        set_={
+            'quantidade': tabela.c.quantidade + comando.excluded.quantidade,
+            'atendimentos': tabela.c.atendimentos + comando.excluded.atendimentos,
+            'receita': tabela.c.receita + comando.excluded.receita,
+        }
+    ))
+
+def recalcular_resumo_procedimentos():
+    """Reconstrói os resumos inteiros a partir dos itens dos atendimentos"""
+    tabela = ResumoProcedimentoDiario.__table__
+    db.session.execute(tabela.delete())
+    db.session.execute(tabela.insert().from_select(
+        ['data', 'procedimento_id', 'profissional_id', 'quantidade', 'atendimentos', 'receita'],
+        db.select(
+            Atendimento.data_atendimento,
+            AtendimentoProcedimento.procedimento_id,
+            Atendimento.profissional_id,
+            db.func.sum(db.func.coalesce(AtendimentoProcedimento.quantidade, 1)),
+            db.func.count(db.distinct(Atendimento.id)),
+            db.func.sum(AtendimentoProcedimento.valor_total)
+        ).join(Atendimento, AtendimentoProcedimento.atendimento_id == Atendimento.id)
+         .group_by(Atendimento.data_atendimento, AtendimentoProcedimento.procedimento_id,
+                   Atendimento.profissional_id)
+    ))
+    
+    # Por profissional: um registro por atendimento com procedimentos antes de agrupar
+    itens = db.select(
+        AtendimentoProcedimento.atendimento_id,
+        db.func.sum(db.func.coalesce(AtendimentoProcedimento.quantidade, 1)).label('quantidade')
+    ).group_by(AtendimentoProcedimento.atendimento_id).subquery()
+    tabela = ResumoProfissionalDiario.__table__
+    db.session.execute(tabela.delete())
+    db.session.execute(tabela.insert().from_select(
+        ['data', 'profissional_id', 'quantidade', 'atendimentos', 'receita'],
+        db.select(
+            Atendimento.data_atendimento,
+            Atendimento.profissional_id,
+            db.func.sum(itens.c.quantidade),
+            db.func.count(),
+            db.func.sum(db.func.coalesce(Atendimento.valor_total, 0))
+        ).join(itens, itens.c.atendimento_id == Atendimento.id)
+         .group_by(Atendimento.data_atendimento, Atendimento.profissional_id)
+    ))
+    db.session.commit()
+
+def consulta_relatorio_procedimentos(inicio, fim, agrupar, profissional_id=None):
+    """Quantidade, atendimentos e receita no período [inicio, fim), lidos dos resumos diários.
+    
+    Por procedimento a receita é a soma dos itens; por profissional é o valor
+    total dos atendimentos (com descontos) e cada atendimento conta uma vez.
+    """
+    if agrupar == 'profissional':
+        resumo = ResumoProfissionalDiario
+        entidade, coluna = Profissional, resumo.profissional_id
+    else:
+        resumo = ResumoProcedimentoDiario
+        entidade, coluna = Procedimento, resumo.procedimento_id
+    receita = db.func.sum(resumo.receita).label('receita')
+    
+    consulta = db.select(
+        entidade.nome.label('nome'),
+        db.func.sum(resumo.quantidade).label('quantidade'),
+        db.func.sum(resumo.atendimentos).label('atendimentos'),
+        receita
+    ).join(entidade, entidade.id == coluna)\
+     .where(resumo.data >= inicio, resumo.data < fim)\
+     .group_by(entidade.id, entidade.nome)\
+     .order_by(receita.desc())
+    if profissional_id:
+        consulta = consulta.where(resumo.profissional_id == profissional_id)
+    
+    linhas = []
+    for linha in db.session.execute(consulta):
+        receita_linha = Decimal(linha.receita or 0).quantize(Decimal('0.01'))
+        atendimentos = int(linha.atendimentos or 0)
+        linhas.append({
+            'nome': linha.nome,
+            'quantidade': int(linha.quantidade or 0),
+            'atendimentos': atendimentos,
+            'receita': receita_linha,
+            'ticket_medio': (receita_linha / atendimentos).quantize(Decimal('0.01')) if atendimentos else Decimal('0'),
+        })
+    return linhas
+
+@app.cli.command('recalcular-procedimentos')
+def recalcular_procedimentos_command():
+    """Reconstrói o resumo diário de procedimentos"""
+    recalcular_resumo_procedimentos()
+    total = db.session.query(ResumoProcedimentoDiario).count()
+    print(f"✅ Resumo de procedimentos reconstruído: {total} linha(s)")
+
+# ==================== MÓDULO DE RELATÓRIOS ====================
+
+@app.route('/relatorios')
+@login_required
+def relatorios():
+    return render_template('relatorios/index.html')
+
+@app.route('/relatorios/financeiro')
+@login_required
+def relatorio_financeiro():
+    inicio, fim = periodo_dos_parametros(request.args)
+    agrupar = request.args.get('agrupar', 'dia')
+    if agrupar not in AGRUPAMENTOS_FINANCEIRO:
+        agrupar = 'dia'
+    formato = request.args.get('formato', 'html')
+    
+    # Período inclusivo na tela, semiaberto na consulta
+    consulta = consulta_relatorio_financeiro(inicio, fim + timedelta(days=1), agrupar)
+    
+    if formato == 'json':
+        def gerar_json():
+            yield '{"inicio": "%s", "fim": "%s", "agrupar": "%s", "linhas": [' % (inicio, fim, agrupar)
+            separador = ''
+            for linha in linhas_relatorio_financeiro(consulta, agrupar):
+                yield separador + json.dumps(dict(linha, total=str(linha['total'])))
+                separador = ','
+            yield ']}'
+        return Response(stream_with_context(gerar_json()), mimetype='application/json')
+    
+    return stream_template('relatorios/financeiro.html',
+                           linhas=linhas_relatorio_financeiro(consulta, agrupar),
+                           inicio=inicio,
+                           fim=fim,
+                           agrupar=agrupar,
+                           agrupamentos=AGRUPAMENTOS_FINANCEIRO)
+
+@app.route('/relatorios/pendencias')
+@login_required
+def relatorio_pendencias():
+    hoje = date.today()
+    faixa = request.args.get('faixa', '')
+    profissional_id = request.args.get('profissional_id', type=int)
+    
+    query = consulta_pendencias(hoje, faixa, profissional_id)
+    
+    if request.args.get('formato') == 'csv':
+        nome_arquivo = f"pendencias_{hoje.strftime('%Y-%m-%d')}.csv"
+        return Response(
+            stream_with_context(gerar_csv_pendencias(query)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+        )
+    
+    pendencias = PaginacaoKeyset(
+        query, [Atendimento.data_atendimento, Atendimento.id],
+        chave=lambda linha: (linha.data_atendimento, linha.id),
+        cursor=request.args.get('cursor'), direcao=request.args.get('direcao', 'next'),
+        page=request.args.get('page', 1, type=int), per_page=50
+    )
+    
+    return render_template('relatorios/pendencias.html',
+                         pendencias=pendencias,
+                         resumo=resumo_pendencias(hoje),
+                         faixas=FAIXAS_PENDENCIA,
+                         faixa=faixa,
+                         profissionais=obter_catalogo().profissionais,
+                         profissional_id=profissional_id,
+                         hoje=hoje)
+
+@app.route('/relatorios/procedimentos')
+@login_required
+def relatorio_procedimentos():
+    inicio, fim = periodo_dos_parametros(request.args)
+    agrupar = request.args.get('agrupar', 'procedimento')
+    if agrupar not in AGRUPAMENTOS_PROCEDIMENTOS:
+        agrupar = 'procedimento'
+    profissional_id = request.args.get('profissional_id', type=int)
+    
+    # Período inclusivo na tela, semiaberto na consulta
+    linhas = consulta_relatorio_procedimentos(inicio, fim + timedelta(days=1), agrupar, profissional_id)
+    
+    return render_template('relatorios/procedimentos.html',
+                         linhas=linhas,
+                         inicio=inicio,
+                         fim=fim,
+                         agrupar=agrupar,
+                         agrupamentos=AGRUPAMENTOS_PROCEDIMENTOS,
+                         profissionais=obter_catalogo().profissionais,
+                         profissional_id=profissional_id)
+
+# ==================== DOCUMENTOS PDF ====================
+
+app.config['CLINICA_NOME'] = os.getenv('CLINICA_NOME', 'Clínica Estética')
+app.config['CLINICA_LOGO'] = os.getenv('CLINICA_LOGO', '')  # caminho de um PNG/JPG, opcional
+app.config['PDF_CACHE_ITENS'] = int(os.getenv('PDF_CACHE_ITENS', '200'))
+
+# Linhas por tabela nos relatórios: blocos pequenos deixam barato o corte entre páginas
+LINHAS_POR_BLOCO_PDF = 25
+
+_pdf_recursos = None
+_pdf_recursos_lock = threading.Lock()
+_pdf_cache = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+def recursos_pdf():
+    """Estilos e logo dos PDFs, montados uma única vez por processo"""
+    global _pdf_recursos
+    if _pdf_recursos is None:
+        with _pdf_recursos_lock:
+            if _pdf_recursos is None:
+                base = getSampleStyleSheet()
+                logo = None
+                if app.config['CLINICA_LOGO'] and os.path.exists(app.config['CLINICA_LOGO']):
+                    # Decodifica a imagem uma vez; o canvas só referencia o leitor
+                    leitor = ImageReader(app.config['CLINICA_LOGO'])
+                    largura, altura = leitor.getSize()
+                    logo = (leitor, 14 * mm * largura / altura, 14 * mm)
+                
+                _pdf_recursos = {
+                    'logo': logo,
+                    'titulo': ParagraphStyle('titulo', parent=base['Title'], fontSize=15, spaceAfter=2 * mm),
+                    'subtitulo': ParagraphStyle('subtitulo', parent=base['Normal'], fontSize=9,
+                                                textColor=colors.grey, alignment=1, spaceAfter=6 * mm),
+                    'normal': ParagraphStyle('normal', parent=base['Normal'], fontSize=10, leading=14),
+                    'assinatura': ParagraphStyle('assinatura', parent=base['Normal'], fontSize=9,
+                                                 alignment=1, spaceBefore=18 * mm),
+                    'tabela': TableStyle([
+                        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                        ('FONTSIZE', (0, 0), (-1, -1), 8),
+                        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#ede9fe')),
+                        ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.HexColor('#8b5cf6')),
+                        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9fafb')]),
+                        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                    ]),
+                }
+    return _pdf_recursos
+
+def _cabecalho_pdf(canvas, documento):
+    recursos = recursos_pdf()
+    largura, altura = documento.pagesize
+    canvas.saveState()
+    x = documento.leftMargin
+    if recursos['logo']:
+        leitor, largura_logo, altura_logo = recursos['logo']
+        canvas.drawImage(leitor, x, altura - 10 * mm - altura_logo, largura_logo, altura_logo, mask='auto')
+        x += largura_logo + 4 * mm
+    canvas.setFont('Helvetica-Bold', 11)
+    canvas.drawString(x, altura - 17 * mm, app.config['CLINICA_NOME'])
+    canvas.setFont('Helvetica', 7)
+    canvas.setFillColor(colors.grey)
+    canvas.drawRightString(largura - documento.rightMargin, 8 * mm, f'Página {canvas.getPageNumber()}')
+    canvas.restoreState()
+
+def _documento_pdf(destino, titulo, paisagem=False):
+    return SimpleDocTemplate(
+        destino, pagesize=landscape(A4) if paisagem else A4, title=titulo,
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=28 * mm, bottomMargin=15 * mm
+    )
+
+def _desenhar_no_quadro(quadro, canvas, pendentes):
+    """Desenha no quadro o início de 'pendentes', dividindo o que não couber inteiro.
+    
+    Usa só Frame.add e Frame.split; o que não coube fica na lista para a
+    próxima página. Retorna quantos flowables (ou partes) foram desenhados.
+    """
+    desenhados = 0
+    while pendentes:
+        if quadro.add(pendentes[0], canvas, trySplit=0):
+            del pendentes[0]
+            desenhados += 1
+            continue
+        partes = quadro.split(pendentes[0], canvas)
+        if len(partes) < 2 or not quadro.add(partes[0], canvas, trySplit=0):
+            break
+        pendentes[0:1] = partes[1:]
+        desenhados += 1
+    return desenhados
+
+def _celula_pdf(valor, formato, largura):
+    if valor is None:
+        return ''
+    if formato == 'moeda':
+        return currency_filter(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.strftime('%d/%m/%Y')
+    texto = str(valor)
+    return texto if len(texto) <= largura else texto[:largura - 1] + '…'
+
+def blocos_pdf(titulo, colunas, linhas, largura_util, contagem):
+    """Título e tabelas de LINHAS_POR_BLOCO_PDF linhas, gerados sob demanda.
+    
+    Soma em contagem['linhas'] as linhas já colocadas em tabelas.
+    """
+    recursos = recursos_pdf()
+    soma_larguras = sum(largura for _, largura, _ in colunas)
+    larguras = [largura_util * largura / soma_larguras for _, largura, _ in colunas]
+    cabecalho = [nome for nome, _, _ in colunas]
+    
+    yield Paragraph(escape(titulo), recursos['titulo'])
+    yield Paragraph(f"Gerado em {datetime.now().strftime('%d/%m/%Y %H:%M')}", recursos['subtitulo'])
+    bloco = []
+    for valores in linhas:
+        bloco.append([_celula_pdf(valor, formato, largura)
+                      for valor, (_, largura, formato) in zip(valores, colunas)])
+        if len(bloco) == LINHAS_POR_BLOCO_PDF:
+            contagem['linhas'] += len(bloco)
+            yield Table([cabecalho] + bloco, colWidths=larguras, style=recursos['tabela'], repeatRows=1)
+            bloco = []
+    contagem['linhas'] += len(bloco)
+    if bloco or not contagem['linhas']:
+        yield Table([cabecalho] + bloco, colWidths=larguras, style=recursos['tabela'], repeatRows=1)
+
+def escrever_pdf(destino, titulo, colunas, linhas):
+    """Gera o relatório em PDF e retorna o número de linhas.
+    
+    Uma Table única com todas as linhas mede e divide o conjunto inteiro a cada
+    página. Aqui as linhas viram tabelas de blocos_pdf(), desenhadas página a
+    página no canvas com o mesmo quadro e margens do SimpleDocTemplate, e só o
+    bloco atual fica em memória.
+    """
+    documento = _documento_pdf(destino, titulo, paisagem=True)
+    contagem = {'linhas': 0}
+    
+    canvas = Canvas(destino, pagesize=documento.pagesize)
+    canvas.setTitle(titulo)
+    
+    def nova_pagina():
+        _cabecalho_pdf(canvas, documento)
+        return Frame(documento.leftMargin, documento.bottomMargin, documento.width, documento.height)
+    
+    quadro, pagina_vazia = nova_pagina(), True
+    for bloco in blocos_pdf(titulo, colunas, linhas, documento.width, contagem):
+        pendentes = [bloco]
+        while True:
+            if _desenhar_no_quadro(quadro, canvas, pendentes):
+                pagina_vazia = False
+            if not pendentes:
+                break
+            if pagina_vazia:
+                raise ValueError('Bloco do relatório maior que a página do PDF')
+            canvas.showPage()
+            quadro, pagina_vazia = nova_pagina(), True
+    canvas.save()
+    return contagem['linhas']
+
+def pdf_em_cache(tipo, objeto_id, dados, gerar):
+    """Retorna (pdf, hash) do documento, gerando-o só quando o conteúdo muda.
+    
+    A chave inclui o hash dos dados impressos: reimprimir o mesmo documento não
+    gera nada, e qualquer alteração (novo pagamento, correção de nome) gera outro.
+    """
+    resumo = hashlib.sha256(json.dumps(dados, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+    chave = (tipo, objeto_id, resumo)
+    
+    with _pdf_cache_lock:
+        pdf = _pdf_cache.get(chave)
+        if pdf is not None:
+            _pdf_cache.move_to_end(chave)
+            return pdf, resumo
+    
+    pdf = gerar(dados)
+    with _pdf_cache_lock:
+        _pdf_cache[chave] = pdf
+        while len(_pdf_cache) > app.config['PDF_CACHE_ITENS']:
+            _pdf_cache.popitem(last=False)
+    return pdf, resumo
+
+def resposta_pdf(pdf, resumo, nome_arquivo):
+    resposta = Response(pdf, mimetype='application/pdf',
+                        headers={'Content-Disposition': f'inline; filename={nome_arquivo}'})
+    resposta.set_etag(resumo)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta.make_conditional(request)
+
+def _tabela_valores(linhas, larguras):
+    tabela = Table(linhas, colWidths=larguras, hAlign='LEFT', style=recursos_pdf()['tabela'])
+    tabela.setStyle([('ALIGN', (-1, 0), (-1, -1), 'RIGHT'), ('FONTSIZE', (0, 0), (-1, -1), 9)])
+    return tabela
+
+def dados_comprovante_atendimento(atendimento_id):
+    """Dados impressos no comprovante, já formatados (None se não existe)"""
+    linha = db.session.query(
+        Atendimento,
+        Paciente.nome.label('paciente_nome'),
+        Paciente.cpf.label('paciente_cpf'),
+        Profissional.nome.label('profissional_nome')
+    ).join(Paciente, Atendimento.paciente_id == Paciente.id)\
+     .join(Profissional, Atendimento.profissional_id == Profissional.id)\
+     .filter(Atendimento.id == atendimento_id).first()
+    if not linha:
+        return None
+    
+    atendimento = linha.Atendimento
+    procedimentos = db.session.query(
+        Procedimento.nome, AtendimentoProcedimento.quantidade, AtendimentoProcedimento.valor_total
+    ).join(Procedimento, AtendimentoProcedimento.procedimento_id == Procedimento.id)\
+     .filter(AtendimentoProcedimento.atendimento_id == atendimento_id)\
+     .order_by(AtendimentoProcedimento.id).all()
+    pagamentos = db.session.query(Pagamento.data_pagamento, Pagamento.forma_pagamento, Pagamento.valor)\
+        .filter(Pagamento.atendimento_id == atendimento_id)\
+        .order_by(Pagamento.data_pagamento, Pagamento.id).all()
+    valor_total = atendimento.valor_total or Decimal('0')
+    valor_pago = atendimento.valor_pago or Decimal('0')
+    
+    return {
+        'numero': atendimento.id,
+        'paciente': linha.paciente_nome,
+        'cpf': formatar_cpf(linha.paciente_cpf),
+        'profissional': linha.profissional_nome,
+        'data': atendimento.data_atendimento.strftime('%d/%m/%Y'),
+        'descricao': atendimento.descricao or '',
+        'procedimentos': [[nome, str(quantidade or 1), currency_filter(valor)] for nome, quantidade, valor in procedimentos],
+        'pagamentos': [[data_pagamento.strftime('%d/%m/%Y'), forma, currency_filter(valor)]
+                       for data_pagamento, forma, valor in pagamentos],
+        'valor_total': currency_filter(valor_total),
+        'valor_pago': currency_filter(valor_pago),
+        'valor_pendente': currency_filter(max(valor_total - valor_pago, 0)),
+    }
+
+def gerar_comprovante_atendimento(dados):
+    recursos = recursos_pdf()
+    buffer = io.BytesIO()
+    documento = _documento_pdf(buffer, f"Comprovante de atendimento nº {dados['numero']}")
+    
+    elementos = [
+        Paragraph(f"Comprovante de Atendimento nº {dados['numero']}", recursos['titulo']),
+        Paragraph(f"Atendimento realizado em {dados['data']}", recursos['subtitulo']),
+        Paragraph(f"<b>Paciente:</b> {escape(dados['paciente'])} &nbsp; <b>CPF:</b> {dados['cpf']}", recursos['normal']),
+        Paragraph(f"<b>Profissional:</b> {escape(dados['profissional'])}", recursos['normal']),
+        Spacer(1, 5 * mm),
+    ]
+    if dados['procedimentos']:
+        elementos += [
+            _tabela_valores([['Procedimento', 'Qtd.', 'Valor']] + dados['procedimentos'], [110 * mm, 20 * mm, 50 * mm]),
+            Spacer(1, 5 * mm),
+        ]
+    elif dados['descricao']:
+        elementos += [Paragraph(escape(dados['descricao']), recursos['normal']), Spacer(1, 5 * mm)]
+    
+    elementos.append(_tabela_valores([
+        ['Valor total', dados['valor_total']],
+        ['Valor pago', dados['valor_pago']],
+        ['Saldo pendente', dados['valor_pendente']],
+    ], [130 * mm, 50 * mm]))
+    
+    if dados['pagamentos']:
+        elementos += [
+            Spacer(1, 5 * mm),
+            _tabela_valores([['Data do pagamento', 'Forma', 'Valor']] + dados['pagamentos'],
+                            [60 * mm, 70 * mm, 50 * mm]),
+        ]
+    elementos.append(Paragraph('_' * 45 + '<br/>' + escape(app.config['CLINICA_NOME']), recursos['assinatura']))
+    
+    documento.build(elementos, onFirstPage=_cabecalho_pdf, onLaterPages=_cabecalho_pdf)
+    return buffer.getvalue()
+
+def dados_recibo_pagamento(pagamento_id):
+    """Dados impressos no recibo do pagamento, já formatados (None se não existe)"""
+    linha = db.session.query(
+        Pagamento,
+        Atendimento.data_atendimento,
+        Atendimento.valor_total,
+        Atendimento.valor_pago,
+        Paciente.nome.label('paciente_nome'),
+        Paciente.cpf.label('paciente_cpf'),
+        Profissional.nome.label('profissional_nome')
+    ).join(Atendimento, Pagamento.atendimento_id == Atendimento.id)\
+     .join(Paciente, Atendimento.paciente_id == Paciente.id)\
+     .join(Profissional, Atendimento.profissional_id == Profissional.id)\
+     .filter(Pagamento.id == pagamento_id).first()
+    if not linha:
+        return None
+    
+    pagamento = linha.Pagamento
+    saldo = (linha.valor_total or Decimal('0')) - (linha.valor_pago or Decimal('0'))
+    return {
+        'numero': pagamento.id,
+        'atendimento': pagamento.atendimento_id,
+        'paciente': linha.paciente_nome,
+        'cpf': formatar_cpf(linha.paciente_cpf),
+        'profissional': linha.profissional_nome,
+        'data_atendimento': linha.data_atendimento.strftime('%d/%m/%Y'),
+        'data_pagamento': pagamento.data_pagamento.strftime('%d/%m/%Y'),
+        'forma_pagamento': pagamento.forma_pagamento,
+        'valor': currency_filter(pagamento.valor),
+        'observacoes': pagamento.observacoes or '',
+        'saldo': currency_filter(max(saldo, 0)),
+    }
+
+def gerar_recibo_pagamento(dados):
+    recursos = recursos_pdf()
+    buffer = io.BytesIO()
+    documento = _documento_pdf(buffer, f"Recibo nº {dados['numero']}")
+    
+    elementos = [
+        Paragraph(f"Recibo de Pagamento nº {dados['numero']}", recursos['titulo']),
+        Paragraph(f"Pagamento em {dados['data_pagamento']}", recursos['subtitulo']),
+        Paragraph(
+            f"Recebemos de <b>{escape(dados['paciente'])}</b> (CPF {dados['cpf']}) a quantia de "
+            f"<b>{dados['valor']}</b>, paga em {escape(dados['forma_pagamento'])}, referente ao "
+            f"atendimento nº {dados['atendimento']} de {dados['data_atendimento']} "
+            f"com {escape(dados['profissional'])}.",
+            recursos['normal']
+        ),
+        Spacer(1, 5 * mm),
+        _tabela_valores([
+            ['Valor recebido', dados['valor']],
+            ['Saldo pendente do atendimento', dados['saldo']],
+        ], [130 * mm, 50 * mm]),
+    ]
+    if dados['observacoes']:
+        elementos += [Spacer(1, 5 * mm), Paragraph(f"<b>Observações:</b> {escape(dados['observacoes'])}", recursos['normal'])]
+    elementos.append(Paragraph('_' * 45 + '<br/>' + escape(app.config['CLINICA_NOME']), recursos['assinatura']))
+    
+    documento.build(elementos, onFirstPage=_cabecalho_pdf, onLaterPages=_cabecalho_pdf)
+    return buffer.getvalue()
+
+@app.route('/atendimentos/<int:id>/comprovante.pdf')
+@login_required
+def comprovante_atendimento(id):
+    dados = dados_comprovante_atendimento(id)
+    if not dados:
+        flash('Atendimento não encontrado!', 'error')
+        return redirect(url_for('atendimentos'))
+    
+    pdf, resumo = pdf_em_cache('atendimento', id, dados, gerar_comprovante_atendimento)
+    return resposta_pdf(pdf, resumo, f'comprovante_atendimento_{id}.pdf')
+
+@app.route('/pagamentos/<int:id>/recibo.pdf')
+@login_required
+def recibo_pagamento(id):
+    dados = dados_recibo_pagamento(id)
+    if not dados:
+        flash('Pagamento não encontrado!', 'error')
+        return redirect(url_for('atendimentos'))
+    
+    pdf, resumo = pdf_em_cache('pagamento', id, dados, gerar_recibo_pagamento)
+    return resposta_pdf(pdf, resumo, f'recibo_pagamento_{id}.pdf')
+
+# ==================== EXPORTAÇÃO (EXCEL E PDF) ====================
+
+# Acima deste número de linhas a planilha é gerada em segundo plano
+app.config['EXPORTACAO_LIMITE_SINCRONO'] = int(os.getenv('EXPORTACAO_LIMITE_SINCRONO', '5000'))
+app.config['EXPORTACAO_DIR'] = os.getenv('EXPORTACAO_DIR', os.path.join(app.instance_path, 'exportacoes'))
+app.config['EXPORTACAO_VALIDADE_HORAS'] = int(os.getenv('EXPORTACAO_VALIDADE_HORAS', '24'))
+
+# Poucas threads: cada exportação em andamento ocupa uma conexão do pool
+_exportacoes_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('EXPORTACAO_WORKERS', '2')),
+    thread_name_prefix='exportacao'
+)
+
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def _exportacao_atendimentos(parametros):
+    query = consulta_atendimentos(parametros.get('search', ''), parametros.get('status', ''))\
+        .with_entities(
+            Atendimento.id,
+            Atendimento.data_atendimento,
+            Paciente.nome,
+            Profissional.nome,
+            Atendimento.status,
+            Atendimento.valor_total,
+            Atendimento.valor_pago,
+            Atendimento.descricao
+        )
+    return {
+        'titulo': 'Atendimentos',
+        'colunas': [('Atendimento', 12, None), ('Data', 12, 'data'), ('Paciente', 40, None),
+                    ('Profissional', 30, None), ('Status', 12, None), ('Valor Total', 14, 'moeda'),
+                    ('Valor Pago', 14, 'moeda'), ('Descrição', 60, None)],
+        'contar': query.count,
+        'linhas': lambda: query.order_by(Atendimento.data_atendimento.desc(), Atendimento.id.desc())
+                               .yield_per(1000),
+    }
+
+def _exportacao_pacientes(parametros):
+    query = Paciente.query
+    if parametros.get('search'):
+        query = filtrar_busca_pacientes(query, parametros['search'])
+    query = query.with_entities(Paciente.nome, Paciente.cpf, Paciente.data_nascimento,
+                                Paciente.telefone, Paciente.observacoes)
+    
+    def linhas():
+        for nome, cpf, data_nascimento, telefone, observacoes in query.order_by(Paciente.nome, Paciente.id).yield_per(1000):
+            yield nome, formatar_cpf(cpf), data_nascimento, telefone, observacoes
+    
+    return {
+        'titulo': 'Pacientes',
+        'colunas': [('Nome', 40, None), ('CPF', 16, None), ('Nascimento', 12, 'data'),
+                    ('Telefone', 16, None), ('Observações', 60, None)],
+        'contar': query.count,
+        'linhas': linhas,
+    }
+
+def _exportacao_financeiro(parametros):
+    inicio, fim = periodo_dos_parametros(parametros)
+    agrupar = parametros.get('agrupar', 'dia')
+    if agrupar not in AGRUPAMENTOS_FINANCEIRO:
+        agrupar = 'dia'
+    
+    def linhas():
+        consulta = consulta_relatorio_financeiro(inicio, fim + timedelta(days=1), agrupar)
+        for linha in linhas_relatorio_financeiro(consulta, agrupar):
+            yield linha['rotulo'], linha['quantidade'], linha['total']
+    
+    return {
+        'titulo': 'Financeiro',
+        'colunas': [(AGRUPAMENTOS_FINANCEIRO[agrupar], 30, None), ('Pagamentos', 12, None), ('Total', 16, 'moeda')],
+        'contar': None,  # já agregado no banco: no máximo algumas centenas de linhas
+        'linhas': linhas,
+    }
+
+def _exportacao_pendencias(parametros):
+    hoje = date.today()
+    profissional_id = parametros.get('profissional_id', '')
+    query = consulta_pendencias(hoje, parametros.get('faixa', ''),
+                                int(profissional_id) if profissional_id.isdigit() else None)
+    
+    def linhas():
+        for linha in query.order_by(Atendimento.data_atendimento, Atendimento.id).yield_per(1000):
+            yield (linha.id, linha.data_atendimento, (hoje - linha.data_atendimento).days, linha.faixa,
+                   linha.paciente_nome, linha.paciente_telefone, linha.profissional_nome, linha.status,
+                   linha.valor_total, linha.valor_pago, linha.saldo)
+    
+    return {
+        'titulo': 'Pendências',
+        'colunas': [('Atendimento', 12, None), ('Data', 12, 'data'), ('Dias', 8, None), ('Faixa', 8, None),
+                    ('Paciente', 40, None), ('Telefone', 16, None), ('Profissional', 30, None),
+                    ('Status', 12, None), ('Valor Total', 14, 'moeda'), ('Valor Pago', 14, 'moeda'),
+                    ('Saldo', 14, 'moeda')],
+        'contar': query.count,
+        'linhas': linhas,
+    }
+
+EXPORTACOES = {
+    'atendimentos': _exportacao_atendimentos,
+    'pacientes': _exportacao_pacientes,
+    'financeiro': _exportacao_financeiro,
+    'pendencias': _exportacao_pendencias,
+}
+
+def escrever_planilha(destino, titulo, colunas, linhas):
+    """Grava a planilha em modo constant_memory e retorna o número de linhas.
+    
+    Nesse modo o xlsxwriter descarrega cada linha no disco assim que a próxima
+    começa, então a memória não cresce com o tamanho da exportação; em troca
+    as linhas precisam ser escritas em ordem, uma única vez.
+    """
+    livro = xlsxwriter.Workbook(destino, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy',
+        'tmpdir': app.config['EXPORTACAO_DIR'],
+    })
+    planilha = livro.add_worksheet(titulo[:31])
+    formatos = {
+        None: None,
+        'data': livro.add_format({'num_format': 'dd/mm/yyyy'}),
+        'moeda': livro.add_format({'num_format': '"R$" #,##0.00'}),
+    }
+    
+    for indice, (_, largura, formato) in enumerate(colunas):
+        planilha.set_column(indice, indice, largura, formatos[formato])
+    planilha.write_row(0, 0, [nome for nome, _, _ in colunas], livro.add_format({'bold': True}))
+    planilha.freeze_panes(1, 0)
+    
+    total = 0
+    for total, valores in enumerate(linhas, start=1):
+        planilha.write_row(total, 0, valores)
+    
+    livro.close()
+    return total
+
+# Formato -> (função que grava o arquivo, mimetype)
+FORMATOS_EXPORTACAO = {
+    'xlsx': (escrever_planilha, MIMETYPE_XLSX),
+    'pdf': (escrever_pdf, 'application/pdf'),
+}
+
+def _caminho_exportacao(job_id, extensao):
+    return os.path.join(app.config['EXPORTACAO_DIR'], f'{job_id}.{extensao}')
+
+def ler_exportacao(job_id):
+    """Metadados da exportação em segundo plano (None se não existe)"""
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+        return None
+    try:
+        with open(_caminho_exportacao(job_id, 'json'), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+
+def _gravar_exportacao(info):
+    # Grava num arquivo temporário e renomeia: quem lê nunca vê o JSON pela metade
+    caminho = _caminho_exportacao(info['id'], 'json')
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(info, arquivo)
+    os.replace(caminho + '.tmp', caminho)
+
+def limpar_exportacoes_antigas():
+    """Remove arquivos de exportações mais antigas que a validade configurada"""
+    limite = time.time() - app.config['EXPORTACAO_VALIDADE_HORAS'] * 3600
+    for nome in os.listdir(app.config['EXPORTACAO_DIR']):
+        caminho = os.path.join(app.config['EXPORTACAO_DIR'], nome)
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            pass
+
+def _executar_exportacao(info, parametros):
+    with app.app_context():
+        parcial = _caminho_exportacao(info['id'], info['formato'] + '.parcial')
+        try:
+            definicao = EXPORTACOES[info['tipo']](parametros)
+            escrever, _ = FORMATOS_EXPORTACAO[info['formato']]
+            info['linhas'] = escrever(parcial, definicao['titulo'], definicao['colunas'], definicao['linhas']())
+            os.replace(parcial, _caminho_exportacao(info['id'], info['formato']))
+            info['status'] = 'concluida'
+        except Exception as e:
+            print(f"❌ Erro na exportação {info['id']}: {e}")
+            info['status'] = 'erro'
+            info['erro'] = str(e)
+            if os.path.exists(parcial):
+                os.remove(parcial)
+        finally:
+            db.session.remove()
+        info['concluida_em'] = datetime.now().isoformat(timespec='seconds')
+        _gravar_exportacao(info)
+
+def agendar_exportacao(tipo, formato, parametros, titulo):
+    """Registra a exportação e a envia para o executor; retorna os metadados"""
+    info = {
+        'id': uuid.uuid4().hex,
+        'tipo': tipo,
+        'formato': formato,
+        'titulo': titulo,
+        'usuario_id': session['user_id'],
+        'status': 'processando',
+        'linhas': None,
+        'erro': None,
+        'criada_em': datetime.now().isoformat(timespec='seconds'),
+        'concluida_em': None,
+    }
+    _gravar_exportacao(info)
+    _exportacoes_executor.submit(_executar_exportacao, dict(info), parametros)
+    return info
+
+@app.route('/exportar/<tipo>')
+@login_required
+def exportar(tipo):
+    if tipo not in EXPORTACOES:
+        flash('Exportação não disponível!', 'error')
+        return redirect(url_for('dashboard'))
+    
+    os.makedirs(app.config['EXPORTACAO_DIR'], exist_ok=True)
+    parametros = request.args.to_dict()
+    formato = parametros.pop('formato', 'xlsx')
+    if formato not in FORMATOS_EXPORTACAO:
+        formato = 'xlsx'
+    escrever, mimetype = FORMATOS_EXPORTACAO[formato]
+    definicao = EXPORTACOES[tipo](parametros)
+    nome_arquivo = f"{tipo}_{date.today().strftime('%Y-%m-%d')}.{formato}"
+    
+    total = definicao['contar']() if definicao['contar'] else 0
+    if total > app.config['EXPORTACAO_LIMITE_SINCRONO']:
+        limpar_exportacoes_antigas()
+        agendar_exportacao(tipo, formato, parametros, definicao['titulo'])
+        flash(f'O arquivo de {definicao["titulo"].lower()} tem {total} linhas e está sendo gerado. '
+              f'Ele ficará disponível para download nesta página.', 'info')
+        return redirect(url_for('exportacoes'))
+    
+    # Exportação pequena: gera num arquivo temporário, apagado ao fechar a resposta
+    arquivo = tempfile.TemporaryFile(dir=app.config['EXPORTACAO_DIR'])
+    escrever(arquivo, definicao['titulo'], definicao['colunas'], definicao['linhas']())
+    arquivo.seek(0)
+    return send_file(arquivo, mimetype=mimetype, as_attachment=True, download_name=nome_arquivo)
+
+@app.route('/exportacoes')
+@login_required
+def exportacoes():
+    lista = []
+    if os.path.isdir(app.config['EXPORTACAO_DIR']):
+        for nome in os.listdir(app.config['EXPORTACAO_DIR']):
+            if nome.endswith('.json'):
+                info = ler_exportacao(nome[:-5])
+                if info and info['tipo'] in EXPORTACOES and info['usuario_id'] == session['user_id']:
+                    lista.append(info)
+    lista.sort(key=lambda info: info['criada_em'], reverse=True)
+    
+    return render_template('exportacoes/lista.html',
+                         exportacoes=lista,
+                         processando=any(info['status'] == 'processando' for info in lista))
+
+@app.route('/exportacoes/<job_id>')
+@login_required
+def baixar_exportacao(job_id):
+    info = ler_exportacao(job_id)
+    if not info or info['usuario_id'] != session['user_id'] or info['status'] != 'concluida':
+        flash('Exportação não encontrada ou ainda em andamento!', 'error')
+        return redirect(url_for('exportacoes'))
+    
+    formato = info.get('formato', 'xlsx')
+    nome_arquivo = f"{info['tipo']}_{info['criada_em'][:10]}.{formato}"
+    return send_file(_caminho_exportacao(job_id, formato), mimetype=FORMATOS_EXPORTACAO[formato][1],
+                     as_attachment=True, download_name=nome_arquivo)
+
+# ==================== BACKUP E RESTAURAÇÃO ====================
+
+app.config['BACKUP_PATH'] = os.getenv('BACKUP_PATH', './backups/')
+app.config['BACKUP_RETENTION_DAYS'] = int(os.getenv('BACKUP_RETENTION_DAYS', '30'))
+# Sobreposição do incremental com o backup anterior: cobre linhas gravadas com
+# horário anterior ao início do backup mas confirmadas depois dele
+app.config['BACKUP_MARGEM_MINUTOS'] = int(os.getenv('BACKUP_MARGEM_MINUTOS', '10'))
+
+# Tabelas derivadas não entram no backup: são reconstruídas após a restauração
+TABELAS_DERIVADAS = {'paciente_busca_token', 'resumo_financeiro_diario', 'resumo_procedimento_diario',
+                     'resumo_profissional_diario'}
+NULO_CSV = '\\N'
+LOTE_BACKUP = 1000
+
+_backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup')
+
+def tabelas_backup():
+    """Tabelas do backup em ordem de dependência (pais antes dos filhos)"""
+    return [tabela for tabela in db.metadata.sorted_tables if tabela.name not in TABELAS_DERIVADAS]
+
+def listar_backups():
+    """Manifestos dos backups concluídos, do mais antigo ao mais recente"""
+    pasta = app.config['BACKUP_PATH']
+    manifestos = []
+    if os.path.isdir(pasta):
+        for nome in sorted(os.listdir(pasta)):
+            try:
+                with open(os.path.join(pasta, nome, 'manifesto.json'), encoding='utf-8') as arquivo:
+                    manifestos.append(json.load(arquivo))
+            except (OSError, ValueError):
+                continue  # backup em andamento ou incompleto
+    return manifestos
+
+def _filtro_incremental(tabela, desde):
+    """Linhas criadas ou alteradas depois de 'desde' (None = tabela inteira)"""
+    colunas = tabela.c
+    if 'atualizado_em' in colunas and 'criado_em' in colunas:
+        return db.func.coalesce(colunas.atualizado_em, colunas.criado_em) > desde
+    if 'atualizado_em' in colunas:
+        return colunas.atualizado_em > desde
+    if 'criado_em' in colunas:
+        return colunas.criado_em > desde
+    if tabela is AtendimentoProcedimento.__table__:
+        # Itens não mudam depois de gravados: seguem o atendimento
+        return colunas.atendimento_id.in_(db.select(Atendimento.id).where(Atendimento.criado_em > desde))
+    return None
+
+def _valor_backup(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+def _conversor_coluna(coluna):
+    """Função que converte o valor lido do arquivo para o tipo da coluna"""
+    tipo = coluna.type
+    if isinstance(tipo, db.DateTime):
+        converter = datetime.fromisoformat
+    elif isinstance(tipo, db.Date):
+        converter = date.fromisoformat
+    elif isinstance(tipo, db.Numeric):
+        converter = Decimal
+    elif isinstance(tipo, db.Boolean):
+        converter = lambda valor: valor in ('True', 'true', '1')
+    elif isinstance(tipo, db.Integer):
+        converter = int
+    else:
+        return lambda valor: valor
+    return lambda valor: converter(valor) if isinstance(valor, str) else valor
+
+def executar_backup(incremental=False, formato='ndjson'):
+    """Grava um backup em BACKUP_PATH e retorna seu manifesto.
+    
+    Cada tabela é lida em lotes por um cursor do servidor (yield_per) e gravada
+    comprimida, uma linha por registro, sem montar a tabela em memória. No
+    PostgreSQL a leitura inteira acontece num snapshot REPEATABLE READ somente
+    leitura: o backup é consistente e não bloqueia as gravações das rotas.
+    O incremental leva só as linhas criadas ou alteradas desde o backup anterior.
+    """
+    os.makedirs(app.config['BACKUP_PATH'], exist_ok=True)
+    anteriores = listar_backups()
+    base = anteriores[-1] if incremental and anteriores else None
+    desde = None
+    if base:
+        desde = datetime.fromisoformat(base['inicio']) - timedelta(minutes=app.config['BACKUP_MARGEM_MINUTOS'])
+    
+    inicio = datetime.utcnow()
+    nome = f"backup_{inicio.strftime('%Y%m%d_%H%M%S_%f')}_{'incremental' if base else 'completo'}"
+    pasta = os.path.join(app.config['BACKUP_PATH'], nome)
+    parcial = pasta + '.parcial'
+    os.makedirs(parcial)
+    
+    manifesto = {
+        'nome': nome,
+        'tipo': 'incremental' if base else 'completo',
+        'formato': formato,
+        'base': base['nome'] if base else None,
+        'desde': desde.isoformat() if desde else None,
+        'inicio': inicio.isoformat(),
+        'tabelas': {},
+    }
+    cronometro = time.perf_counter()
+    
+    opcoes = {}
+    if db.engine.dialect.name == 'postgresql':
+        opcoes = {'isolation_level': 'REPEATABLE READ', 'postgresql_readonly': True}
+    
+    try:
+        with db.engine.connect().execution_options(**opcoes) as conexao, conexao.begin():
+            for tabela in tabelas_backup():
+                inicio_tabela = time.perf_counter()
+                consulta = db.select(tabela).order_by(*tabela.primary_key.columns)
+                filtro = _filtro_incremental(tabela, desde) if desde else None
+                if filtro is not None:
+                    consulta = consulta.where(filtro)
+                
+                colunas = [coluna.name for coluna in tabela.columns]
+                arquivo_nome = f'{tabela.name}.{formato}.gz'
+                linhas = 0
+                with gzip.open(os.path.join(parcial, arquivo_nome), 'wt', encoding='utf-8', newline='') as arquivo:
+                    if formato == 'csv':
+                        escritor = csv.writer(arquivo)
+                        escritor.writerow(colunas)
+                    resultado = conexao.execute(consulta.execution_options(yield_per=LOTE_BACKUP))
+                    for lote in resultado.partitions():
+                        for linha in lote:
+                            valores = [_valor_backup(valor) for valor in linha]
+                            if formato == 'csv':
+                                escritor.writerow([NULO_CSV if valor is None else valor for valor in valores])
+                            else:
+                                arquivo.write(json.dumps(valores, ensure_ascii=False) + '\n')
+                        linhas += len(lote)
+                
+                manifesto['tabelas'][tabela.name] = {
+                    'arquivo': arquivo_nome,
+                    'colunas': colunas,
+                    'linhas': linhas,
+                    'bytes': os.path.getsize(os.path.join(parcial, arquivo_nome)),
+                    'segundos': round(time.perf_counter() - inicio_tabela, 3),
+                    'completa': filtro is None,
+                }
+    except Exception:
+        shutil.rmtree(parcial, ignore_errors=True)
+        raise
+    
+    segundos = time.perf_counter() - cronometro
+    total_linhas = sum(info['linhas'] for info in manifesto['tabelas'].values())
+    manifesto.update({
+        'fim': datetime.utcnow().isoformat(),
+        'linhas': total_linhas,
+        'bytes': sum(info['bytes'] for info in manifesto['tabelas'].values()),
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(total_linhas / segundos) if segundos else total_linhas,
+    })
+    
+    # O manifesto é gravado por último: pasta sem manifesto é backup incompleto
+    with open(os.path.join(parcial, 'manifesto.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, indent=2)
+    os.replace(parcial, pasta)
+    
+    remover_backups_expirados()
+    return manifesto
+
+def remover_backups_expirados():
+    """Apaga backups além da retenção que nenhum backup mais novo precisa.
+    
+    Incrementais dependem do completo anterior, então só sai o que é anterior
+    ao último backup completo já fora do prazo de retenção.
+    """
+    limite = (datetime.utcnow() - timedelta(days=app.config['BACKUP_RETENTION_DAYS'])).isoformat()
+    backups = listar_backups()
+    completos_expirados = [b for b in backups if b['tipo'] == 'completo' and b['inicio'] <= limite]
+    if not completos_expirados:
+        return
+    corte = completos_expirados[-1]['inicio']
+    for backup in backups:
+        if backup['inicio'] < corte:
+            shutil.rmtree(os.path.join(app.config['BACKUP_PATH'], backup['nome']), ignore_errors=True)
+
+def cadeia_backup(pasta):
+    """Manifestos a aplicar para restaurar 'pasta': o completo de origem e os incrementais até ela"""
+    cadeia = []
+    while True:
+        with open(os.path.join(pasta, 'manifesto.json'), encoding='utf-8') as arquivo:
+            manifesto = json.load(arquivo)
+        manifesto['pasta'] = pasta
+        cadeia.insert(0, manifesto)
+        if manifesto['tipo'] == 'completo':
+            return cadeia
+        pasta = os.path.join(os.path.dirname(os.path.abspath(pasta)), manifesto['base'])
+
+def _ler_arquivo_backup(caminho, formato):
+    with gzip.open(caminho, 'rt', encoding='utf-8', newline='') as arquivo:
+        if formato == 'csv':
+            leitor = csv.reader(arquivo)
+            next(leitor)
+            for valores in leitor:
+                yield [None if valor == NULO_CSV else valor for valor in valores]
+        else:
+            for linha in arquivo:
+                yield json.loads(linha)
+
+def _preparar_banco_vazio(cadeia, tabelas):
+    """Confere que o banco está vazio antes de restaurar sem 'substituir'.
+    
+    Não contam os contadores semeados pelas migrações nem o administrador padrão
+    criado na inicialização quando é o único usuário: ambos são removidos para
+    darem lugar aos do backup.
+    """
+    contagem = {tabela.name: db.session.execute(db.select(db.func.count()).select_from(tabela)).scalar()
+                for tabela in tabelas if tabela.name != 'contador'}
+    usuarios = contagem.pop('usuario', 0)
+    admin = db.session.execute(db.select(Usuario)).scalar_one() if usuarios == 1 else None
+    admin_padrao = admin is not None and (admin.username, admin.email) == ('admin', 'admin@clinica.com')
+    if any(contagem.values()) or (usuarios and not admin_padrao):
+        raise ValueError('O banco não está vazio: use a opção de substituir os dados')
+    
+    db.session.execute(db.delete(Contador))
+    if admin_padrao and any(manifesto['tabelas'].get('usuario', {}).get('linhas') for manifesto in cadeia):
+        db.session.delete(admin)
+        db.session.flush()
+
+def restaurar_backup(pasta, substituir=False):
+    """Aplica o backup (e os anteriores de que ele depende) e retorna as estatísticas.
+    
+    As linhas entram em lotes com INSERT ... ON CONFLICT DO UPDATE pela chave
+    primária, então reaplicar um incremental sobreposto é seguro. Sem
+    'substituir' o banco precisa estar vazio (ver _preparar_banco_vazio); com ele,
+    as tabelas são apagadas antes.
+    """
+    cadeia = cadeia_backup(pasta)
+    tabelas = tabelas_backup()
+    versao_catalogo = _versao_catalogo()
+    
+    if substituir:
+        for tabela in reversed(db.metadata.sorted_tables):
+            db.session.execute(tabela.delete())
+    else:
+        _preparar_banco_vazio(cadeia, tabelas)
+    
+    dialeto = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    estatisticas = {'linhas': 0, 'segundos': 0.0, 'backups': [manifesto['nome'] for manifesto in cadeia]}
+    cronometro = time.perf_counter()
+    
+    for manifesto in cadeia:
+        for tabela in tabelas:
+            info = manifesto['tabelas'].get(tabela.name)
+            if not info or not info['linhas']:
+                continue
+            
+            colunas = [tabela.c[nome] for nome in info['colunas'] if nome in tabela.c]
+            indices = [info['colunas'].index(coluna.name) for coluna in colunas]
+            conversores = [_conversor_coluna(coluna) for coluna in colunas]
+            chaves = [coluna.name for coluna in tabela.primary_key.columns]
+            
+            comando = dialeto.insert(tabela)
+            atualizar = {coluna.name: comando.excluded[coluna.name] for coluna in colunas if coluna.name not in chaves}
+            comando = comando.on_conflict_do_update(index_elements=chaves, set_=atualizar) if atualizar \
+                else comando.on_conflict_do_nothing(index_elements=chaves)
+            
+            lote = []
+            for valores in _ler_arquivo_backup(os.path.join(manifesto['pasta'], info['arquivo']), manifesto['formato']):
+                lote.append({coluna.name: converter(valores[indice])
+                             for coluna, indice, converter in zip(colunas, indices, conversores)})
+                if len(lote) == LOTE_BACKUP:
+                    db.session.execute(comando, lote)
+                    estatisticas['linhas'] += len(lote)
+                    lote = []
+            if lote:
+                db.session.execute(comando, lote)
+                estatisticas['linhas'] += len(lote)
+    
+    if db.engine.dialect.name == 'postgresql':
+        # Os ids vieram do backup: as sequências precisam continuar depois deles
+        for tabela in tabelas:
+            if list(tabela.primary_key.columns.keys()) == ['id'] and isinstance(tabela.c.id.type, db.Integer):
+                db.session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{tabela.name}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {tabela.name}), 0) + 1, false)"
+                ))
+    
+    # Tabelas derivadas: o resumo financeiro é refeito a partir do zero no próximo pagamento
+    # ou pelo `flask consolidar-financeiro`; até lá o relatório lê dos pagamentos
+    db.session.execute(ResumoFinanceiroDiario.__table__.delete())
+    db.session.execute(db.delete(Contador).where(Contador.nome == 'resumo_financeiro'))
+    # A versão do catálogo só avança, mesmo que o backup traga uma mais antiga
+    db.session.execute(db.delete(Contador).where(Contador.nome == 'catalogo'))
+    db.session.add(Contador(nome='catalogo', valor=versao_catalogo))
+    db.session.commit()
+    reindexar_busca_pacientes()
+    recalcular_resumo_procedimentos()
+    invalidar_catalogo()
+    invalidar_estatisticas()
+    invalidar_busca_pacientes()
+    
+    estatisticas['segundos'] = round(time.perf_counter() - cronometro, 3)
+    estatisticas['linhas_por_segundo'] = round(estatisticas['linhas'] / estatisticas['segundos']) \
+        if estatisticas['segundos'] else estatisticas['linhas']
+    return estatisticas
+
+def _executar_backup_agendado(incremental, formato):
+    with app.app_context():
+        try:
+            manifesto = executar_backup(incremental, formato)
+            print(f"✅ Backup {manifesto['nome']}: {manifesto['linhas']} linhas "
+                  f"em {manifesto['segundos']}s ({manifesto['linhas_por_segundo']} linhas/s)")
+        except Exception as e:
+            print(f"❌ Erro no backup: {e}")
+        finally:
+            db.session.remove()
+
+@app.cli.command('backup')
+@click.option('--incremental', is_flag=True, help='Só as linhas criadas ou alteradas desde o último backup')
+@click.option('--formato', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+def backup_command(incremental, formato):
+    """Grava um backup compactado de todas as tabelas em BACKUP_PATH"""
+    manifesto = executar_backup(incremental, formato)
+    for nome, info in manifesto['tabelas'].items():
+        print(f"   {nome:<30} {info['linhas']:>10} linhas {info['bytes']:>12} bytes {info['segundos']:>8.3f}s")
+    print(f"✅ Backup {manifesto['tipo']} {manifesto['nome']}: {manifesto['linhas']} linhas, "
+          f"{manifesto['bytes']} bytes em {manifesto['segundos']}s ({manifesto['linhas_por_segundo']} linhas/s)")
+
+@app.cli.command('restaurar-backup')
+@click.argument('pasta')
+@click.option('--substituir', is_flag=True, help='Apaga os dados atuais antes de restaurar')
+def restaurar_backup_command(pasta, substituir):
+    """Restaura um backup (incluindo o completo e os incrementais de que ele depende)"""
+    try:
+        estatisticas = restaurar_backup(pasta, substituir)
+    except ValueError as e:
+        db.session.rollback()
+        print(f"❌ {e}")
+        return
+    except OSError as e:
+        db.session.rollback()
+        print(f"❌ Backup não encontrado ou ilegível: {e.filename or pasta} ({e.strerror or e})")
+        return
+    print(f"✅ Restaurados {', '.join(estatisticas['backups'])}: {estatisticas['linhas']} linhas "
+          f"em {estatisticas['segundos']}s ({estatisticas['linhas_por_segundo']} linhas/s)")
+
+# ==================== IMPORTAÇÃO DE PACIENTES ====================
+
+LOTE_IMPORTACAO = 1000
+
+# Cabeçalho da planilha (normalizado) -> campo do paciente
+COLUNAS_IMPORTACAO = {
+    'nome': 'nome',
+    'nome completo': 'nome',
+    'cpf': 'cpf',
+    'data nascimento': 'data_nascimento',
+    'data de nascimento': 'data_nascimento',
+    'nascimento': 'data_nascimento',
+    'telefone': 'telefone',
+    'celular': 'telefone',
+    'gosto musical': 'gosto_musical',
+    'observacoes': 'observacoes',
+    'obs': 'observacoes',
+}
+
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+def _indice_coluna_xlsx(referencia):
+    """'C12' -> 2"""
+    indice = 0
+    for letra in referencia:
+        if letra.isdigit():
+            break
+        indice = indice * 26 + ord(letra) - 64
+    return indice - 1
+
+def _linhas_xlsx(arquivo):
+    """Lê a primeira planilha de um .xlsx em fluxo (iterparse), linha a linha"""
+    with zipfile.ZipFile(arquivo) as pacote:
+        compartilhadas = []
+        if 'xl/sharedStrings.xml' in pacote.namelist():
+            with pacote.open('xl/sharedStrings.xml') as xml:
+                for _, elemento in ET.iterparse(xml):
+                    if elemento.tag == _XLSX_NS + 'si':
+                        compartilhadas.append(''.join(t.text or '' for t in elemento.iter(_XLSX_NS + 't')))
+                        elemento.clear()
+        
+        planilhas = sorted((nome for nome in pacote.namelist() if re.fullmatch(r'xl/worksheets/sheet\d+\.xml', nome)),
+                           key=lambda nome: int(re.sub(r'\D', '', nome)))
+        with pacote.open(planilhas[0]) as xml:
+            for _, elemento in ET.iterparse(xml):
+                if elemento.tag != _XLSX_NS + 'row':
+                    continue
+                valores = {}
+                for celula in elemento.iter(_XLSX_NS + 'c'):
+                    tipo = celula.get('t')
+                    valor = celula.find(_XLSX_NS + 'v')
+                    if tipo == 'inlineStr':
+                        conteudo = ''.join(t.text or '' for t in celula.iter(_XLSX_NS + 't'))
+                    elif valor is None:
+                        continue
+                    elif tipo == 's':
+                        conteudo = compartilhadas[int(valor.text)]
+                    elif tipo in ('str', 'e', 'b'):
+                        conteudo = valor.text
+                    else:
+                        numero = float(valor.text)
+                        conteudo = int(numero) if numero.is_integer() else numero
+                    valores[_indice_coluna_xlsx(celula.get('r'))] = conteudo
+                elemento.clear()
+                yield [valores.get(indice) for indice in range(max(valores, default=-1) + 1)]
+
+def _linhas_csv(arquivo):
+    """Lê CSV em UTF-8 (com ou sem BOM) ou Windows-1252, separado por ';' ou ','"""
+    inicio = arquivo.read(65536)
+    arquivo.seek(0)
+    try:
+        # Incremental: um caractere cortado no fim do bloco não conta como erro
+        codecs.getincrementaldecoder('utf-8-sig')().decode(inicio, final=len(inicio) < 65536)
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacao = 'cp1252'
+    primeira_linha = inicio.split(b'\n', 1)[0]
+    separador = ';' if primeira_linha.count(b';') >= primeira_linha.count(b',') else ','
+    
+    texto = io.TextIOWrapper(arquivo, encoding=codificacao, newline='')
+    try:
+        yield from csv.reader(texto, delimiter=separador)
+    finally:
+        texto.detach()
+
+def ler_planilha_pacientes(arquivo, nome_arquivo):
+    """Gera (número da linha, campos) da planilha; a primeira linha é o cabeçalho"""
+    linhas = _linhas_xlsx(arquivo) if nome_arquivo.lower().endswith('.xlsx') else _linhas_csv(arquivo)
+    cabecalho = next(linhas, None) or []
+    campos = [COLUNAS_IMPORTACAO.get(normalizar_texto(str(titulo or ''))) for titulo in cabecalho]
+    if 'nome' not in campos or 'cpf' not in campos or 'data_nascimento' not in campos:
+        raise ValueError('A planilha precisa das colunas Nome, CPF e Data de Nascimento')
+    
+    for numero, valores in enumerate(linhas, start=2):
+        if not any(valor not in (None, '') for valor in valores):
+            continue
+        yield numero, {campo: valor for campo, valor in zip(campos, valores) if campo}
+
+def _data_importacao(valor):
+    if isinstance(valor, (int, float)):
+        return date(1899, 12, 30) + timedelta(days=int(valor))  # número de série do Excel
+    texto = str(valor or '').strip()
+    for formato in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y'):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    return None
+
+def _texto_importacao(valor, limite=None):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor).strip()
+    return texto[:limite] if limite else texto
+
+def _validar_lote_importacao(lote, vistos):
+    """Separa o lote em pacientes válidos e erros (linha, cpf, nome, motivo)"""
+    cpfs = normalizar_cpfs([campos.get('cpf') for _, campos in lote])
+    validos_cpf = cpfs_validos(cpfs)
+    hoje = date.today()
+    pacientes, erros = [], []
+    
+    for (numero, campos), cpf, cpf_valido in zip(lote, cpfs, validos_cpf):
+        nome = ' '.join(_texto_importacao(campos.get('nome')).split())[:100]
+        data_nascimento = _data_importacao(campos.get('data_nascimento'))
+        
+        if not nome:
+            motivo = 'Nome em branco'
+        elif not cpf_valido:
+            motivo = 'CPF inválido'
+        elif not data_nascimento or data_nascimento > hoje:
+            motivo = 'Data de nascimento inválida'
+        elif cpf in vistos:
+            motivo = 'CPF repetido na planilha'
+        else:
+            vistos.add(cpf)
+            nome_normalizado = normalizar_texto(nome)
+            pacientes.append({
+                'linha': numero,
+                'nome': nome,
+                'nome_normalizado': nome_normalizado,
+                'cpf': cpf,
+                'data_nascimento': data_nascimento,
+                'telefone': _texto_importacao(campos.get('telefone'), 20),
+                'gosto_musical': _texto_importacao(campos.get('gosto_musical'), 100),
+                'observacoes': _texto_importacao(campos.get('observacoes')),
+            })
+            continue
+        erros.append((numero, _texto_importacao(campos.get('cpf')), nome, motivo))
+    
+    return pacientes, erros
+
+def _gravar_lote_importacao(pacientes):
+    """Descarta CPFs já cadastrados (uma consulta IN) e grava o resto em lote.
+    
+    Retorna os pacientes descartados. O INSERT em lote não dispara os eventos
+    do ORM, então nome normalizado e palavras de busca são gravados aqui.
+    """
+    existentes = set(db.session.execute(
+        db.select(Paciente.cpf).where(Paciente.cpf.in_([paciente['cpf'] for paciente in pacientes]))
+    ).scalars())
+    novos = [paciente for paciente in pacientes if paciente['cpf'] not in existentes]
+    duplicados = [paciente for paciente in pacientes if paciente['cpf'] in existentes]
+    
+    if novos:
+        registros = [{chave: valor for chave, valor in paciente.items() if chave != 'linha'} for paciente in novos]
+        ids = db.session.execute(
+            db.insert(Paciente).returning(Paciente.id, sort_by_parameter_order=True), registros
+        ).scalars().all()
+        tokens = [token for paciente_id, paciente in zip(ids, novos)
+                  for token in _tokens_paciente(paciente_id, paciente['nome_normalizado'])]
+        if tokens:
+            db.session.execute(db.insert(PacienteBuscaToken), tokens)
+    db.session.commit()
+    return novos, duplicados
+
+def importar_pacientes(arquivo, nome_arquivo, arquivo_erros, progresso=None):
+    """Importa pacientes de CSV/XLSX em lotes e retorna as estatísticas.
+    
+    Cada lote de LOTE_IMPORTACAO linhas custa uma consulta de CPFs existentes,
+    um INSERT em lote de pacientes e outro de palavras de busca, e um commit.
+    Linhas rejeitadas vão para arquivo_erros (CSV) com o número da linha e o motivo.
+    """
+    estatisticas = {'lidas': 0, 'importados': 0, 'duplicados': 0, 'invalidos': 0, 'segundos': 0.0}
+    cronometro = time.perf_counter()
+    vistos = set()
+    linhas = ler_planilha_pacientes(arquivo, nome_arquivo)
+    
+    with open(arquivo_erros, 'w', encoding='utf-8-sig', newline='') as saida:
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(['Linha', 'CPF', 'Nome', 'Motivo'])
+        
+        while True:
+            lote = list(itertools.islice(linhas, LOTE_IMPORTACAO))
+            if not lote:
+                break
+            
+            pacientes, erros = _validar_lote_importacao(lote, vistos)
+            estatisticas['invalidos'] += len(erros)
+            if pacientes:
+                try:
+                    _, duplicados = _gravar_lote_importacao(pacientes)
+                except IntegrityError:
+                    # CPF cadastrado por outra pessoa entre a consulta e o INSERT: refaz o lote
+                    db.session.rollback()
+                    _, duplicados = _gravar_lote_importacao(pacientes)
+                erros += [(paciente['linha'], formatar_cpf(paciente['cpf']), paciente['nome'], 'CPF já cadastrado')
+                          for paciente in duplicados]
+                estatisticas['importados'] += len(pacientes) - len(duplicados)
+                estatisticas['duplicados'] += len(duplicados)
+            
+            escritor.writerows(sorted(erros))
+            estatisticas['lidas'] += len(lote)
+            estatisticas['segundos'] = round(time.perf_counter() - cronometro, 3)
+            if progresso:
+                progresso(estatisticas)
+    
+    if estatisticas['importados']:
+        invalidar_estatisticas()
+        invalidar_busca_pacientes()
+        painel_ao_vivo.publicar('importacao_pacientes', ressincronizar=True)
+    estatisticas['linhas_por_segundo'] = round(estatisticas['lidas'] / estatisticas['segundos']) \
+        if estatisticas['segundos'] else estatisticas['lidas']
+    return estatisticas
+
+def _executar_importacao(info, caminho_upload):
+    with app.app_context():
+        def progresso(estatisticas):
+            info.update(estatisticas)
+            _gravar_exportacao(info)
+        
+        try:
+            with open(caminho_upload, 'rb') as arquivo:
+                info.update(importar_pacientes(arquivo, info['arquivo'],
+                                               _caminho_exportacao(info['id'], 'csv'), progresso))
+            info['status'] = 'concluida'
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Erro na importação {info['id']}: {e}")
+            info['status'] = 'erro'
+            info['erro'] = str(e)
+        finally:
+            db.session.remove()
+            os.remove(caminho_upload)
+        info['concluida_em'] = datetime.now().isoformat(timespec='seconds')
+        _gravar_exportacao(info)
+
+@app.cli.command('importar-pacientes')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--erros', default='importacao_erros.csv', show_default=True, help='CSV com as linhas rejeitadas')
+def importar_pacientes_command(arquivo, erros):
+    """Importa pacientes de uma planilha CSV ou XLSX"""
+    def progresso(estatisticas):
+        print(f"   {estatisticas['lidas']} linhas lidas, {estatisticas['importados']} importadas "
+              f"({estatisticas['segundos']}s)")
+    
+    with open(arquivo, 'rb') as entrada:
+        estatisticas = importar_pacientes(entrada, arquivo, erros, progresso)
+    print(f"✅ {estatisticas['importados']} pacientes importados, {estatisticas['duplicados']} já cadastrados, "
+          f"{estatisticas['invalidos']} inválidos ({estatisticas['linhas_por_segundo']} linhas/s)")
+    if estatisticas['duplicados'] or estatisticas['invalidos']:
+        print(f"   Linhas rejeitadas em {erros}")
+
+@app.route('/admin/importar-pacientes', methods=['GET', 'POST'])
+@admin_required
+def admin_importar_pacientes():
+    if request.method == 'POST':
+        arquivo = request.files.get('arquivo')
+        if not arquivo or not arquivo.filename.lower().endswith(('.csv', '.xlsx')):
+            flash('Envie uma planilha .csv ou .xlsx!', 'error')
+            return redirect(url_for('admin_importar_pacientes'))
+        
+        os.makedirs(app.config['EXPORTACAO_DIR'], exist_ok=True)
+        limpar_exportacoes_antigas()
+        info = {
+            'id': uuid.uuid4().hex,
+            'tipo': 'importacao_pacientes',
+            'titulo': 'Importação de pacientes',
+            'arquivo': os.path.basename(arquivo.filename),
+            'usuario_id': session['user_id'],
+            'status': 'processando',
+            'lidas': 0,
+            'importados': 0,
+            'duplicados': 0,
+            'invalidos': 0,
+            'erro': None,
+            'criada_em': datetime.now().isoformat(timespec='seconds'),
+            'concluida_em': None,
+        }
+        caminho_upload = _caminho_exportacao(info['id'], 'upload')
+        arquivo.save(caminho_upload)
+        _gravar_exportacao(info)
+        _exportacoes_executor.submit(_executar_importacao, info, caminho_upload)
+        
+        flash(f'Importação de {info["arquivo"]} iniciada!', 'success')
+        return redirect(url_for('admin_importar_pacientes'))
+    
+    importacoes = []
+    if os.path.isdir(app.config['EXPORTACAO_DIR']):
+        for nome in os.listdir(app.config['EXPORTACAO_DIR']):
+            if nome.endswith('.json'):
+                info = ler_exportacao(nome[:-5])
+                if info and info['tipo'] == 'importacao_pacientes':
+                    importacoes.append(info)
+    importacoes.sort(key=lambda info: info['criada_em'], reverse=True)
+    
+    return render_template('admin/importar_pacientes.html',
+                         importacoes=importacoes,
+                         processando=any(info['status'] == 'processando' for info in importacoes))
+
+@app.route('/admin/importar-pacientes/<job_id>')
+@admin_required
+def progresso_importacao(job_id):
+    info = ler_exportacao(job_id)
+    if not info or info['tipo'] != 'importacao_pacientes':
+        return jsonify({'erro': 'Importação não encontrada'}), 404
+    return jsonify(info)
+
+@app.route('/admin/importar-pacientes/<job_id>/erros')
+@admin_required
+def erros_importacao(job_id):
+    info = ler_exportacao(job_id)
+    if not info or info['tipo'] != 'importacao_pacientes' or info['status'] != 'concluida':
+        flash('Importação não encontrada ou ainda em andamento!', 'error')
+        return redirect(url_for('admin_importar_pacientes'))
+    
+    return send_file(_caminho_exportacao(job_id, 'csv'), mimetype='text/csv', as_attachment=True,
+                     download_name=f"importacao_erros_{info['criada_em'][:10]}.csv")
+
+# ==================== MÓDULO DE ADMINISTRAÇÃO ====================
+
+@app.route('/admin')
+@admin_required
+def admin_dashboard():
+    total_usuarios = Usuario.query.count()
+    usuarios_ativos = Usuario.query.filter_by(ativo=True).count()
+    total_pacientes = Paciente.query.count()
+    total_procedimentos = len(obter_catalogo().procedimentos_ativos)
+    
+    return render_template('admin/dashboard.html',
+                         total_usuarios=total_usuarios,
+                         usuarios_ativos=usuarios_ativos,
+                         total_pacientes=total_pacientes,
+                         total_procedimentos=total_procedimentos)
+
+@app.route('/admin/usuarios')
+@admin_required
+def admin_usuarios():
+    usuarios = Usuario.query.order_by(Usuario.username).all()
+    return render_template('admin/usuarios.html', usuarios=usuarios)
+
+@app.route('/admin/backup', methods=['GET', 'POST'])
+@admin_required
+def admin_backup():
+    if request.method == 'POST':
+        formato = request.form.get('formato', 'ndjson')
+        if formato not in ('ndjson', 'csv'):
+            formato = 'ndjson'
+        _backup_executor.submit(_executar_backup_agendado, request.form.get('tipo') == 'incremental', formato)
+        flash('Backup iniciado! Ele aparecerá na lista ao terminar.', 'success')
+        return redirect(url_for('admin_backup'))
+    
+    return render_template('admin/backup.html',
+                         backups=list(reversed(listar_backups())),
+                         pasta=os.path.abspath(app.config['BACKUP_PATH']),
+                         retencao=app.config['BACKUP_RETENTION_DAYS'])
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metricas():
+    if request.args.get('formato') == 'prometheus':
+        return Response(metricas_rotas.prometheus(), mimetype='text/plain; version=0.0.4')
+    
+    return render_template('admin/metricas.html',
+                         rotas=metricas_rotas.resumo(),
+                         desde=metricas_rotas.desde)
+
+@app.route('/admin/metrics/limpar', methods=['POST'])
+@admin_required
+def limpar_metricas():
+    metricas_rotas.limpar()
+    flash('Métricas zeradas!', 'success')
+    return redirect(url_for('admin_metricas'))
+
+@app.route('/metrics')
+def metricas_prometheus():
+    """Métricas para coletores Prometheus, autenticados pelo METRICAS_TOKEN"""
+    token = app.config['METRICAS_TOKEN']
+    if not token:
+        return jsonify({'erro': 'Não encontrado'}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'erro': 'Autenticação necessária'}), 401
+    return Response(metricas_rotas.prometheus(), mimetype='text/plain; version=0.0.4')
+
+# ==================== TRATAMENTO DE ERROS ====================
+
+@app.errorhandler(404)
+def not_found_error(error):
+    return render_template('errors/404.html'), 404
+
+@app.errorhandler(500)
+def internal_error(error):
+    db.session.rollback()
+    return render_template('errors/500.html'), 500
+    
+    
+# ==================== ROTAS EXTRAS ====================
+
+@app.route('/api/estatisticas')
+@login_required
+def api_estatisticas():
+    """API para dados do dashboard em tempo real"""
+    try:
+        estatisticas = obter_estatisticas()
+        
+        stats = {
+            'pacientes_total': estatisticas['total_pacientes'],
+            'atendimentos_hoje': estatisticas['atendimentos_hoje'],
+            'agendamentos_hoje': estatisticas['agendamentos_hoje'],
+            'profissionais_ativos': estatisticas['total_profissionais'],
+            'procedimentos_ativos': estatisticas['total_procedimentos'],
+        }
+        
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/buscar-pacientes')
+@login_required
+def buscar_pacientes():
+    """Busca rápida de pacientes para autocomplete"""
     termo = request.args.get('termo', '')
     
     if len(termo) < 2:
         return jsonify([])
     
-    pacientes = Paciente.query.filter(
-        db.or_(
-            Paciente.nome.ilike(f'%{termo}%'),
-            Paciente.cpf.ilike(f'%{termo}%')
-        )
-    ).limit(10).all()
-    
     resultado = []
-    for paciente in pacientes:
+    for id, nome, cpf, telefone, data_nascimento, observacoes in buscar_pacientes_resumo(termo):
         resultado.append({
-            'id': paciente.id,
-            'nome': paciente.nome,
-            'cpf': formatar_cpf(paciente.cpf),
-            'telefone': paciente.telefone or '',
-            'idade': calcular_idade(paciente.data_nascimento)
+            'id': id,
+            'nome': nome,
+            'cpf': formatar_cpf(cpf),
+            'telefone': telefone or '',
+            'idade': calcular_idade(data_nascimento),
+            'observacoes': observacoes or ''
         })
     
     return jsonify(resultado)
@@ -1237,7 +4929,7 @@ def buscar_pacientes():
 def verificar_disponibilidade():
     """Verifica disponibilidade de horário para agendamento"""
     try:
-        profissional_id = request.args.get('profissional_id')
+        profissional_id = request.args.get('profissional_id', type=int)
         data = request.args.get('data')
         horario = request.args.get('horario')
         
@@ -1245,19 +4937,16 @@ def verificar_disponibilidade():
             return jsonify({'disponivel': True, 'mensagem': 'Dados incompletos'})
         
         data_hora = datetime.strptime(f"{data} {horario}", '%Y-%m-%d %H:%M')
+        duracao = duracao_agendamento(request.args.get('duracao_minutos', type=int),
+                                      request.args.get('procedimento_id', type=int))
         
-        # Verificar se já existe agendamento neste horário
-        conflito = Agendamento.query.filter_by(
-            profissional_id=profissional_id,
-            data_hora=data_hora,
-            status='agendado'
-        ).first()
+        # Verificar se algum agendamento ocupa parte do intervalo
+        conflito = conflito_agenda(profissional_id, data_hora, data_hora + timedelta(minutes=duracao))
         
         if conflito:
-            paciente = Paciente.query.get(conflito.paciente_id)
             return jsonify({
                 'disponivel': False,
-                'mensagem': f'Horário ocupado por {paciente.nome}'
+                'mensagem': mensagem_conflito(conflito)
             })
         else:
             return jsonify({
@@ -1268,66 +4957,309 @@ def verificar_disponibilidade():
     except Exception as e:
         return jsonify({'disponivel': True, 'mensagem': f'Erro: {str(e)}'})
 
+@app.route('/api/agenda/horarios-livres')
+@login_required
+def api_horarios_livres():
+    """Horários livres de um profissional em um dia, para a duração pedida"""
+    profissional_id = request.args.get('profissional_id', type=int)
+    try:
+        dia = datetime.strptime(request.args.get('data', ''), '%Y-%m-%d').date()
+        duracao = duracao_agendamento(request.args.get('duracao_minutos', type=int),
+                                      request.args.get('procedimento_id', type=int))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    if not profissional_id:
+        return jsonify({'erro': 'Informe o profissional'}), 400
+    
+    return jsonify({
+        'profissional_id': profissional_id,
+        'data': dia.isoformat(),
+        'duracao_minutos': duracao,
+        'horarios': [inicio.strftime('%H:%M') for inicio in horarios_livres(profissional_id, dia, duracao)],
+    })
+
+@app.route('/api/agenda/disponibilidade')
+@login_required
+def api_disponibilidade_agenda():
+    """Horários livres de todos os profissionais ativos (ou de um profissional/especialidade) no período"""
+    try:
+        inicio = datetime.strptime(request.args.get('inicio', ''), '%Y-%m-%d').date()
+        fim = datetime.strptime(request.args.get('fim') or request.args.get('inicio', ''), '%Y-%m-%d').date()
+        duracao = duracao_agendamento(request.args.get('duracao_minutos', type=int),
+                                      request.args.get('procedimento_id', type=int))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    if not 0 <= (fim - inicio).days < 62:
+        return jsonify({'erro': 'O período deve ter de 1 a 62 dias'}), 400
+    
+    consulta = db.select(Profissional.id, Profissional.nome, Profissional.especialidade)\
+                 .where(Profissional.ativo == True).order_by(Profissional.nome)
+    profissional_id = request.args.get('profissional_id', type=int)
+    especialidade = request.args.get('especialidade', '').strip()
+    if profissional_id:
+        consulta = consulta.where(Profissional.id == profissional_id)
+    if especialidade:
+        consulta = consulta.where(db.func.lower(Profissional.especialidade) == especialidade.lower())
+    profissionais = db.session.execute(consulta).all()
+    
+    livres = disponibilidade_agenda([profissional.id for profissional in profissionais], inicio, fim, duracao)
+    return jsonify({
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'duracao_minutos': duracao,
+        'profissionais': [{
+            'id': profissional.id,
+            'nome': profissional.nome,
+            'especialidade': profissional.especialidade or '',
+            'dias': {
+                dia.isoformat(): [horario.strftime('%H:%M') for horario in horarios]
+                for dia, horarios in livres[profissional.id].items()
+            },
+        } for profissional in profissionais],
+    })
+
 @app.route('/dashboard/refresh')
 @login_required
 def dashboard_refresh():
     """Endpoint para atualizar dados do dashboard via AJAX"""
     try:
-        hoje = date.today()
-        
-        # Calcular estatísticas
-        stats = {
-            'atendimentos_hoje': Atendimento.query.filter_by(data_atendimento=hoje).count() if 'Atendimento' in globals() else 0,
-            'agendamentos_hoje': Agendamento.query.filter(db.func.date(Agendamento.data_hora) == hoje).count() if 'Agendamento' in globals() else 0,
-            'valores_hoje': 0,
-            'pendentes': 0
-        }
+        estatisticas = obter_estatisticas()
         
-        try:
-            valores_hoje = db.session.query(db.func.sum(Atendimento.valor_total)).filter_by(data_atendimento=hoje).scalar()
-            stats['valores_hoje'] = float(valores_hoje) if valores_hoje else 0
-            
-            pendentes = Atendimento.query.filter_by(status='pendente').count()
-            stats['pendentes'] = pendentes
-        except:
-            pass
+        # Mesmas chaves do painel ao vivo (SSE), usado pelas telas sem o canal
+        stats = dict(estatisticas, pendentes=estatisticas['atendimentos_pendentes'])
         
         return jsonify(stats)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ==================== API JSON (v1) ====================
+
+API_LIMITE_PADRAO = 50
+API_LIMITE_MAXIMO = 500
+
+def _campos_modelo(modelo, *nomes):
+    return {nome: getattr(modelo, nome) for nome in nomes}
+
+# Recursos expostos em /api/v1/<recurso>: campos publicados e filtros por igualdade
+RECURSOS_API = {
+    'pacientes': {
+        'modelo': Paciente,
+        'campos': _campos_modelo(Paciente, 'id', 'nome', 'cpf', 'data_nascimento', 'telefone',
+                                 'gosto_musical', 'observacoes', 'criado_em', 'atualizado_em'),
+        'filtros': ('cpf',),
+    },
+    'atendimentos': {
+        'modelo': Atendimento,
+        'campos': _campos_modelo(Atendimento, 'id', 'paciente_id', 'profissional_id', 'data_atendimento',
+                                 'descricao', 'valor_total', 'valor_pago', 'desconto_valor',
+                                 'desconto_percentual', 'status', 'criado_em', 'atualizado_em'),
+        'filtros': ('paciente_id', 'profissional_id', 'status', 'data_atendimento'),
+    },
+    'agendamentos': {
+        'modelo': Agendamento,
+        'campos': _campos_modelo(Agendamento, 'id', 'paciente_id', 'profissional_id', 'procedimento_id',
+                                 'data_hora', 'duracao_minutos', 'data_hora_fim', 'observacoes', 'status',
+                                 'serie_id', 'recorrencia', 'serie_ordem', 'criado_em', 'atualizado_em'),
+        'filtros': ('paciente_id', 'profissional_id', 'status', 'serie_id'),
+    },
+    'pagamentos': {
+        'modelo': Pagamento,
+        'campos': _campos_modelo(Pagamento, 'id', 'atendimento_id', 'valor', 'forma_pagamento',
+                                 'data_pagamento', 'observacoes', 'criado_em'),
+        'filtros': ('atendimento_id', 'forma_pagamento', 'data_pagamento'),
+    },
+    'procedimentos': {
+        'modelo': Procedimento,
+        'campos': _campos_modelo(Procedimento, 'id', 'nome', 'valor', 'duracao_minutos', 'ativo', 'atualizado_em'),
+        'filtros': ('ativo',),
+    },
+    'profissionais': {
+        'modelo': Profissional,
+        'campos': _campos_modelo(Profissional, 'id', 'nome', 'especialidade', 'telefone', 'email',
+                                 'ativo', 'atualizado_em'),
+        'filtros': ('ativo', 'especialidade'),
+    },
+}
+
+def _alteracao_api(modelo):
+    """Momento da última alteração da linha: atualizado_em, ou criado_em onde não existe"""
+    colunas = [getattr(modelo, nome) for nome in ('atualizado_em', 'criado_em') if hasattr(modelo, nome)]
+    return db.func.coalesce(*colunas) if len(colunas) > 1 else colunas[0]
+
+def _campos_pedidos(definicao, fields):
+    """Campos de ?fields=a,b (o id sempre vem); todos quando não informado"""
+    if not fields:
+        return definicao['campos']
+    nomes = ['id'] + [nome.strip() for nome in fields.split(',') if nome.strip() and nome.strip() != 'id']
+    desconhecidos = [nome for nome in nomes if nome not in definicao['campos']]
+    if desconhecidos:
+        raise ValueError(f"Campos desconhecidos: {', '.join(desconhecidos)}")
+    return {nome: definicao['campos'][nome] for nome in dict.fromkeys(nomes)}
+
+def _filtros_api(definicao, parametros):
+    """Filtros por igualdade dos parâmetros da URL, convertidos para o tipo da coluna"""
+    filtros = []
+    for nome in definicao['filtros']:
+        if nome not in parametros:
+            continue
+        coluna = definicao['campos'][nome]
+        valor = parametros[nome]
+        if isinstance(coluna.type, db.Boolean):
+            valor = valor.lower() in ('1', 'true', 'sim')
+        elif isinstance(coluna.type, db.Integer):
+            valor = int(valor)
+        elif isinstance(coluna.type, db.Date):
+            valor = date.fromisoformat(valor)
+        filtros.append(coluna == valor)
+    
+    if parametros.get('alterados_desde'):
+        filtros.append(_alteracao_api(definicao['modelo']) > datetime.fromisoformat(parametros['alterados_desde']))
+    return filtros
+
+def _valor_api(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+def _resposta_condicional_api(versao, ultima_alteracao):
+    """Resposta vazia com ETag e Last-Modified; vira 304 se o cliente já tem essa versão"""
+    resposta = Response(mimetype='application/json')
+    resposta.set_etag(hashlib.sha1(repr(versao).encode()).hexdigest())
+    if ultima_alteracao:
+        resposta.last_modified = ultima_alteracao
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    resposta.vary.add('Cookie')
+    return resposta.make_conditional(request)
+
+@app.route('/api/v1/<recurso>')
+@login_required
+def api_listar(recurso):
+    """Lista paginada por chave (?apos=<último id>&limite=), com ?fields= e filtros.
+    
+    A versão da página (quantidade, ids e última alteração) vem de uma consulta
+    de agregação sobre os índices; se o cliente já tem essa versão a resposta é
+    304 sem carregar as linhas.
+    """
+    definicao = RECURSOS_API.get(recurso)
+    if not definicao:
+        return jsonify({'erro': f'Recurso desconhecido: {recurso}'}), 404
+    modelo = definicao['modelo']
+    try:
+        campos = _campos_pedidos(definicao, request.args.get('fields'))
+        filtros = _filtros_api(definicao, request.args)
+        apos = int(request.args.get('apos', 0))
+        limite = min(max(int(request.args.get('limite', API_LIMITE_PADRAO)), 1), API_LIMITE_MAXIMO)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    # Uma linha a mais indica se existe próxima página
+    condicao = db.and_(modelo.id > apos, *filtros)
+    pagina = db.select(modelo.id.label('id'), _alteracao_api(modelo).label('alterado_em'))\
+               .where(condicao).order_by(modelo.id).limit(limite + 1).subquery()
+    quantidade, soma_ids, ultimo_id, ultima_alteracao = db.session.execute(
+        db.select(db.func.count(), db.func.sum(pagina.c.id), db.func.max(pagina.c.id),
+                  db.func.max(pagina.c.alterado_em))
+    ).one()
+    
+    resposta = _resposta_condicional_api(
+        (recurso, sorted(request.args.items(multi=True)), quantidade, soma_ids, ultimo_id, ultima_alteracao),
+        ultima_alteracao
+    )
+    if resposta.status_code == 304:
+        return resposta
+    
+    linhas = db.session.execute(
+        db.select(*[coluna.label(nome) for nome, coluna in campos.items()])
+          .where(condicao).order_by(modelo.id).limit(limite + 1)
+    ).all()
+    proximo = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        parametros = request.args.to_dict()
+        parametros['apos'] = linhas[-1].id
+        proximo = url_for('api_listar', recurso=recurso, **parametros)
+    
+    resposta.set_data(json.dumps({
+        'dados': [{nome: _valor_api(valor) for nome, valor in linha._mapping.items()} for linha in linhas],
+        'proximo': proximo,
+    }, ensure_ascii=False))
+    return resposta
+
+@app.route('/api/v1/<recurso>/<int:id>')
+@login_required
+def api_detalhar(recurso, id):
+    definicao = RECURSOS_API.get(recurso)
+    if not definicao:
+        return jsonify({'erro': f'Recurso desconhecido: {recurso}'}), 404
+    modelo = definicao['modelo']
+    try:
+        campos = _campos_pedidos(definicao, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    ultima_alteracao = db.session.execute(
+        db.select(_alteracao_api(modelo)).where(modelo.id == id)
+    ).first()
+    if not ultima_alteracao:
+        return jsonify({'erro': 'Registro não encontrado'}), 404
+    
+    resposta = _resposta_condicional_api((recurso, id, sorted(campos), ultima_alteracao[0]), ultima_alteracao[0])
+    if resposta.status_code == 304:
+        return resposta
+    
+    linha = db.session.execute(
+        db.select(*[coluna.label(nome) for nome, coluna in campos.items()]).where(modelo.id == id)
+    ).one()
+    resposta.set_data(json.dumps({nome: _valor_api(valor) for nome, valor in linha._mapping.items()},
+                                 ensure_ascii=False))
+    return resposta
+
 # ==================== CONTEXT PROCESSORS ====================
 
+def valor_preguicoso(chave, carregar):
+    """Cria um proxy que só executa carregar() quando o template lê o valor.
+    
+    O resultado fica guardado em g, então cada valor é buscado no máximo uma vez
+    por requisição, mesmo que vários templates (base, includes) o usem.
+    """
+    def obter():
+        cache = g.setdefault('_contexto_preguicoso', {})
+        if chave not in cache:
+            cache[chave] = carregar()
+        return cache[chave]
+    
+    return LocalProxy(obter)
+
+def _carregar_usuario_atual():
+    try:
+        return usuario_logado()
+    except:
+        return None
+
+def _carregar_estatistica_global(campo):
+    try:
+        return obter_estatisticas()[campo]
+    except:
+        return 0
+
 @app.context_processor
 def inject_user():
     """Injeta informações do usuário em todos os templates"""
-    usuario_atual = None
-    if 'user_id' in session:
-        try:
-            usuario_atual = Usuario.query.get(session['user_id'])
-        except:
-            pass
-    
-    return dict(usuario_atual=usuario_atual)
+    return dict(usuario_atual=valor_preguicoso('usuario_atual', _carregar_usuario_atual))
 
 @app.context_processor
 def inject_stats():
-    """Injeta estatísticas básicas em todos os templates"""
-    try:
-        stats = {
-            'total_pacientes_global': Paciente.query.count(),
-            'total_profissionais_global': Profissional.query.filter_by(ativo=True).count(),
-            'sistema_versao': '1.0.0'
-        }
-    except:
-        stats = {
-            'total_pacientes_global': 0,
-            'total_profissionais_global': 0,
-            'sistema_versao': '1.0.0'
-        }
-    
-    return dict(**stats)
+    """Injeta estatísticas básicas em todos os templates (avaliadas sob demanda)"""
+    return dict(
+        total_pacientes_global=valor_preguicoso(
+            'total_pacientes_global', lambda: _carregar_estatistica_global('total_pacientes')),
+        total_profissionais_global=valor_preguicoso(
+            'total_profissionais_global', lambda: _carregar_estatistica_global('total_profissionais')),
+        sistema_versao='1.0.0'
+    )
 
 # ==================== FILTROS JINJA PERSONALIZADOS ====================
 
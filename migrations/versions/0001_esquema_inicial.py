@@ -0,0 +1,135 @@
+"""esquema inicial
+
+Tabelas como eram criadas por db.create_all() antes das migrações. Bancos
+já existentes são marcados nesta revisão por criar_tabelas() antes do upgrade.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('usuario',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=80), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('senha_hash', sa.String(length=120), nullable=False),
+        sa.Column('tipo', sa.String(length=20), nullable=False),
+        sa.Column('ativo', sa.Boolean(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('paciente',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(length=100), nullable=False),
+        sa.Column('cpf', sa.String(length=14), nullable=False),
+        sa.Column('data_nascimento', sa.Date(), nullable=False),
+        sa.Column('telefone', sa.String(length=20), nullable=True),
+        sa.Column('gosto_musical', sa.String(length=100), nullable=True),
+        sa.Column('observacoes', sa.Text(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cpf')
+    )
+    op.create_table('procedimento',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(length=100), nullable=False),
+        sa.Column('valor', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('ativo', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('profissional',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(length=100), nullable=False),
+        sa.Column('especialidade', sa.String(length=100), nullable=True),
+        sa.Column('telefone', sa.String(length=20), nullable=True),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.Column('ativo', sa.Boolean(), nullable=True),
+        sa.Column('usuario_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('anamnese',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('paciente_id', sa.Integer(), nullable=False),
+        sa.Column('numero_identificador', sa.String(length=20), nullable=False),
+        sa.Column('conteudo', sa.Text(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.Column('atualizado_em', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('atendimento',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('paciente_id', sa.Integer(), nullable=False),
+        sa.Column('profissional_id', sa.Integer(), nullable=False),
+        sa.Column('data_atendimento', sa.Date(), nullable=False),
+        sa.Column('descricao', sa.Text(), nullable=True),
+        sa.Column('valor_total', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('desconto_valor', sa.Numeric(precision=10, scale=2), nullable=True),
+        sa.Column('desconto_percentual', sa.Numeric(precision=5, scale=2), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id'], ),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissional.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('agendamento',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('paciente_id', sa.Integer(), nullable=False),
+        sa.Column('profissional_id', sa.Integer(), nullable=False),
+        sa.Column('data_hora', sa.DateTime(), nullable=False),
+        sa.Column('observacoes', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id'], ),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissional.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('atendimento_procedimento',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('atendimento_id', sa.Integer(), nullable=False),
+        sa.Column('procedimento_id', sa.Integer(), nullable=False),
+        sa.Column('quantidade', sa.Integer(), nullable=True),
+        sa.Column('valor_unitario', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('valor_total', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['atendimento_id'], ['atendimento.id'], ),
+        sa.ForeignKeyConstraint(['procedimento_id'], ['procedimento.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('pagamento',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('atendimento_id', sa.Integer(), nullable=False),
+        sa.Column('valor', sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column('forma_pagamento', sa.String(length=50), nullable=False),
+        sa.Column('data_pagamento', sa.Date(), nullable=False),
+        sa.Column('observacoes', sa.Text(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['atendimento_id'], ['atendimento.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('pagamento')
+    op.drop_table('atendimento_procedimento')
+    op.drop_table('agendamento')
+    op.drop_table('atendimento')
+    op.drop_table('anamnese')
+    op.drop_table('profissional')
+    op.drop_table('procedimento')
+    op.drop_table('paciente')
+    op.drop_table('usuario')
@@ -0,0 +1,96 @@
+"""busca de pacientes e numeração de anamnese
+
+Adiciona o nome normalizado e o índice de palavras da busca de pacientes,
+a tabela de contadores e a unicidade de anamnese.numero_identificador
+(renumerando duplicatas geradas pelo antigo MAX(id) + 1 concorrente).
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def _renumerar_anamneses_duplicadas(conn):
+    anamnese = sa.table('anamnese', sa.column('id', sa.Integer), sa.column('numero_identificador', sa.String))
+    
+    proximo = conn.execute(sa.select(sa.func.coalesce(sa.func.max(anamnese.c.id), 0))).scalar()
+    duplicados = conn.execute(
+        sa.select(anamnese.c.numero_identificador)
+          .group_by(anamnese.c.numero_identificador)
+          .having(sa.func.count() > 1)
+    ).scalars().all()
+    
+    for numero in duplicados:
+        ids = conn.execute(
+            sa.select(anamnese.c.id)
+              .where(anamnese.c.numero_identificador == numero)
+              .order_by(anamnese.c.id)
+        ).scalars().all()
+        # Mantém o número na anamnese mais antiga
+        for id_anamnese in ids[1:]:
+            proximo += 1
+            conn.execute(
+                anamnese.update()
+                  .where(anamnese.c.id == id_anamnese)
+                  .values(numero_identificador=f"ANM{proximo:05d}")
+            )
+    
+    return proximo
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspetor = sa.inspect(conn)
+    tabelas = inspetor.get_table_names()
+    
+    # Bancos criados com db.create_all() em versões intermediárias já podem ter parte disto
+    colunas_paciente = [coluna['name'] for coluna in inspetor.get_columns('paciente')]
+    if 'nome_normalizado' not in colunas_paciente:
+        op.add_column('paciente', sa.Column('nome_normalizado', sa.String(length=100), nullable=True))
+        op.create_index('ix_paciente_nome_normalizado', 'paciente', ['nome_normalizado'])
+    
+    if 'paciente_busca_token' not in tabelas:
+        op.create_table('paciente_busca_token',
+            sa.Column('paciente_id', sa.Integer(), nullable=False),
+            sa.Column('token', sa.String(length=100), nullable=False),
+            sa.ForeignKeyConstraint(['paciente_id'], ['paciente.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('paciente_id', 'token')
+        )
+        op.create_index('ix_paciente_busca_token_token', 'paciente_busca_token', ['token', 'paciente_id'])
+    
+    if 'contador' not in tabelas:
+        op.create_table('contador',
+            sa.Column('nome', sa.String(length=50), nullable=False),
+            sa.Column('valor', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('nome')
+        )
+    
+    indices_anamnese = [indice['name'] for indice in inspetor.get_indexes('anamnese')]
+    if 'ix_anamnese_numero_identificador' not in indices_anamnese:
+        ultimo_numero = _renumerar_anamneses_duplicadas(conn)
+        
+        contador = sa.table('contador', sa.column('nome', sa.String), sa.column('valor', sa.Integer))
+        if conn.execute(sa.select(contador.c.nome).where(contador.c.nome == 'anamnese')).first() is None:
+            op.bulk_insert(contador, [{'nome': 'anamnese', 'valor': ultimo_numero}])
+        
+        op.create_index('ix_anamnese_numero_identificador', 'anamnese', ['numero_identificador'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_anamnese_numero_identificador', table_name='anamnese')
+    op.drop_table('contador')
+    op.drop_index('ix_paciente_busca_token_token', table_name='paciente_busca_token')
+    op.drop_table('paciente_busca_token')
+    op.drop_index('ix_paciente_nome_normalizado', table_name='paciente')
+    with op.batch_alter_table('paciente') as batch_op:
+        batch_op.drop_column('nome_normalizado')
@@ -0,0 +1,51 @@
+"""índices das consultas mais frequentes
+
+Índices compostos no formato dos filtros e ordenações das rotas: listagens
+paginadas por (data, id) e (nome, id), filtros por status, agenda do dia,
+verificação de disponibilidade por (profissional, data_hora, status) e
+buscas por chave estrangeira em pagamentos, anamneses e itens de atendimento.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+INDICES = [
+    ('ix_paciente_nome_id', 'paciente', ['nome', 'id']),
+    ('ix_anamnese_paciente_criado', 'anamnese', ['paciente_id', 'criado_em']),
+    ('ix_atendimento_data_id', 'atendimento', ['data_atendimento', 'id']),
+    ('ix_atendimento_status_data', 'atendimento', ['status', 'data_atendimento', 'id']),
+    ('ix_atendimento_paciente_data', 'atendimento', ['paciente_id', 'data_atendimento']),
+    ('ix_atendimento_profissional_data', 'atendimento', ['profissional_id', 'data_atendimento']),
+    ('ix_atendimento_criado_em', 'atendimento', ['criado_em']),
+    ('ix_atendimento_procedimento_atendimento', 'atendimento_procedimento', ['atendimento_id']),
+    ('ix_atendimento_procedimento_procedimento', 'atendimento_procedimento', ['procedimento_id']),
+    ('ix_agendamento_data_hora', 'agendamento', ['data_hora']),
+    ('ix_agendamento_profissional_data_status', 'agendamento', ['profissional_id', 'data_hora', 'status']),
+    ('ix_agendamento_paciente_data', 'agendamento', ['paciente_id', 'data_hora']),
+    ('ix_pagamento_atendimento', 'pagamento', ['atendimento_id']),
+    ('ix_pagamento_data', 'pagamento', ['data_pagamento']),
+]
+
+
+def upgrade():
+    inspetor = sa.inspect(op.get_bind())
+    for nome, tabela, colunas in INDICES:
+        if nome not in [indice['name'] for indice in inspetor.get_indexes(tabela)]:
+            op.create_index(nome, tabela, colunas)
+
+
+def downgrade():
+    for nome, tabela, colunas in reversed(INDICES):
+        op.drop_index(nome, table_name=tabela)
@@ -0,0 +1,39 @@
+"""total pago materializado no atendimento
+
+Adiciona atendimento.valor_pago e o preenche com a soma dos pagamentos
+existentes. A partir daqui é mantido por novo_pagamento na mesma transação
+do pagamento; 'flask reconciliar-pagamentos' recalcula em massa.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 09:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('atendimento', sa.Column('valor_pago', sa.Numeric(precision=10, scale=2), nullable=False, server_default='0'))
+    
+    atendimento = sa.table('atendimento', sa.column('id', sa.Integer), sa.column('valor_pago', sa.Numeric))
+    pagamento = sa.table('pagamento', sa.column('atendimento_id', sa.Integer), sa.column('valor', sa.Numeric))
+    op.execute(
+        atendimento.update().values(valor_pago=
+            sa.select(sa.func.coalesce(sa.func.sum(pagamento.c.valor), 0))
+              .where(pagamento.c.atendimento_id == atendimento.c.id)
+              .scalar_subquery()
+        )
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('atendimento') as batch_op:
+        batch_op.drop_column('valor_pago')
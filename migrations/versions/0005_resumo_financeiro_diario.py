@@ -0,0 +1,36 @@
+"""resumo financeiro diário
+
+Totais de pagamentos por dia, profissional e forma de pagamento para os
+dias fechados, usados pelo relatório financeiro. É preenchido sob demanda
+por consolidar_resumo_financeiro() ou 'flask consolidar-financeiro'.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 09:40:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('resumo_financeiro_diario',
+        sa.Column('data', sa.Date(), nullable=False),
+        sa.Column('profissional_id', sa.Integer(), nullable=False),
+        sa.Column('forma_pagamento', sa.String(length=50), nullable=False),
+        sa.Column('quantidade', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissional.id'], ),
+        sa.PrimaryKeyConstraint('data', 'profissional_id', 'forma_pagamento')
+    )
+
+
+def downgrade():
+    op.drop_table('resumo_financeiro_diario')
@@ -0,0 +1,48 @@
+"""resumo diário de procedimentos
+
+Quantidade, atendimentos e receita por dia, procedimento e profissional,
+mantidos por novo_atendimento e usados pelo relatório de procedimentos.
+Os itens já existentes são agregados aqui; depois disso o resumo pode ser
+refeito a qualquer momento com 'flask recalcular-procedimentos'.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 11:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('resumo_procedimento_diario',
+        sa.Column('data', sa.Date(), nullable=False),
+        sa.Column('procedimento_id', sa.Integer(), nullable=False),
+        sa.Column('profissional_id', sa.Integer(), nullable=False),
+        sa.Column('quantidade', sa.Integer(), nullable=False),
+        sa.Column('atendimentos', sa.Integer(), nullable=False),
+        sa.Column('receita', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['procedimento_id'], ['procedimento.id'], ),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissional.id'], ),
+        sa.PrimaryKeyConstraint('data', 'procedimento_id', 'profissional_id')
+    )
+
+    op.execute(
+        "INSERT INTO resumo_procedimento_diario "
+        "(data, procedimento_id, profissional_id, quantidade, atendimentos, receita) "
+        "SELECT a.data_atendimento, ap.procedimento_id, a.profissional_id, "
+        "SUM(COALESCE(ap.quantidade, 1)), COUNT(DISTINCT a.id), SUM(ap.valor_total) "
+        "FROM atendimento_procedimento ap JOIN atendimento a ON a.id = ap.atendimento_id "
+        "GROUP BY a.data_atendimento, ap.procedimento_id, a.profissional_id"
+    )
+
+
+def downgrade():
+    op.drop_table('resumo_procedimento_diario')
@@ -0,0 +1,40 @@
+"""atualizado_em nas tabelas alteráveis
+
+Marca d'água do backup incremental: 'flask backup --incremental' leva as
+linhas com criado_em/atualizado_em posteriores ao backup anterior. As linhas
+existentes recebem criado_em (ou o momento da migração, onde não há).
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 14:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+TABELAS_COM_CRIADO_EM = ['usuario', 'paciente', 'atendimento', 'agendamento']
+TABELAS_SEM_CRIADO_EM = ['profissional', 'procedimento']
+
+
+def upgrade():
+    for tabela in TABELAS_COM_CRIADO_EM + TABELAS_SEM_CRIADO_EM:
+        op.add_column(tabela, sa.Column('atualizado_em', sa.DateTime(), nullable=True))
+
+    for tabela in TABELAS_COM_CRIADO_EM:
+        op.execute(f"UPDATE {tabela} SET atualizado_em = COALESCE(criado_em, CURRENT_TIMESTAMP)")
+    for tabela in TABELAS_SEM_CRIADO_EM:
+        op.execute(f"UPDATE {tabela} SET atualizado_em = CURRENT_TIMESTAMP")
+
+
+def downgrade():
+    for tabela in TABELAS_COM_CRIADO_EM + TABELAS_SEM_CRIADO_EM:
+        with op.batch_alter_table(tabela) as batch_op:
+            batch_op.drop_column('atualizado_em')
@@ -0,0 +1,56 @@
+"""duração dos procedimentos e agendamentos
+
+Cada procedimento ganha uma duração padrão e cada agendamento passa a
+guardar procedimento, duração e horário de término, o que permite detectar
+sobreposição de horários e não apenas horários idênticos. Agendamentos já
+existentes ficam com 30 minutos.
+
+No PostgreSQL a restrição de exclusão (btree_gist) é criada na inicialização
+por configurar_agenda_sem_sobreposicao(), como o índice de trigramas.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 20:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('procedimento', sa.Column('duracao_minutos', sa.Integer(), nullable=False, server_default='30'))
+
+    with op.batch_alter_table('agendamento') as batch_op:
+        batch_op.add_column(sa.Column('procedimento_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('duracao_minutos', sa.Integer(), nullable=False, server_default='30'))
+        batch_op.add_column(sa.Column('data_hora_fim', sa.DateTime(), nullable=True))
+        batch_op.create_foreign_key('fk_agendamento_procedimento_id', 'procedimento', ['procedimento_id'], ['id'])
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("UPDATE agendamento SET data_hora_fim = data_hora + duracao_minutos * INTERVAL '1 minute'")
+    else:
+        op.execute("UPDATE agendamento SET data_hora_fim = "
+                   "strftime('%Y-%m-%d %H:%M:%S.000000', data_hora, '+' || duracao_minutos || ' minutes')")
+
+    with op.batch_alter_table('agendamento') as batch_op:
+        batch_op.alter_column('data_hora_fim', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE agendamento DROP CONSTRAINT IF EXISTS ex_agendamento_sem_sobreposicao')
+
+    with op.batch_alter_table('agendamento') as batch_op:
+        batch_op.drop_constraint('fk_agendamento_procedimento_id', type_='foreignkey')
+        batch_op.drop_column('data_hora_fim')
+        batch_op.drop_column('duracao_minutos')
+        batch_op.drop_column('procedimento_id')
+
+    op.drop_column('procedimento', 'duracao_minutos')
@@ -0,0 +1,37 @@
+"""séries de agendamentos recorrentes
+
+Pacotes de sessões (por exemplo, dez sessões quinzenais) viram uma série:
+as ocorrências compartilham serie_id, guardam a regra de recorrência e a
+ordem da sessão. O índice (serie_id, data_hora) atende ao cancelamento e à
+remarcação do restante da série em um único UPDATE.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 21:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('agendamento') as batch_op:
+        batch_op.add_column(sa.Column('serie_id', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('recorrencia', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('serie_ordem', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_agendamento_serie_data', ['serie_id', 'data_hora'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('agendamento') as batch_op:
+        batch_op.drop_index('ix_agendamento_serie_data')
+        batch_op.drop_column('serie_ordem')
+        batch_op.drop_column('recorrencia')
+        batch_op.drop_column('serie_id')
@@ -0,0 +1,32 @@
+"""hash de senha com até 255 caracteres
+
+O método do hash passou a ser configurável (SENHA_HASH_METODO) e os hashes
+são refeitos no login quando o custo muda. Métodos como scrypt geram textos
+maiores que os 120 caracteres originais.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 23:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('usuario') as batch_op:
+        batch_op.alter_column('senha_hash', existing_type=sa.String(length=120),
+                              type_=sa.String(length=255), existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('usuario') as batch_op:
+        batch_op.alter_column('senha_hash', existing_type=sa.String(length=255),
+                              type_=sa.String(length=120), existing_nullable=False)
@@ -0,0 +1,49 @@
+"""resumo diário por profissional
+
+O relatório de procedimentos agrupado por profissional somava a coluna
+atendimentos do resumo por procedimento, contando um atendimento com dois
+procedimentos duas vezes. Este resumo guarda cada atendimento uma única vez
+por dia e profissional, com o valor total cobrado (já com descontos).
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('resumo_profissional_diario',
+        sa.Column('data', sa.Date(), nullable=False),
+        sa.Column('profissional_id', sa.Integer(), nullable=False),
+        sa.Column('quantidade', sa.Integer(), nullable=False),
+        sa.Column('atendimentos', sa.Integer(), nullable=False),
+        sa.Column('receita', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['profissional_id'], ['profissional.id'], ),
+        sa.PrimaryKeyConstraint('data', 'profissional_id')
+    )
+
+    op.execute(
+        "INSERT INTO resumo_profissional_diario "
+        "(data, profissional_id, quantidade, atendimentos, receita) "
+        "SELECT a.data_atendimento, a.profissional_id, SUM(itens.quantidade), COUNT(*), "
+        "SUM(COALESCE(a.valor_total, 0)) "
+        "FROM atendimento a JOIN ("
+        "SELECT atendimento_id, SUM(COALESCE(quantidade, 1)) AS quantidade "
+        "FROM atendimento_procedimento GROUP BY atendimento_id"
+        ") itens ON itens.atendimento_id = a.id "
+        "GROUP BY a.data_atendimento, a.profissional_id"
+    )
+
+
+def downgrade():
+    op.drop_table('resumo_profissional_diario')
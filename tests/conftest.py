@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# O app lê DATABASE_URL na importação: usa um SQLite temporário em vez do PostgreSQL
+_banco = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_banco.close()
+os.environ['DATABASE_URL'] = 'sqlite:///' + _banco.name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacao  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    aplicacao.app.config['TESTING'] = True
+    with aplicacao.app.app_context():
+        aplicacao.db.create_all()
+        yield aplicacao.app
+        aplicacao.db.session.remove()
+        aplicacao.db.drop_all()
@@ -0,0 +1,54 @@
+import os
+from datetime import date
+
+import pytest
+
+from app import (Contador, Paciente, Usuario, criar_usuario_admin, db, executar_backup,
+                 restaurar_backup)
+
+
+def _banco_recem_criado():
+    """Como depois de `flask db upgrade` e `python app.py`: contador semeado e admin padrão"""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    db.session.add(Contador(nome='anamnese', valor=0))
+    db.session.commit()
+    criar_usuario_admin()
+
+
+@pytest.fixture
+def backup(app, tmp_path):
+    app.config['BACKUP_PATH'] = str(tmp_path)
+    criar_usuario_admin()
+    db.session.add(Usuario(username='recepcao', email='recepcao@clinica.com', senha_hash='x', tipo='recepcao'))
+    db.session.add(Paciente(nome='Ana Souza', cpf='52998224725', data_nascimento=date(1990, 1, 1)))
+    db.session.add(Contador(nome='anamnese', valor=7))
+    db.session.commit()
+    return os.path.join(str(tmp_path), executar_backup()['nome'])
+
+
+def test_restaura_em_banco_recem_criado(backup):
+    _banco_recem_criado()
+
+    restaurar_backup(backup)
+
+    assert db.session.execute(db.select(Paciente.nome)).scalars().all() == ['Ana Souza']
+    assert sorted(db.session.execute(db.select(Usuario.username)).scalars()) == ['admin', 'recepcao']
+    assert db.session.get(Contador, 'anamnese').valor == 7
+
+
+def test_recusa_banco_com_dados(backup):
+    _banco_recem_criado()
+    db.session.add(Paciente(nome='Bia Lima', cpf='11144477735', data_nascimento=date(1985, 5, 5)))
+    db.session.commit()
+
+    with pytest.raises(ValueError, match='não está vazio'):
+        restaurar_backup(backup)
+
+
+def test_comando_com_pasta_inexistente(app, tmp_path):
+    resultado = app.test_cli_runner().invoke(args=['restaurar-backup', str(tmp_path / 'nao-existe')])
+
+    assert resultado.exception is None
+    assert 'Backup não encontrado' in resultado.output
@@ -0,0 +1,29 @@
+import io
+
+from app import ler_planilha_pacientes
+
+
+def _csv_com_caractere_na_fronteira(nome):
+    """CSV UTF-8 em que o primeiro byte de 'ã' é o último do bloco de detecção (64 KiB)"""
+    cabecalho = 'Nome;CPF;Data de Nascimento\n'.encode()
+    linha = 'Maria Silva;52998224725;01/01/1990\n'.encode()
+    conteudo = cabecalho + linha * ((65536 - len(cabecalho)) // len(linha))
+    # Linha de comentário que empurra o nome até a fronteira
+    conteudo += b'#' * (65535 - len(conteudo) - len(nome.encode().split(b'\xc3')[0]) - 1) + b'\n'
+    conteudo += f'{nome};52998224725;01/01/1990\n'.encode()
+    assert conteudo[65535] == 0xc3
+    return conteudo
+
+
+def test_csv_utf8_com_caractere_cortado_no_bloco_de_deteccao():
+    nome = 'João Conceição'
+    linhas = dict(ler_planilha_pacientes(io.BytesIO(_csv_com_caractere_na_fronteira(nome)), 'pacientes.csv'))
+
+    assert linhas[max(linhas)]['nome'] == nome
+
+
+def test_csv_windows_1252():
+    conteudo = 'Nome;CPF;Data de Nascimento\nJoão Conceição;52998224725;01/01/1990\n'.encode('cp1252')
+    linhas = dict(ler_planilha_pacientes(io.BytesIO(conteudo), 'pacientes.csv'))
+
+    assert linhas[2]['nome'] == 'João Conceição'
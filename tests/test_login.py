@@ -0,0 +1,45 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+import app as aplicacao
+
+
+@pytest.mark.parametrize('metodo', ['pbkdf2', 'pbkdf2:sha512', 'pbkdf2:sha256:1000', 'scrypt', 'scrypt:16384:8:1'])
+def test_prefixo_hash_configurado_igual_ao_do_werkzeug(app, metodo, monkeypatch):
+    monkeypatch.setitem(app.config, 'SENHA_HASH_METODO', metodo)
+
+    assert not aplicacao.hash_desatualizado(generate_password_hash('x', method=metodo))
+    assert aplicacao.hash_desatualizado(generate_password_hash('x', method='pbkdf2:sha256:1'))
+
+
+def test_hash_desatualizado_nao_calcula_hash(app, monkeypatch):
+    def proibido(*args, **kwargs):
+        raise AssertionError('hash calculado na thread da requisição')
+    monkeypatch.setattr(aplicacao, 'generate_password_hash', proibido)
+
+    assert aplicacao.hash_desatualizado('pbkdf2:sha256:1$sal$abc')
+
+
+@pytest.fixture
+def login(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SENHA_HASH_METODO', 'pbkdf2:sha256:1')
+    monkeypatch.setitem(app.config, 'LOGIN_RAJADA_USUARIO_IP', 2)
+    monkeypatch.setitem(app.config, 'LOGIN_RAJADA_USUARIO', 4)
+    aplicacao.criar_usuario_admin()
+    for limite in (aplicacao.limite_login_ip, aplicacao.limite_login_usuario, aplicacao.limite_login_usuario_ip):
+        limite.limpar()
+
+    def tentar(senha, ip):
+        return app.test_client().post('/login', data={'username': 'admin', 'senha': senha},
+                                      environ_base={'REMOTE_ADDR': ip}).status_code
+    return tentar
+
+
+def test_falhas_do_mesmo_ip_nao_bloqueiam_outro_ip(login):
+    assert [login('errada', '198.51.100.1') for _ in range(3)] == [200, 200, 429]
+    assert login('admin123', '198.51.100.2') == 302
+
+
+def test_falhas_de_muitos_ips_bloqueiam_o_usuario(login):
+    assert [login('errada', f'192.0.2.{indice}') for indice in range(1, 6)] == [200, 200, 200, 200, 429]
+    assert login('admin123', '192.0.2.99') == 429
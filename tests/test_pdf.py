@@ -0,0 +1,52 @@
+import io
+import re
+import tracemalloc
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import app as aplicacao
+
+COLUNAS = [('Data', 12, None), ('Paciente', 40, None), ('Profissional', 30, None),
+           ('Status', 12, None), ('Valor Total', 14, 'moeda'), ('Descrição', 60, None)]
+
+
+def _linhas(quantidade):
+    for indice in range(quantidade):
+        yield (date(2024, 1, 1), f'Paciente {indice}', 'Dra. Ana', 'pago', Decimal('150.00'),
+               'Limpeza de pele' * (indice % 3 + 1))
+
+
+def _paginas(pdf):
+    return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+
+@pytest.mark.parametrize('quantidade', [0, 1, 25, 1000])
+def test_pdf_tem_todas_as_linhas_e_as_paginas_do_build(app, quantidade):
+    destino = io.BytesIO()
+    assert aplicacao.escrever_pdf(destino, 'Atendimentos', COLUNAS, _linhas(quantidade)) == quantidade
+
+    # Referência: o build do reportlab com os mesmos blocos numa lista comum
+    referencia = io.BytesIO()
+    documento = aplicacao._documento_pdf(referencia, 'Atendimentos', paisagem=True)
+    contagem = {'linhas': 0}
+    documento.build(list(aplicacao.blocos_pdf('Atendimentos', COLUNAS, _linhas(quantidade), documento.width, contagem)),
+                    onFirstPage=aplicacao._cabecalho_pdf, onLaterPages=aplicacao._cabecalho_pdf)
+
+    assert contagem['linhas'] == quantidade
+    assert _paginas(destino.getvalue()) == _paginas(referencia.getvalue())
+
+
+def test_pdf_grande_em_memoria_limitada(app):
+    tracemalloc.start()
+    try:
+        destino = io.BytesIO()
+        assert aplicacao.escrever_pdf(destino, 'Atendimentos', COLUNAS, _linhas(5000)) == 5000
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert _paginas(destino.getvalue()) > 100
+    # O PDF em si fica no BytesIO; as tabelas desenhadas não se acumulam
+    assert pico - len(destino.getvalue()) < 20 * 1024 * 1024